@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+"""
+パネルドライバを別プロセスで動かす表示ワーカー。
+
+GPIO/SPI で止まった inky.show() は同じプロセスからは中断できないので、
+ドライバは長寿命のワーカープロセスに閉じ込め、slideshow.py（親）が
+タイムアウト付きで監視する。止まったらワーカーだけを kill して作り直し、
+親のキュー・カウンタ・フレームはそのまま続ける。
+
+- フレーム (1600x1200 の P-mode index) は multiprocessing.shared_memory に置く。
+  親はそこへ直接デコード・描画し、パイプで送るのは短いコマンドと
+  パレット（最大 768 バイト）だけなので、フレームは pickle もコピーもしない
+- ワーカーはこのファイルをスクリプトとして起動する（親はログやボタンの
+  スレッドを持つので fork しない）。multiprocessing の spawn は子で親の
+  __main__（slideshow.py 全体）を import し直すので使わず、
+  socketpair の上の multiprocessing.connection.Connection でやりとりする
+- ドライバは "module:function" で指定した関数で作る（既定 inky.auto:auto）
+
+slideshow.py からは inky と同じく width / height / set_image() / show()
+を持つオブジェクトとして使える。
+"""
+
+import atexit
+import importlib
+import json
+import logging
+import mmap
+import signal
+import socket
+import subprocess
+import sys
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from panel_driver import (
+    PANEL_PALETTE_BYTES,
+    supports_direct_write,
+    write_indices,
+)
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FACTORY = "inky.auto:auto"
+
+WORKER_SCRIPT = Path(__file__).resolve()
+
+# POSIX 共有メモリの置き場所（Linux）
+SHM_DIR = Path("/dev/shm")
+
+
+class DisplayWorkerError(RuntimeError):
+    """ワーカーが応答しない・異常終了した、またはドライバが例外を出した。"""
+
+
+# ============================================================
+# Worker process
+# ============================================================
+
+def create_display(factory, factory_kwargs=None):
+    """
+    "module:function" からドライバを作る。
+
+    inky.auto:auto のように、inky 互換のオブジェクトを返す関数を指定する。
+    factory_kwargs（JSON にできる値）はそのまま引数で渡す。
+    """
+    module_name, _, func_name = factory.partition(":")
+
+    module = importlib.import_module(module_name)
+
+    return getattr(module, func_name)(**(factory_kwargs or {}))
+
+
+def attach_frame(shm_name, size):
+    """
+    親の共有メモリをフレームとして開く。
+
+    SharedMemory(name=...) で開くと、このプロセス用の resource_tracker が起動し、
+    ワーカーが kill されたときに親のセグメントを unlink してしまう。
+    POSIX 共有メモリは /dev/shm のファイルなので、そのまま mmap する。
+    """
+    width, height = size
+
+    with (SHM_DIR / shm_name).open("r+b") as f:
+        buffer = mmap.mmap(f.fileno(), width * height)
+
+    return np.ndarray(
+        (height, width),
+        dtype=np.uint8,
+        buffer=buffer,
+    )
+
+
+def describe_error(exc):
+    return f"{type(exc).__name__}: {exc}"
+
+
+def apply_frame(inky, image, palette):
+    """
+    共有メモリのフレームをドライバのバッファへ書く。
+
+    6色の純色パレットで EL133UF1 なら buf へ index を直接書き、
+    それ以外は set_image() に任せる（slideshow.FrameBuffer と同じ判断）。
+    """
+    if palette == PANEL_PALETTE_BYTES and supports_direct_write(inky):
+        write_indices(inky, np.asarray(image))
+
+        return "direct"
+
+    # frombuffer の画像は読み取り専用なので、putpalette() で1回だけ複製される
+    image.putpalette(palette)
+    inky.set_image(image)
+
+    return "set_image"
+
+
+def worker_main(conn, shm_name, size, factory, factory_kwargs=None):
+    """
+    ワーカープロセスの本体。
+
+    コマンド: ("set", palette) / ("show",) / ("stop",)
+    応答:     ("ok", 結果) / ("error", "型: メッセージ")
+    """
+    # Ctrl-C は親が受けて、stop を送ってくる
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    frame = attach_frame(shm_name, size)
+
+    try:
+        inky = create_display(factory, factory_kwargs)
+
+        if hasattr(inky, "set_border"):
+            inky.set_border(inky.WHITE)
+
+    except Exception as exc:
+        conn.send(("error", describe_error(exc)))
+        return
+
+    conn.send(
+        (
+            "ok",
+            {
+                "driver": type(inky).__name__,
+                "size": (inky.width, inky.height),
+            },
+        )
+    )
+
+    while True:
+        try:
+            command, *args = conn.recv()
+
+        except EOFError:
+            # 親が終了した
+            break
+
+        if command == "stop":
+            break
+
+        try:
+            if command == "set":
+                image = Image.frombuffer(
+                    "P",
+                    size,
+                    frame,
+                    "raw",
+                    "P",
+                    0,
+                    1,
+                )
+
+                result = apply_frame(inky, image, args[0])
+
+            elif command == "show":
+                inky.show()
+                result = None
+
+            else:
+                raise ValueError(f"Unknown command: {command}")
+
+            conn.send(("ok", result))
+
+        except Exception as exc:
+            conn.send(("error", describe_error(exc)))
+
+
+def worker_command(conn_fd, shm_name, size, factory, factory_kwargs):
+    """ワーカーを起動するコマンドライン。引数は main() が読む。"""
+    return [
+        sys.executable,
+        str(WORKER_SCRIPT),
+        str(conn_fd),
+        json.dumps(
+            {
+                "shm": shm_name,
+                "size": list(size),
+                "factory": factory,
+                "factory_kwargs": factory_kwargs or {},
+            }
+        ),
+    ]
+
+
+def main(argv=None):
+    conn_fd, spec = (sys.argv[1:] if argv is None else argv)
+    spec = json.loads(spec)
+
+    worker_main(
+        Connection(int(conn_fd)),
+        spec["shm"],
+        tuple(spec["size"]),
+        spec["factory"],
+        spec["factory_kwargs"],
+    )
+
+
+# ============================================================
+# Parent side
+# ============================================================
+
+class DisplayWorker:
+    """
+    ワーカープロセスと共有メモリのフレームを持ち、
+    inky と同じ形で set_image() / show() を提供する。
+
+    - 応答がタイムアウトしたり、ワーカーが落ちたりしたら、
+      ワーカーを kill して作り直してから DisplayWorkerError を出す
+    - ドライバの例外（ワーカーは生きている）はそのまま DisplayWorkerError にする
+    - frame_buffer は共有メモリそのもの。FrameBuffer に渡すと、
+      デコードとオーバーレイが最初からワーカーの見るメモリに入る
+
+    パネル専用の1スレッドから使う前提で、ロックは持たない。
+    """
+
+    def __init__(
+        self,
+        size=(1600, 1200),
+        factory=DEFAULT_FACTORY,
+        factory_kwargs=None,
+        init_timeout=120.0,
+        command_timeout=30.0,
+        show_timeout=180.0,
+    ):
+        self.width, self.height = size
+        self.factory = factory
+        self.factory_kwargs = factory_kwargs
+
+        self.init_timeout = init_timeout
+        self.command_timeout = command_timeout
+        self.show_timeout = show_timeout
+
+        self.shm = shared_memory.SharedMemory(
+            create=True,
+            size=self.width * self.height,
+        )
+
+        self.frame_buffer = self.shm.buf
+
+        self.array = np.ndarray(
+            (self.height, self.width),
+            dtype=np.uint8,
+            buffer=self.frame_buffer,
+        )
+
+        self.process = None
+        self.conn = None
+
+        self.driver = None
+        self.restarts = 0
+
+        atexit.register(self.close)
+
+        try:
+            self.start()
+
+        except Exception:
+            # initialize_display() が作り直すので、共有メモリを残さない
+            self.close()
+            raise
+
+    # ---------- process ----------
+
+    def start(self):
+        parent_sock, child_sock = socket.socketpair()
+
+        started = time.monotonic()
+
+        try:
+            self.process = subprocess.Popen(
+                worker_command(
+                    child_sock.fileno(),
+                    self.shm.name,
+                    (self.width, self.height),
+                    self.factory,
+                    self.factory_kwargs,
+                ),
+                pass_fds=(child_sock.fileno(),),
+                stdin=subprocess.DEVNULL,
+            )
+
+        except Exception:
+            parent_sock.close()
+            raise
+
+        finally:
+            child_sock.close()
+
+        self.conn = Connection(parent_sock.detach())
+
+        info = self._receive(
+            self.init_timeout,
+            "init",
+        )
+
+        if tuple(info["size"]) != (self.width, self.height):
+            self.stop()
+
+            raise DisplayWorkerError(
+                f"Unexpected display resolution: "
+                f"{info['size'][0]}x{info['size'][1]}"
+            )
+
+        self.driver = info["driver"]
+
+        logger.info(
+            "Display worker ready: %s / pid=%d (%.1fs)",
+            self.driver,
+            self.process.pid,
+            time.monotonic() - started,
+        )
+
+    def wait(self, timeout):
+        """ワーカーの終了を待つ。返り値: 終了コード（まだ動いていれば None）"""
+        try:
+            return self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            return None
+
+    def kill(self):
+        if self.process is not None:
+            self.process.kill()
+            self.wait(5)
+
+        if self.conn is not None:
+            self.conn.close()
+
+        self.process = None
+        self.conn = None
+
+    def stop(self):
+        if self.process is None:
+            return
+
+        try:
+            if self.conn is not None:
+                self.conn.send(("stop",))
+                self.wait(5)
+
+        except (OSError, ValueError):
+            pass
+
+        self.kill()
+
+    def close(self):
+        self.stop()
+
+        if self.shm is None:
+            return
+
+        # 自分の持つ view を先に手放す。FrameBuffer などがまだ
+        # frame_buffer の view を持っていると close() できないが、
+        # unlink() だけで /dev/shm からは消える。
+        self.array = None
+        self.frame_buffer = None
+
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+
+        self.shm.unlink()
+        self.shm = None
+
+    def restart(self, reason):
+        self.restarts += 1
+
+        logger.error(
+            "Display worker %s; killing pid %s and restarting (#%d)",
+            reason,
+            self.process.pid if self.process else "-",
+            self.restarts,
+        )
+
+        self.kill()
+
+        try:
+            self.start()
+
+        except Exception:
+            logger.exception(
+                "Display worker restart failed; "
+                "retrying on the next command"
+            )
+            self.kill()
+
+    # ---------- commands ----------
+
+    def _receive(self, timeout, what):
+        if not self.conn.poll(timeout):
+            message = f"{what} timed out after {timeout:.0f}s"
+
+            if what == "init":
+                self.kill()
+                raise DisplayWorkerError(message)
+
+            self.restart(message)
+            raise DisplayWorkerError(message)
+
+        try:
+            status, payload = self.conn.recv()
+
+        except (EOFError, OSError):
+            message = f"exited during {what} (code {self.wait(1)})"
+
+            if what == "init":
+                self.kill()
+                raise DisplayWorkerError(message)
+
+            self.restart(message)
+            raise DisplayWorkerError(message)
+
+        if status == "error":
+            if what == "init":
+                self.kill()
+
+            raise DisplayWorkerError(f"{what} failed: {payload}")
+
+        return payload
+
+    def _request(self, command, timeout):
+        if self.process is None:
+            # 前回の作り直しに失敗していたら、ここでもう一度
+            self.start()
+
+        try:
+            self.conn.send(command)
+
+        except OSError:
+            message = f"pipe closed before {command[0]}"
+            self.restart(message)
+            raise DisplayWorkerError(message)
+
+        return self._receive(timeout, command[0])
+
+    def set_frame(self, palette):
+        """
+        frame_buffer にあるフレームを、パネルのバッファへ書かせる。
+
+        返り値: ワーカー側の書き込み方法（"direct" / "set_image"）
+        """
+        return self._request(
+            ("set", bytes(palette)),
+            self.command_timeout,
+        )
+
+    def set_image(self, image):
+        """frame_buffer 以外の P-mode 画像は、index を共有メモリへ写してから送る。"""
+        if image.mode != "P":
+            raise ValueError(
+                f"Display worker expects a P-mode image, got {image.mode}"
+            )
+
+        np.copyto(
+            self.array,
+            np.asarray(image),
+        )
+
+        return self.set_frame(image.getpalette())
+
+    def show(self):
+        self._request(
+            ("show",),
+            self.show_timeout,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -36,12 +36,17 @@ LOG_FILE = os.path.join(LOG_DIR, "throttled_monitor.log")
 STATE_DIR = os.path.expanduser("~/.cache")
 STATE_FILE = os.path.join(STATE_DIR, "throttled_state.json")
 
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# supervisor.py からも同じ logger 名で throttled_monitor.log へ書く
+logger = logging.getLogger("throttled")
+
 
 def setup_logging():
     os.makedirs(LOG_DIR, exist_ok=True)
     logging.basicConfig(
         level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(message)s",
+        format=LOG_FORMAT,
         handlers=[
             logging.FileHandler(LOG_FILE),
             logging.StreamHandler()
@@ -59,7 +64,7 @@ def run_vcgencmd_get_throttled():
             check=True,
         )
         output = result.stdout.strip()
-        logging.info(f"vcgencmd output: {output}")
+        logger.info(f"vcgencmd output: {output}")
 
         if "=" not in output:
             raise ValueError("Unexpected vcgencmd output format")
@@ -75,7 +80,7 @@ def run_vcgencmd_get_throttled():
         return value, output
 
     except Exception as e:
-        logging.error(f"vcgencmd get_throttled error: {e}")
+        logger.error(f"vcgencmd get_throttled error: {e}")
         return None, None
 
 
@@ -105,7 +110,7 @@ def load_previous_state():
             state = json.load(f)
         return state
     except Exception as e:
-        logging.warning(f"state load error: {e}")
+        logger.warning(f"state load error: {e}")
         return None
 
 
@@ -119,14 +124,14 @@ def save_state(value, flags):
         with open(STATE_FILE, "w") as f:
             json.dump(state, f, indent=2)
     except Exception as e:
-        logging.error(f"state save error: {e}")
+        logger.error(f"state save error: {e}")
 
 
 def send_ntfy(title: str, message: str, tags=None, priority=None):
     """ntfy.sh に通知を送信する（タイトルは英語のみ）"""
     if not NTFY_URL:
         # URL が設定されていない場合は、何も送らずログだけ残す
-        logging.warning(
+        logger.warning(
             "NTFY_THROTTLED_URL が .env に設定されていないため、通知をスキップします。"
         )
         return
@@ -141,9 +146,9 @@ def send_ntfy(title: str, message: str, tags=None, priority=None):
     req = request.Request(NTFY_URL, data=data, headers=headers, method="POST")
     try:
         with request.urlopen(req, timeout=10) as resp:
-            logging.info(f"ntfy sent: HTTP {resp.status}")
+            logger.info(f"ntfy sent: HTTP {resp.status}")
     except urlerror.URLError as e:
-        logging.error(f"ntfy send error: {e}")
+        logger.error(f"ntfy send error: {e}")
 
 
 def describe_flags(flags):
@@ -186,30 +191,35 @@ def describe_flags(flags):
     return "\n".join(message)
 
 
-def main():
-    setup_logging()
-    logging.info("===== throttled monitor start =====")
+def check_throttled(notify=send_ntfy):
+    """
+    1回分のチェック。supervisor.py からも呼ばれる。
+
+    notify は send_ntfy と同じ引数 (title, message, tags, priority) を取る関数。
+    返り値: 取得した値（vcgencmd が失敗したら None）
+    """
+    logger.info("===== throttled monitor start =====")
 
     value, raw_output = run_vcgencmd_get_throttled()
     if value is None:
-        logging.error("vcgencmd failed; aborting")
-        return
+        logger.error("vcgencmd failed; aborting")
+        return None
 
     flags = decode_flags(value)
     prev = load_previous_state()
 
-    logging.info(f"value=0x{value:X}")
-    logging.info(f"flags={flags}")
+    logger.info(f"value=0x{value:X}")
+    logger.info(f"flags={flags}")
 
     # 初回は必ず通知
     if prev is None:
         title = f"[{HOSTNAME}] throttled initial"
         body = f"raw: {raw_output}\n\n" + describe_flags(flags)
-        send_ntfy(title, body, tags=["raspi", "throttle"], priority=3)
+        notify(title, body, tags=["raspi", "throttle"], priority=3)
         save_state(value, flags)
-        logging.info("初回通知完了")
-        logging.info("===== throttled monitor end =====")
-        return
+        logger.info("初回通知完了")
+        logger.info("===== throttled monitor end =====")
+        return value
 
     # 状態変化チェック
     prev_value = prev.get("value")
@@ -222,11 +232,18 @@ def main():
             f"raw: {raw_output}\n\n"
             + describe_flags(flags)
         )
-        send_ntfy(title, body, tags=["raspi", "throttle", "change"], priority=4)
-        logging.info("状態変化 → ntfy 通知送信")
+        notify(title, body, tags=["raspi", "throttle", "change"], priority=4)
+        logger.info("状態変化 → ntfy 通知送信")
 
     save_state(value, flags)
-    logging.info("===== throttled monitor end =====")
+    logger.info("===== throttled monitor end =====")
+
+    return value
+
+
+def main():
+    setup_logging()
+    check_throttled()
 
 
 if __name__ == "__main__":
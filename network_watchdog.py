@@ -52,7 +52,7 @@ def send_ntfy(title: str, message: str, tags=None, priority: int = 3):
         log(f"ntfy error: {e}")
 
 
-def ping_host(host: str, count: int = 3, timeout: int = 2) -> bool:
+def ping_host(host: str, count: int = 3, timeout: int = 2, log=log) -> bool:
     try:
         result = subprocess.run(
             ["ping", "-c", str(count), "-W", str(timeout), host],
@@ -66,7 +66,7 @@ def ping_host(host: str, count: int = 3, timeout: int = 2) -> bool:
         return False
 
 
-def restart_wifi():
+def restart_wifi(log=log):
     # NetworkManager 前提。違っていたらここだけ調整。
     cmds = [
         ["nmcli", "device", "disconnect", "wlan0"],
@@ -80,29 +80,34 @@ def restart_wifi():
             log(f"コマンド失敗: {cmd} -> {e}")
 
 
-def main():
+def check_network(log=log, notify=send_ntfy):
+    """
+    1回分のチェック。supervisor.py からも呼ばれる（log と notify を差し替える）。
+
+    返り値: 最終的に ping が通ったか
+    """
     log("===== network watchdog start =====")
 
-    if ping_host(GATEWAY_IP):
+    if ping_host(GATEWAY_IP, log=log):
         log(f"ping OK: {GATEWAY_IP}")
-        return
+        return True
 
     log(f"ping NG: {GATEWAY_IP}。Wi-Fi 再接続を試みます。")
-    restart_wifi()
+    restart_wifi(log)
     time.sleep(10)
 
-    if ping_host(GATEWAY_IP):
+    if ping_host(GATEWAY_IP, log=log):
         log("再接続後の ping は成功しました。")
-        send_ntfy(
+        notify(
             "Raspberry Pi Wi-Fi 再接続",
             "network_watchdog が Wi-Fi を再接続しました。（ping 復旧）",
             tags=["raspi", "network"],
             priority=3,
         )
-        return
+        return True
 
     log("再接続後も ping に失敗しました。")
-    send_ntfy(
+    notify(
         "Raspberry Pi ネットワーク障害",
         "network_watchdog で Wi-Fi 再接続を試みましたが復旧しませんでした。",
         tags=["raspi", "network", "error"],
@@ -113,6 +118,12 @@ def main():
     # log("システム再起動を試みます...")
     # subprocess.run(["/usr/bin/systemctl", "reboot", "-i"], check=False)
 
+    return False
+
+
+def main():
+    check_network()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,199 @@
+"""
+パネルドライバの作成と、EL133UF1 のバッファへの書き込み。
+
+slideshow.py と表示ワーカー（display_worker.py）の両方が import する。
+ワーカーは kill のたびに作り直すので、ここは標準ライブラリだけに頼り、
+.env などの設定も読まない（設定は引数で受け取る）。
+numpy はバッファへ書くときに import する（slideshow.py の起動を軽くするため）。
+"""
+
+import importlib
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+DISPLAY_MODEL_FILE = Path.home() / ".cache" / "slideshow_display_model_133.json"
+
+
+# ============================================================
+# Driver
+# ============================================================
+
+def load_display_model(cache_file=None):
+    cache_file = Path(cache_file or DISPLAY_MODEL_FILE)
+
+    try:
+        with cache_file.open(
+            "r",
+            encoding="utf-8",
+        ) as f:
+            model = json.load(f)
+
+        return {
+            "module": str(model["module"]),
+            "class": str(model["class"]),
+            "resolution": tuple(int(v) for v in model["resolution"]),
+        }
+
+    except Exception:
+        return None
+
+
+def save_display_model(inky, cache_file=None):
+    cache_file = Path(cache_file or DISPLAY_MODEL_FILE)
+
+    try:
+        cache_file.parent.mkdir(
+            parents=True,
+            exist_ok=True,
+        )
+
+        tmp_file = cache_file.with_suffix(".tmp")
+
+        tmp_file.write_text(
+            json.dumps(
+                {
+                    "module": type(inky).__module__,
+                    "class": type(inky).__name__,
+                    "resolution": [inky.width, inky.height],
+                    "detected_at": datetime.now().isoformat(
+                        timespec="seconds"
+                    ),
+                },
+                indent=2,
+            )
+        )
+
+        os.replace(tmp_file, cache_file)
+
+    except Exception as exc:
+        logger.warning(
+            "Failed to save display model: %s",
+            exc,
+        )
+
+
+def forget_display_model(cache_file=None):
+    """返り値: 消すキャッシュがあったら True"""
+    try:
+        Path(cache_file or DISPLAY_MODEL_FILE).unlink()
+        return True
+
+    except FileNotFoundError:
+        return False
+
+
+def open_display(
+    import_module=importlib.import_module,
+    cache_file=None,
+    use_cache=True,
+):
+    """
+    パネルのドライバを作る。
+
+    前回 inky.auto で検出したモジュール・クラス・解像度が保存されていれば、
+    EEPROM を I2C で読まずに InkyEL133UF1(resolution=(1600, 1200)) のように
+    直接作る。直接作れなかったら inky.auto で検出し直して保存し直す。
+
+    import_module はテスト用に差し替えられる（偽のドライバモジュールを返す）。
+    表示ワーカーのプロセスからも "panel_driver:open_display" として呼ばれる。
+    """
+    model = load_display_model(cache_file) if use_cache else None
+
+    if model is not None:
+        try:
+            module = import_module(model["module"])
+            driver_class = getattr(module, model["class"])
+
+            inky = driver_class(
+                resolution=model["resolution"],
+            )
+
+            if (inky.width, inky.height) != model["resolution"]:
+                raise ValueError(
+                    f"driver reports {inky.width}x{inky.height}"
+                )
+
+            logger.info(
+                "Display constructed from cached model: %s.%s %dx%d",
+                model["module"],
+                model["class"],
+                *model["resolution"],
+            )
+
+            return inky
+
+        except Exception as exc:
+            logger.warning(
+                "Cached display model failed (%s: %s); "
+                "probing with inky.auto",
+                type(exc).__name__,
+                exc,
+            )
+
+    auto = import_module("inky.auto").auto
+
+    inky = auto(verbose=True)
+
+    if use_cache:
+        save_display_model(inky, cache_file)
+
+    return inky
+
+
+# ============================================================
+# Panel buffer
+# ============================================================
+
+# preprocess_photos.py が書き出す6色の純色パレット
+# (BLACK, WHITE, YELLOW, RED, BLUE, GREEN)
+PANEL_PALETTE_BYTES = bytes(
+    (
+        0, 0, 0,
+        255, 255, 255,
+        255, 255, 0,
+        255, 0, 0,
+        0, 0, 255,
+        0, 255, 0,
+    )
+)
+
+# パレット index -> EL133UF1 のネイティブ色番号（4 は欠番）。
+# inky.set_image() の remap と同じ。範囲外は白にする。
+PANEL_REMAP = bytes((0, 1, 2, 3, 5, 6)) + bytes((1,)) * 250
+
+
+def supports_direct_write(inky_display):
+    """
+    inky_el133uf1 の buf は (rows, cols) = (1200, 1600) の uint8 で、
+    show() がそこから SPI 用に詰め直す。それ以外のドライバは set_image() に任せる。
+    """
+    import numpy as np
+
+    buf = getattr(inky_display, "buf", None)
+
+    return (
+        type(inky_display).__module__.endswith("inky_el133uf1")
+        and isinstance(buf, np.ndarray)
+        and buf.dtype == np.uint8
+        and buf.shape == (
+            inky_display.height,
+            inky_display.width,
+        )
+    )
+
+
+def write_indices(inky_display, indices):
+    """パレット index の配列を、色番号にしてドライバの buf へ直接書く。"""
+    import numpy as np
+
+    np.take(
+        np.frombuffer(PANEL_REMAP, dtype=np.uint8),
+        indices,
+        out=inky_display.buf,
+    )
@@ -1,71 +1,2172 @@
 #!/usr/bin/env python3
-from PIL import Image
-import piexif
+"""
+Spectra 6 向け前処理パイプライン
+
+photos_raw/ の元画像から、slideshow.py がそのまま表示できる
+1600x1200 の P-mode PNG と photos/metadata.json を生成する。
+
+処理の流れ:
+- EXIF の向きを反映してから中央トリミング・リサイズ
+  （--low-memory では JPEG の縮小デコードと段階縮小で省メモリ化）
+- ガンマ・ハイライト圧縮・彩度のトーン補正（1つの LUT + 1つの行列に合成）
+- Spectra 6 の6色パレットへ量子化（ディザあり/なし）
+- inky の色順 (BLACK, WHITE, YELLOW, RED, BLUE, GREEN) の
+  6色パレットを持つ P-mode PNG として保存
+- capture_date / display_mode を metadata.json にマージ
+
+6色ちょうどのパレットを持つ P-mode 画像は、inky.set_image() 側で
+再ディザされずにそのままパネルへ送られる。
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import multiprocessing
 import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps, PngImagePlugin
+from dotenv import load_dotenv
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+load_dotenv(BASE_DIR / ".env")
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-RAW_DIR = os.path.join(BASE_DIR, "photos_raw")
-OUT_DIR = os.path.join(BASE_DIR, "photos")
+
+# ============================================================
+# Paths / configuration
+# ============================================================
+
+RAW_DIR = Path(
+    os.getenv(
+        "RAW_PHOTO_DIR",
+        str(BASE_DIR / "photos_raw"),
+    )
+)
+
+OUT_DIR = Path(
+    os.getenv(
+        "PHOTO_DIR",
+        str(BASE_DIR / "photos" / "auto"),
+    )
+)
+
+METADATA_FILE = Path(
+    os.getenv(
+        "METADATA_FILE",
+        str(BASE_DIR / "photos" / "metadata.json"),
+    )
+)
 
 TARGET_SIZE = (1600, 1200)  # (width, height)
 
-os.makedirs(OUT_DIR, exist_ok=True)
+SOURCE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+CONFIG = {
+    # トーンカーブ。TONE_ORDER の順に合成して 256 エントリの LUT 1つにする。
+    "TONE_ORDER": os.getenv("PREPROCESS_TONE_ORDER", "gamma,highlight"),
+
+    "GAMMA": float(os.getenv("PREPROCESS_GAMMA", "1.0")),
+
+    # この値より明るい領域だけを圧縮する（255 なら無効）
+    "HIGHLIGHT_KNEE": int(os.getenv("PREPROCESS_HIGHLIGHT_KNEE", "255")),
+
+    # 大きいほどハイライト圧縮が強くなる
+    "HIGHLIGHT_STRENGTH": float(
+        os.getenv("PREPROCESS_HIGHLIGHT_STRENGTH", "0")
+    ),
+
+    # 画像そのものの彩度（1.0 で無変更）。量子化パレットの SATURATION とは別。
+    "TONE_SATURATION": float(os.getenv("PREPROCESS_TONE_SATURATION", "1.0")),
+
+    # inky.set_image(saturation=...) と同じ意味。
+    # 量子化の際に「パネル実発色」と「純色」をどれだけ混ぜるか。
+    "SATURATION": float(os.getenv("PREPROCESS_SATURATION", "0.5")),
+
+    "DITHER": os.getenv("PREPROCESS_DITHER", "floyd-steinberg"),
+
+    "DISPLAY_MODE": os.getenv("PREPROCESS_DISPLAY_MODE", "color"),
+
+    # 最近傍色を決める距離: rgb / weighted / lab
+    "METRIC": os.getenv("PREPROCESS_METRIC", "rgb"),
+
+    # 3D LUT の1軸あたりのビット数 (6 → 64^3)
+    "LUT_BITS": int(os.getenv("PREPROCESS_LUT_BITS", "6")),
+
+    # 中間結果キャッシュ（デコード+トリミング / トーン補正後 / 量子化後）
+    "CACHE_DIR": os.getenv(
+        "PREPROCESS_CACHE_DIR",
+        str(Path.home() / ".cache" / "inky_renditions"),
+    ),
+
+    # キャッシュ全体の上限 (MB)。0 ならキャッシュしない。
+    "CACHE_MB": int(os.getenv("PREPROCESS_CACHE_MB", "2048")),
+
+    # floyd-steinberg-parallel のワーカープロセス数
+    # （--jobs との積が CPU 数を超える場合は自動で減らす）
+    "DITHER_WORKERS": int(os.getenv("PREPROCESS_DITHER_WORKERS", "0"))
+    or min(4, os.cpu_count() or 1),
+
+    "JOBS": int(os.getenv("PREPROCESS_JOBS", "0")) or os.cpu_count() or 1,
+
+    # Zero 2 W 上で slideshow と同居して変換するためのモード
+    "LOW_MEMORY": os.getenv("PREPROCESS_LOW_MEMORY", "0") == "1",
+
+    # 1プロセスあたりのピーク RSS 上限 (MB)。0 なら無制限。
+    "MAX_RSS_MB": int(os.getenv("PREPROCESS_MAX_RSS_MB", "0")),
+}
+
+DITHER_MODES = (
+    "floyd-steinberg",
+    "floyd-steinberg-parallel",
+    "bayer",
+    "blue-noise",
+    "none",
+)
+
+DISPLAY_MODES = (
+    "color",
+    "monochrome",
+)
+
+DISTANCE_METRICS = (
+    "rgb",
+    "weighted",
+    "lab",
+)
+
+LUT_CACHE_DIR = Path.home() / ".cache" / "spectra_lut"
+
+
+# ============================================================
+# Spectra 6 palette
+# ============================================================
+
+# inky_el133uf1 と同じ色順・同じ値。
+# index 0 = BLACK, 1 = WHITE は slideshow.py のオーバーレイでも使う。
+DESATURATED_PALETTE = [
+    (0, 0, 0),
+    (255, 255, 255),
+    (255, 255, 0),
+    (255, 0, 0),
+    (0, 0, 255),
+    (0, 255, 0),
+]
+
+SATURATED_PALETTE = [
+    (0, 0, 0),
+    (161, 164, 165),
+    (208, 190, 71),
+    (156, 72, 75),
+    (61, 59, 94),
+    (58, 91, 70),
+]
+
+# display_mode ごとに量子化で使ってよいパレット index
+MODE_PALETTE_INDICES = {
+    "color": (0, 1, 2, 3, 4, 5),
+    "monochrome": (0, 1),
+}
+
+
+def blend_palette(saturation):
+    """
+    inky の _palette_blend() と同じ計算で、
+    量子化用のパレット (N, 3) を返す。
+    """
+    saturated = np.array(SATURATED_PALETTE, dtype=np.float64)
+    desaturated = np.array(DESATURATED_PALETTE, dtype=np.float64)
+
+    blended = (
+        saturated * saturation
+        + desaturated * (1.0 - saturation)
+    )
+
+    return blended.astype(np.uint8)
+
+
+def output_palette_bytes():
+    """保存する PNG に書き込む6色の純色パレット。"""
+    return bytes(
+        value
+        for rgb in DESATURATED_PALETTE
+        for value in rgb
+    )
+
+
+# ============================================================
+# Decode / crop
+# ============================================================
+
+def read_capture_date(img):
+    """
+    EXIF の DateTimeOriginal、なければ DateTime を返す。
+
+    slideshow.parse_capture_date() が読める
+    "YYYY:MM:DD HH:MM:SS" 形式のまま保存する。
+    """
+    try:
+        exif = img.getexif()
+    except Exception:
+        return None
+
+    value = exif.get_ifd(0x8769).get(36867) or exif.get(306)
+
+    if not value:
+        return None
+
+    return str(value).strip("\x00 ")
+
+
+def crop_to_target(img, target_size=TARGET_SIZE):
+    """アスペクト比を維持して縮小し、中央でトリミングする。"""
+    w, h = img.size
+    tw, th = target_size
+    img_ratio = w / h
+    target_ratio = tw / th
+
+    if img_ratio > target_ratio:
+        # 横長 → 高さに合わせて縮小
+        new_height = th
+        new_width = max(tw, round(th * img_ratio))
+    else:
+        # 縦長 → 幅に合わせて縮小
+        new_width = tw
+        new_height = max(th, round(tw / img_ratio))
+
+    img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+
+    left = (new_width - tw) // 2
+    top = (new_height - th) // 2
+
+    return img.crop((left, top, left + tw, top + th))
+
+
+class MemoryBudgetError(RuntimeError):
+    """デコードに必要なメモリがピーク RSS 上限を超える。"""
+
+
+# EXIF Orientation 5-8 は 90/270 度回転なので、縦横が入れ替わる
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+# 量子化・保存まで含めた、デコード後バッファ以外の概算メモリ
+PIPELINE_OVERHEAD_BYTES = TARGET_SIZE[0] * TARGET_SIZE[1] * 12
+
 
+def read_proc_status_kb(field):
+    """/proc/self/status の VmRSS / VmHWM などを kB で返す。"""
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
 
-def process_one(path_in, path_out):
+    return 0
+
+
+def reset_peak_rss():
+    """
+    VmHWM（ピーク RSS）を現在値にリセットする。
+
+    1画像ごとのピークを測るため、プールのワーカーでも
+    画像の処理前に呼ぶ。
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def cover_size(size, target_size=TARGET_SIZE):
+    """target_size を覆う最小の縮小後サイズ (w, h)。"""
+    w, h = size
+    tw, th = target_size
+    scale = max(tw / w, th / h)
+
+    return (
+        max(tw, math.ceil(w * scale)),
+        max(th, math.ceil(h * scale)),
+    )
+
+
+def decode_estimate_bytes(img):
+    """draft() 後の img をデコードし、保存まで進めたときの概算ピーク RSS。"""
+    bands = len(img.getbands())
+    decoded_bytes = img.size[0] * img.size[1] * max(3, bands)
+
+    return (
+        read_proc_status_kb("VmRSS") * 1024
+        + decoded_bytes
+        + PIPELINE_OVERHEAD_BYTES
+    )
+
+
+def fit_draft_request(path_in, request, max_rss_mb):
+    """
+    見積もりが max_rss_mb に収まる draft() の要求サイズを返す。
+
+    ターゲットを覆うサイズで収まらなければ、要求を 1/2・1/4・1/8 にして
+    DCT の縮小率を上げる（最後の LANCZOS で拡大するので画質は落ちる）。
+    draft() は最初の1回しか効かないので、試すたびに開き直す。
+    どの縮小率でも収まらなければ MemoryBudgetError。
+    """
+    budget = max_rss_mb * 1024 * 1024
+
+    for shrink in (1, 2, 4, 8):
+        candidate = (
+            max(1, request[0] // shrink),
+            max(1, request[1] // shrink),
+        )
+
+        with Image.open(path_in) as probe:
+            probe.draft("RGB", candidate)
+            estimate = decode_estimate_bytes(probe)
+            size = probe.size
+
+        if estimate <= budget:
+            if shrink > 1:
+                print(
+                    f"WARN: {Path(path_in).name}: decoding at "
+                    f"{size[0]}x{size[1]} to stay within "
+                    f"{max_rss_mb} MB (upscaled afterwards)",
+                    file=sys.stderr,
+                )
+
+            return candidate
+
+    raise MemoryBudgetError(
+        f"decode needs ~{estimate / 1048576:.0f} MB "
+        f"even at {size[0]}x{size[1]} "
+        f"(budget {max_rss_mb} MB)"
+    )
+
+
+def load_source_low_memory(path_in, target_size=TARGET_SIZE, max_rss_mb=0):
+    """
+    省メモリ版の load_source()。
+
+    - JPEG は Image.draft() で DCT 領域の 1/2・1/4・1/8 縮小デコード
+    - reduce() で整数倍縮小し、ターゲットの少し上まで落とす
+    - 中央トリミングしてから最後の LANCZOS 1回で仕上げる
+
+    フル解像度の RGB バッファを作らないため、48MP の元画像でも
+    ピーク RSS は数十 MB に収まる。
+
+    max_rss_mb を指定すると、デコード前の見積もりが収まるまで縮小率を上げ、
+    1/8 でも収まらない画像は MemoryBudgetError でスキップする。
+    """
+    with Image.open(path_in) as img:
+        capture_date = read_capture_date(img)
+
+        orientation = img.getexif().get(0x0112, 1)
+        tw, th = target_size
+
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            oriented_target = (th, tw)
+        else:
+            oriented_target = (tw, th)
+
+        request = cover_size(img.size, oriented_target)
+
+        if max_rss_mb:
+            request = fit_draft_request(path_in, request, max_rss_mb)
+
+        # draft() は要求サイズ以上を保つ最大の縮小率を選ぶ
+        img.draft("RGB", request)
+        img.load()
+
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        cover_w, cover_h = cover_size(img.size, oriented_target)
+        factor = min(img.size[0] // cover_w, img.size[1] // cover_h)
+
+        if factor >= 2:
+            img = img.reduce(factor)
+
+    # reduce 済みの小さな画像に対して向き補正とトリミングを行う
+    img = ImageOps.exif_transpose(img)
+
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    w, h = img.size
+    scale = max(tw / w, th / h)
+    crop_w = min(w, tw / scale)
+    crop_h = min(h, th / scale)
+    left = (w - crop_w) / 2
+    top = (h - crop_h) / 2
+
+    img = img.resize(
+        target_size,
+        Image.Resampling.LANCZOS,
+        box=(left, top, left + crop_w, top + crop_h),
+    )
+
+    return img, capture_date
+
+
+def psnr(a, b):
+    """2枚の RGB 画像の PSNR (dB)。"""
+    diff = np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)
+    mse = float(np.mean(diff * diff))
+
+    if mse == 0:
+        return float("inf")
+
+    return 10.0 * math.log10(255.0 * 255.0 / mse)
+
+
+def load_source(path_in, target_size=TARGET_SIZE):
+    """
+    元画像を開いて、向き補正・トリミング済みの RGB 画像と
+    撮影日時を返す。
+    """
     with Image.open(path_in) as img:
-        # 元画像の EXIF を退避（JPEG の場合に入っていることが多い）
-        exif_bytes = img.info.get("exif")
+        capture_date = read_capture_date(img)
 
+        img = ImageOps.exif_transpose(img)
         img = img.convert("RGB")
-        w, h = img.size
-        tw, th = TARGET_SIZE
-        img_ratio = w / h
-        target_ratio = tw / th
-
-        # アスペクト比を維持しつつ、長辺基準で縮小
-        if img_ratio > target_ratio:
-            # 横長 → 高さに合わせて縮小
-            new_height = th
-            new_width = int(th * img_ratio)
+
+    return crop_to_target(img, target_size), capture_date
+
+
+# ============================================================
+# Tone
+# ============================================================
+
+# カーブは 0-255 の float 配列を受け取って返す関数。
+# 8bit に丸めるのは合成後の最後の1回だけなので、
+# カーブを何段重ねても丸め誤差は積み上がらない。
+
+def gamma_curve(gamma):
+    """
+    gamma > 1.0:
+      中間調～明部を少し暗くする。
+      Spectra 6での白飛び抑制を狙う。
+    """
+    def curve(x):
+        return 255.0 * (x / 255.0) ** gamma
+
+    return curve
+
+
+def highlight_curve(knee, strength):
+    """
+    暗部・中間調はほぼそのままにして、
+    明るい領域だけを緩やかに圧縮する。
+
+    純白 (255) は 255 のまま維持する。
+
+    strength が span (= 255 - knee) を超えるとカーブが knee 直後で
+    下り坂になり、明るい画素ほど暗くなる（ハイライトの反転）。
+    単調性を保てる上限 ±span に丸める。
+    """
+    span = 255.0 - knee
+    strength = max(-span, min(span, strength))
+
+    def curve(x):
+        t = np.clip((x - knee) / span, 0.0, 1.0)
+
+        # 中高輝度域を下げるが、255では再び255になる滑らかなカーブ
+        return x - strength * t * (1.0 - t)
+
+    return curve
+
+
+def check_highlight(knee, strength):
+    """
+    ハイライト圧縮の設定を検証し、問題があればメッセージを返す。
+
+    highlight_curve() 自体も丸めるが、指定した値が黙って効かないより
+    コマンドラインの段階でエラーにしたほうが気づきやすい。
+    """
+    if not 0 <= knee <= 255:
+        return f"highlight knee must be within 0..255 (got {knee})"
+
+    span = 255 - knee
+
+    if strength and abs(strength) > span:
+        return (
+            f"highlight strength {strength:g} exceeds 255 - knee = {span}; "
+            "the curve would invert highlights"
+        )
+
+    return None
+
+
+def tone_curves(options):
+    """options から TONE_ORDER の順にカーブのリストを作る。"""
+    curves = []
+
+    for name in options["TONE_ORDER"].split(","):
+        name = name.strip()
+
+        if not name:
+            continue
+
+        if name == "gamma":
+            if options["GAMMA"] != 1.0:
+                curves.append(gamma_curve(options["GAMMA"]))
+
+        elif name == "highlight":
+            if (
+                options["HIGHLIGHT_STRENGTH"]
+                and options["HIGHLIGHT_KNEE"] < 255
+            ):
+                curves.append(
+                    highlight_curve(
+                        options["HIGHLIGHT_KNEE"],
+                        options["HIGHLIGHT_STRENGTH"],
+                    )
+                )
+
         else:
-            # 縦長 → 幅に合わせて縮小
-            new_width = tw
-            new_height = int(tw / img_ratio)
+            raise ValueError(f"Unknown tone curve: {name}")
+
+    return curves
+
+
+def compose_tone_lut(curves):
+    """カーブ列を合成し、img.point() 用の 256 エントリ LUT を返す。"""
+    x = np.arange(256, dtype=np.float64)
+
+    for curve in curves:
+        x = curve(x)
+
+    return np.clip(np.rint(x), 0, 255).astype(np.uint8).tolist()
+
+
+def saturation_matrix(saturation):
+    """
+    輝度を保ったまま彩度を変える RGB → RGB 行列
+    (Image.convert の 12 要素形式)。
+    """
+    wr, wg, wb = 0.299, 0.587, 0.114
+    s = saturation
+    k = 1.0 - s
+
+    return (
+        wr * k + s, wg * k, wb * k, 0,
+        wr * k, wg * k + s, wb * k, 0,
+        wr * k, wg * k, wb * k + s, 0,
+    )
+
+
+def apply_tone(img, options):
+    """
+    トーンカーブ全体を point() 1回、彩度を convert() 1回で適用する。
+
+    恒等変換になる段は飛ばすので、何も設定しなければ画像はそのまま。
+    """
+    lut = compose_tone_lut(tone_curves(options))
+
+    if lut != list(range(256)):
+        img = img.point(lut * 3)
+
+    if options["TONE_SATURATION"] != 1.0:
+        img = img.convert(
+            "RGB",
+            saturation_matrix(options["TONE_SATURATION"]),
+        )
+
+    return img
+
+
+# ============================================================
+# Quantization
+# ============================================================
+
+# weighted 距離の RGB 重み（緑の差に敏感な人間の視覚に寄せる）
+WEIGHTED_RGB = np.array([2.0, 4.0, 3.0])
+
+# sRGB (D65) → XYZ
+SRGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+
+D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+
+def rgb_to_lab(rgb):
+    """(..., 3) の sRGB 値 (0-255) を CIE L*a*b* に変換する。"""
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(
+        c <= 0.04045,
+        c / 12.92,
+        ((c + 0.055) / 1.055) ** 2.4,
+    )
+
+    xyz = linear @ SRGB_TO_XYZ.T / D65_WHITE
+
+    f = np.where(
+        xyz > (6 / 29) ** 3,
+        np.cbrt(xyz),
+        xyz / (3 * (6 / 29) ** 2) + 4 / 29,
+    )
+
+    return np.stack(
+        [
+            116 * f[..., 1] - 16,
+            500 * (f[..., 0] - f[..., 1]),
+            200 * (f[..., 1] - f[..., 2]),
+        ],
+        axis=-1,
+    )
+
+
+def to_metric_space(rgb, metric):
+    """距離計算用の色空間へ変換する（ユークリッド距離で比較できる形）。"""
+    if metric == "rgb":
+        return np.asarray(rgb, dtype=np.float64)
+
+    if metric == "weighted":
+        return np.asarray(rgb, dtype=np.float64) * np.sqrt(WEIGHTED_RGB)
+
+    if metric == "lab":
+        return rgb_to_lab(rgb)
+
+    raise ValueError(f"Unknown distance metric: {metric}")
+
+
+def nearest_palette_indices(rgb, palette, metric="rgb", chunk_rows=64):
+    """
+    各画素に距離が最小のパレット index を割り当てる（全探索）。
+
+    (H, W, 3) 全体の距離配列を一度に作ると大きいので、
+    chunk_rows 行ずつ処理してメモリ使用量を抑える。
+    """
+    palette = to_metric_space(palette, metric)
+    height = rgb.shape[0]
+    out = np.empty(rgb.shape[:2], dtype=np.uint8)
+
+    for top in range(0, height, chunk_rows):
+        block = to_metric_space(rgb[top:top + chunk_rows], metric)
+        diff = block[:, :, None, :] - palette[None, None, :, :]
+        dist = np.einsum("hwpc,hwpc->hwp", diff, diff)
+        out[top:top + chunk_rows] = np.argmin(dist, axis=2)
+
+    return out
+
+
+# ============================================================
+# 3D LUT
+# ============================================================
+
+_LUT_MEMO = {}
+
+
+def lut_cache_key(palette, bits, metric, kind="nearest"):
+    """パレット値・ビット数・距離・種類から LUT のキャッシュキーを作る。"""
+    payload = json.dumps(
+        {
+            "version": 1,
+            "kind": kind,
+            "palette": np.asarray(palette).astype(int).tolist(),
+            "bits": bits,
+            "metric": metric,
+        },
+        sort_keys=True,
+    )
+
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def build_palette_lut(palette, bits=6, metric="rgb"):
+    """
+    RGB 各軸を 2^bits 段に区切ったセル中心について最近傍色を全探索し、
+    (N, N, N) uint8 の LUT を作る。
+    """
+    levels = 1 << bits
+    step = 256 // levels
+    centres = np.arange(levels) * step + (step - 1) / 2.0
+
+    r, g, b = np.meshgrid(centres, centres, centres, indexing="ij")
+    grid = np.stack([r, g, b], axis=-1).reshape(levels, levels * levels, 3)
+
+    return nearest_palette_indices(grid, palette, metric).reshape(
+        levels,
+        levels,
+        levels,
+    )
+
+
+def get_palette_lut(
+    palette,
+    bits=6,
+    metric="rgb",
+    cache_dir=LUT_CACHE_DIR,
+    kind="nearest",
+):
+    """
+    LUT をプロセス内 → ディスクキャッシュ → 新規作成の順で取得する。
+
+    キャッシュは palette / bits / metric / kind のハッシュをファイル名にした
+    .npy ファイルで、saturation が変わればパレット値が変わるので別キーになる。
+
+    kind:
+      nearest : (N, N, N) 最近傍色 index
+      mix     : (N, N, N, 3) 2色混合 (index a, index b, b の比率 0-255)
+    """
+    key = lut_cache_key(palette, bits, metric, kind)
+
+    if key in _LUT_MEMO:
+        return _LUT_MEMO[key]
+
+    builder, shape = {
+        "nearest": (build_palette_lut, (1 << bits,) * 3),
+        "mix": (build_mix_lut, (1 << bits,) * 3 + (3,)),
+    }[kind]
+
+    cache_file = cache_dir / f"lut-{kind}-{metric}-{bits}-{key}.npy"
+
+    lut = None
+
+    if cache_file.exists():
+        try:
+            lut = np.load(cache_file)
+        except (OSError, ValueError):
+            lut = None
+
+    if lut is None or lut.shape != shape:
+        lut = builder(palette, bits, metric)
+
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_name(f".{cache_file.name}.{os.getpid()}")
+
+            with tmp_file.open("wb") as f:
+                np.save(f, lut)
+
+            os.replace(tmp_file, cache_file)
+
+        except OSError as exc:
+            print(f"WARN: LUT cache not written: {exc}", file=sys.stderr)
+
+    _LUT_MEMO[key] = lut
+
+    return lut
+
+
+def lut_flat_index(rgb, bits):
+    """
+    (H, W, 3) uint8 から、LUT を1次元に並べたときの位置を求める。
+
+    bits <= 8 なら位置は 24bit に収まるので、intp (8 byte) ではなく
+    uint32 のまま in-place で組み立てる。1600x1200 で 15 ms → 5 ms。
+    """
+    shift = 8 - bits
+
+    levels = np.asarray(rgb, dtype=np.uint8) >> shift
+
+    index = levels[..., 0].astype(np.uint32)
+    index <<= bits
+    index |= levels[..., 1]
+    index <<= bits
+    index |= levels[..., 2]
+
+    return index
+
+
+def lut_lookup(rgb, lut):
+    """(H, W, 3) uint8 を LUT の1回の gather で index 配列にする。"""
+    bits = int(round(math.log2(lut.shape[0])))
+
+    return np.take(lut.reshape(-1), lut_flat_index(rgb, bits))
+
+
+# ============================================================
+# Ordered dithering
+# ============================================================
+
+_THRESHOLD_MEMO = {}
+
+
+def bayer_matrix(size=8):
+    """(size, size) の Bayer しきい値行列。値は (0, 1) に正規化済み。"""
+    m = np.zeros((1, 1), dtype=np.float64)
+
+    while m.shape[0] < size:
+        m = np.block([
+            [4 * m, 4 * m + 2],
+            [4 * m + 3, 4 * m + 1],
+        ])
+
+    return (m + 0.5) / m.size
+
+
+def blue_noise_matrix(size=64, iterations=12, sigma=1.5, seed=0):
+    """
+    (size, size) の blue-noise しきい値行列。値は (0, 1)。
+
+    白色ノイズから、トーラス上のガウスぼかしで低周波成分を引いて
+    順位で一様分布へ戻す操作を繰り返す。void-and-cluster ほど
+    厳密ではないが、決定的で数 ms で作れ、低周波の斑は十分消える。
+    """
+    rng = np.random.default_rng(seed)
+    noise = rng.random((size, size))
+
+    freq = np.fft.fftfreq(size)
+    fy, fx = np.meshgrid(freq, freq, indexing="ij")
+    lowpass = np.exp(-2 * (np.pi * sigma) ** 2 * (fx * fx + fy * fy))
+
+    for _ in range(iterations):
+        blurred = np.real(np.fft.ifft2(np.fft.fft2(noise) * lowpass))
+        noise = noise - blurred
+
+        ranks = np.argsort(np.argsort(noise, axis=None))
+        noise = ranks.reshape(size, size).astype(np.float64)
+        noise = (noise + 0.5) / noise.size
+
+    return noise
+
+
+def threshold_matrix(dither):
+    if dither not in _THRESHOLD_MEMO:
+        if dither == "bayer":
+            _THRESHOLD_MEMO[dither] = bayer_matrix(8)
+        elif dither == "blue-noise":
+            _THRESHOLD_MEMO[dither] = blue_noise_matrix(64)
+        else:
+            raise ValueError(f"Not an ordered dither mode: {dither}")
+
+    return _THRESHOLD_MEMO[dither]
+
+
+# 2色混合で、離れた色どうしを組ませすぎないためのペナルティ。
+# 中間調の灰色は黒+白のように、近い2色の組で表したい。
+MIX_PAIR_PENALTY = 0.05
+
+
+def build_mix_lut(palette, bits=6, metric="rgb", chunk=4096):
+    """
+    各 LUT セルの色を「パレット2色 a, b を比率 t で混ぜた色」で近似し、
+    (N, N, N, 3) uint8 = (a, b, round(t * 255)) を返す。
+
+    ordered dither は、画素のしきい値が t 未満なら b、そうでなければ a を置く。
+    6色しかないパネルで単純にしきい値分だけ画素値をずらすと、
+    灰色が緑に寄るなどパレットの偏りがそのまま出るため、
+    混色の組み合わせを事前に決めておく。
+
+    混色はパネル上の面積比なので RGB 空間で計算する
+    （rgb 以外の metric では weighted の重みを使う）。
+    """
+    levels = 1 << bits
+    step = 256 // levels
+    centres = np.arange(levels) * step + (step - 1) / 2.0
+
+    r, g, b = np.meshgrid(centres, centres, centres, indexing="ij")
+    grid = np.stack([r, g, b], axis=-1).reshape(-1, 3)
+
+    weights = np.ones(3) if metric == "rgb" else WEIGHTED_RGB
+    palette = np.asarray(palette, dtype=np.float64)
+
+    count = len(palette)
+    pairs = np.array(
+        [(i, j) for i in range(count) for j in range(i, count)],
+        dtype=np.uint8,
+    )
+
+    start = palette[pairs[:, 0]]
+    delta = palette[pairs[:, 1]] - start
+    delta_norm = np.einsum("pc,pc,c->p", delta, delta, weights)
+
+    out = np.empty((len(grid), 3), dtype=np.uint8)
+
+    for top in range(0, len(grid), chunk):
+        block = grid[top:top + chunk]
+
+        offset = block[:, None, :] - start[None, :, :]
+        t = np.einsum("npc,pc,c->np", offset, delta, weights)
+        t = np.clip(
+            np.divide(
+                t,
+                delta_norm,
+                out=np.zeros_like(t),
+                where=delta_norm > 0,
+            ),
+            0.0,
+            1.0,
+        )
+
+        residual = offset - t[:, :, None] * delta[None, :, :]
+        error = (
+            np.einsum("npc,npc,c->np", residual, residual, weights)
+            + MIX_PAIR_PENALTY * t * (1.0 - t) * delta_norm
+        )
+
+        best = np.argmin(error, axis=1)
+        rows = np.arange(len(block))
+
+        out[top:top + chunk, 0] = pairs[best, 0]
+        out[top:top + chunk, 1] = pairs[best, 1]
+        out[top:top + chunk, 2] = np.rint(t[rows, best] * 255)
+
+    return out.reshape(levels, levels, levels, 3)
+
+
+def ordered_dither_indices(rgb, mix_lut, matrix):
+    """
+    しきい値行列をタイル状に敷き、2色混合 LUT の比率と比べて
+    a / b のどちらを置くか決める。
+
+    画素ごとの依存がないので、全体が numpy の一括演算で終わる。
+    (N, N, N, 3) の LUT から行ごと gather して np.where で選ぶと、
+    3列の strided な読み書きが続いて 1600x1200 で約 70 ms かかる。
+    比率だけの平面と (a, b) を交互に並べた平面に分け、
+    「セル位置 * 2 + (しきい値 < 比率)」で uint8 を1回 gather する
+    （約 15 ms。Pillow の Floyd-Steinberg は約 45 ms）。
+    """
+    height, width = rgb.shape[:2]
+    mh, mw = matrix.shape
+
+    thresholds = np.rint(matrix * 255).astype(np.uint8)
+    thresholds = np.tile(
+        thresholds,
+        (height // mh + 1, width // mw + 1),
+    )[:height, :width]
+
+    bits = int(round(math.log2(mix_lut.shape[0])))
+    ratio = np.ascontiguousarray(mix_lut[..., 2]).reshape(-1)
+    pairs = np.ascontiguousarray(mix_lut[..., :2]).reshape(-1)
+
+    index = lut_flat_index(rgb, bits)
+    use_b = np.take(ratio, index) > thresholds
+
+    index <<= 1
+    index |= use_b
+
+    return np.take(pairs, index)
 
-        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
 
-        # 中央トリミング
-        left = (new_width - tw) // 2
-        top = (new_height - th) // 2
-        img = img.crop((left, top, left + tw, top + th))
+# ============================================================
+# Parallel error diffusion
+# ============================================================
 
-        # EXIF がある場合はそれも一緒に書き戻す
-        if exif_bytes:
+# 何本の対角線ごとに、進捗を次のストライプへ知らせるか。
+# 小さいほどストライプ間の待ちが短くなるが、Condition の通知が増える。
+DIFFUSION_CHUNK = 16
+
+# 前のストライプをこれ以上待ったら、そのワーカーが落ちたとみなす
+DIFFUSION_WAIT_SECONDS = 120
+
+
+def diffuse_stripe(
+    work,
+    out,
+    shape,
+    lut,
+    bits,
+    palette,
+    top,
+    bottom,
+    wait=None,
+    publish=None,
+):
+    """
+    行 [top, bottom) を Floyd-Steinberg で処理する。
+
+    画素 (r, x) が依存するのは左 (r, x-1) と上の行 (r-1, x-1..x+1) だけなので、
+    d = x + 2r が等しい画素どうしは独立で、まとめて numpy で処理できる
+    （anti-diagonal wavefront）。d の小さい順に処理し、同じ対角線からは
+    左下 → 右の順に誤差を足すため、加算順は1行ずつ左から処理した場合と同じで、
+    結果はビット単位で一致する。
+
+    work は (H*W, 3) float64、out は (H*W,) uint8 の平坦な配列。
+    対角線上の画素は平坦な配列で W-2 おきに並ぶので、すべてスライスで扱える。
+
+    wait(d) は前のストライプが対角線 d まで終えるのを待ち、
+    publish(d) は自分が対角線 d まで終えたことを知らせる。
+    """
+    height, width = shape
+
+    flat_lut = lut.reshape(-1)
+    palette = np.asarray(palette, dtype=np.float64)
+    shift = 8 - bits
+
+    skew = width - 2
+    # width < 3 では対角線上の画素は1つだけなので、刻みは何でもよい
+    step = max(skew, 1)
+
+    first = 2 * top
+    last = (width - 1) + 2 * (bottom - 1)
+
+    def diagonal(start, begin, end):
+        """対角線の begin..end-1 番目の画素から start だけずれた位置。"""
+        offset = start + begin * step
+        return slice(offset, offset + (end - begin - 1) * step + 1, step)
+
+    for d in range(first, last + 1):
+        r0 = max(top, -((width - 1 - d) // 2))
+        r1 = min(bottom - 1, d // 2)
+
+        if r0 > r1:
+            continue
+
+        if wait is not None:
+            wait(d)
+
+        n = r1 - r0 + 1
+        start = d + r0 * skew
+
+        value = np.clip(work[diagonal(start, 0, n)], 0.0, 255.0)
+        level = value.astype(np.intp) >> shift
+        index = flat_lut[
+            level[:, 0] << (2 * bits)
+            | level[:, 1] << bits
+            | level[:, 2]
+        ]
+        out[diagonal(start, 0, n)] = index
+
+        error = value - palette[index]
+
+        # 先頭の画素は右端 (x = W-1) のことがあり、
+        # 末尾の画素は左端 (x = 0) や最終行のことがある
+        right = 1 if d - 2 * r0 == width - 1 else 0
+        below = n - 1 if r1 == height - 1 else n
+        left = n - 1 if d - 2 * r1 == 0 else n
+
+        if min(left, below) > 0:
+            work[diagonal(start + width - 1, 0, min(left, below))] += (
+                error[:min(left, below)] * 0.1875
+            )
+
+        if n > right:
+            work[diagonal(start + 1, right, n)] += error[right:] * 0.4375
+
+        if below > 0:
+            work[diagonal(start + width, 0, below)] += error[:below] * 0.3125
+
+        if below > right:
+            work[diagonal(start + width + 1, right, below)] += (
+                error[right:below] * 0.0625
+            )
+
+        if publish is not None and (d - first) % DIFFUSION_CHUNK == 0:
+            publish(d)
+
+    if publish is not None:
+        # 後続のストライプは、もうこちらを待たなくてよい
+        publish(last + 2 * height)
+
+
+def stripe_bounds(height, workers):
+    """行を workers 個の連続したストライプに分けた [(top, bottom), ...]。"""
+    return [
+        (height * i // workers, height * (i + 1) // workers)
+        for i in range(workers)
+    ]
+
+
+def _diffuse_worker(
+    work_name,
+    out_name,
+    shape,
+    lut,
+    bits,
+    palette,
+    progress,
+    conditions,
+    worker,
+    workers,
+):
+    """
+    worker 番目のストライプを処理するプロセスの本体。
+
+    前のストライプの進捗は conditions[worker - 1] で待ち、
+    自分の進捗は conditions[worker] で次のストライプに知らせる。
+    """
+    height, width = shape
+    top, bottom = stripe_bounds(height, workers)[worker]
+
+    work_shm = shared_memory.SharedMemory(name=work_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+
+    try:
+        work = np.ndarray((height * width, 3), dtype=np.float64, buffer=work_shm.buf)
+        out = np.ndarray((height * width,), dtype=np.uint8, buffer=out_shm.buf)
+
+        seen = -1
+
+        def wait(d):
+            nonlocal seen
+
+            if seen >= d:
+                return
+
+            condition = conditions[worker - 1]
+
+            with condition:
+                ready = condition.wait_for(
+                    lambda: progress[worker - 1] >= d,
+                    timeout=DIFFUSION_WAIT_SECONDS,
+                )
+                seen = progress[worker - 1]
+
+            if not ready:
+                raise RuntimeError(
+                    f"error diffusion stripe {worker - 1} stalled at "
+                    f"diagonal {seen}"
+                )
+
+        def publish(d):
+            condition = conditions[worker]
+
+            with condition:
+                progress[worker] = d
+                condition.notify_all()
+
+        diffuse_stripe(
+            work,
+            out,
+            shape,
+            np.frombuffer(lut, dtype=np.uint8),
+            bits,
+            palette,
+            top,
+            bottom,
+            wait=wait if worker > 0 else None,
+            publish=publish if worker + 1 < workers else None,
+        )
+
+    finally:
+        work_shm.close()
+        out_shm.close()
+
+
+def error_diffusion_indices(rgb, palette, lut, workers=1):
+    """
+    Floyd-Steinberg 誤差拡散を、行の連続したストライプを workers 個の
+    プロセスに割り当てて並列に行う。
+
+    各ストライプの中は対角線ごとの numpy 演算で進め、ストライプ境界の誤差は
+    DIFFUSION_CHUNK 本ごとの進捗を Condition で次のストライプへ渡す
+    （pipelined wavefront）。最近傍色は LUT で引くため、Pillow の
+    FLOYDSTEINBERG とは完全には一致しないが、workers=1 の結果とは完全に一致する。
+    """
+    height, width = rgb.shape[:2]
+    bits = int(round(math.log2(lut.shape[0])))
+    workers = max(1, min(workers, height))
+
+    if workers == 1:
+        work = np.array(rgb, dtype=np.float64).reshape(height * width, 3)
+        out = np.empty(height * width, dtype=np.uint8)
+
+        diffuse_stripe(
+            work,
+            out,
+            (height, width),
+            lut,
+            bits,
+            palette,
+            0,
+            height,
+        )
+
+        return out.reshape(height, width)
+
+    work_shm = shared_memory.SharedMemory(create=True, size=height * width * 24)
+    out_shm = shared_memory.SharedMemory(create=True, size=height * width)
+
+    try:
+        work = np.ndarray((height * width, 3), dtype=np.float64, buffer=work_shm.buf)
+        work[:] = np.asarray(rgb, dtype=np.float64).reshape(height * width, 3)
+
+        ctx = multiprocessing.get_context()
+        progress = ctx.RawArray("i", workers)
+        conditions = [ctx.Condition() for _ in range(workers)]
+
+        args = (
+            work_shm.name,
+            out_shm.name,
+            (height, width),
+            lut.reshape(-1).tobytes(),
+            bits,
+            [tuple(float(v) for v in rgb_) for rgb_ in palette],
+            progress,
+            conditions,
+        )
+
+        processes = [
+            ctx.Process(target=_diffuse_worker, args=args + (i, workers))
+            for i in range(workers)
+        ]
+
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            process.join()
+
+        failed = [p.exitcode for p in processes if p.exitcode != 0]
+
+        if failed:
+            raise RuntimeError(
+                f"error diffusion worker failed: exit codes {failed}"
+            )
+
+        out = np.ndarray((height, width), dtype=np.uint8, buffer=out_shm.buf)
+
+        return out.copy()
+
+    finally:
+        work_shm.close()
+        work_shm.unlink()
+        out_shm.close()
+        out_shm.unlink()
+
+
+def quantize(
+    img,
+    saturation,
+    dither,
+    display_mode="color",
+    metric="rgb",
+    lut_bits=6,
+    workers=1,
+):
+    """
+    RGB 画像を Spectra 6 パレットの index 配列 (H, W) uint8 にする。
+
+    返り値の index は DESATURATED_PALETTE / パネルの色順に従う。
+    """
+    allowed = np.array(MODE_PALETTE_INDICES[display_mode], dtype=np.uint8)
+    palette = blend_palette(saturation)[allowed]
+
+    if dither == "floyd-steinberg":
+        # 誤差拡散は Pillow の C 実装に任せる。
+        palette_image = Image.new("P", (1, 1))
+        palette_image.putpalette(palette.tobytes())
+
+        quantized = img.quantize(
+            colors=len(palette),
+            palette=palette_image,
+            dither=Image.Dither.FLOYDSTEINBERG,
+        )
+        indices = np.asarray(quantized, dtype=np.uint8)
+
+    elif dither == "none":
+        lut = get_palette_lut(palette, lut_bits, metric)
+        indices = lut_lookup(np.asarray(img), lut)
+
+    elif dither in ("bayer", "blue-noise"):
+        mix_lut = get_palette_lut(palette, lut_bits, metric, kind="mix")
+        indices = ordered_dither_indices(
+            np.asarray(img),
+            mix_lut,
+            threshold_matrix(dither),
+        )
+
+    elif dither == "floyd-steinberg-parallel":
+        lut = get_palette_lut(palette, lut_bits, metric)
+        indices = error_diffusion_indices(
+            np.asarray(img),
+            palette,
+            lut,
+            workers,
+        )
+
+    else:
+        raise ValueError(f"Unknown dither mode: {dither}")
+
+    return np.take(allowed, indices)
+
+
+def to_panel_image(indices):
+    """index 配列から、6色パレット付きの P-mode 画像を作る。"""
+    height, width = indices.shape
+
+    img = Image.frombytes(
+        "P",
+        (width, height),
+        np.ascontiguousarray(indices).tobytes(),
+    )
+    img.putpalette(output_palette_bytes())
+
+    return img
+
+
+# ============================================================
+# Rendition cache
+# ============================================================
+
+# 段の処理内容を変えたら上げる。古いキャッシュは LRU で自然に消える。
+PIPELINE_VERSION = 1
+
+# MAX_RSS_MB は縮小デコード率を変えることがあるので crop 段に含める
+CROP_PARAMS = ("LOW_MEMORY", "MAX_RSS_MB")
+
+TONE_PARAMS = (
+    "TONE_ORDER",
+    "GAMMA",
+    "HIGHLIGHT_KNEE",
+    "HIGHLIGHT_STRENGTH",
+    "TONE_SATURATION",
+)
+
+# DITHER_WORKERS は結果に影響しないのでキーに含めない
+QUANT_PARAMS = (
+    "SATURATION",
+    "DITHER",
+    "DISPLAY_MODE",
+    "METRIC",
+    "LUT_BITS",
+)
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """ファイル内容の sha256。"""
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def stage_key(parent_key, stage, options, params):
+    """前段のキー + この段のパラメータから、この段のキーを作る。"""
+    payload = json.dumps(
+        {
+            "version": PIPELINE_VERSION,
+            "parent": parent_key,
+            "stage": stage,
+            "params": {name: options[name] for name in params},
+        },
+        sort_keys=True,
+    )
+
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RenditionCache:
+    """
+    段ごとの中間画像を内容アドレスで保存するキャッシュ。
+
+    - キーは「入力のハッシュ + その段のパラメータ」のハッシュ
+    - 中身は PNG（RGB の段は圧縮レベル1で書き込みを軽くする）
+    - 合計サイズが max_bytes を超えたら、mtime の古い順に消す（LRU）。
+      ヒット時に mtime を更新する。
+    - 追い出しは put() ごとではなく、main() がバッチの最後に1回だけ行う。
+      put() のたびに全エントリを stat すると件数の2乗で遅くなり、
+      プールの各ワーカーが同時に消し合うことにもなるため。
+      バッチの途中では一時的に上限を超えることがある。
+
+    saturation だけを変えて再実行した場合は、crop / tone の段が
+    ヒットし、量子化だけがやり直しになる。
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path(self, stage, key):
+        return self.root / stage / key[:2] / f"{key}.png"
+
+    def get(self, stage, key):
+        """キャッシュ済みの PNG のパスを返す。なければ None。"""
+        if not self.enabled:
+            return None
+
+        path = self.path(stage, key)
+
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+
+        return path
+
+    def put(self, stage, key, img, **save_options):
+        if not self.enabled:
+            return
+
+        path = self.path(stage, key)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            img.save(tmp_path, format="PNG", **save_options)
+            os.replace(tmp_path, path)
+
+        except OSError as exc:
+            print(f"WARN: cache write failed: {exc}", file=sys.stderr)
+            tmp_path.unlink(missing_ok=True)
+
+    def evict(self):
+        """合計サイズが上限に収まるまで、最も古く使われたものから消す。"""
+        entries = []
+        total = 0
+
+        for path in self.root.glob("*/*/*.png"):
             try:
-                img.save(
-                    path_out,
-                    format="JPEG",
-                    quality=90,
-                    optimize=True,
-                    exif=exif_bytes,
+                stat = path.stat()
+            except OSError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+
+            try:
+                path.unlink()
+            except OSError:
+                continue
+
+            total -= size
+
+
+def open_cached_rgb(path):
+    with Image.open(path) as cached:
+        return cached.convert("RGB")
+
+
+# ============================================================
+# Pipeline
+# ============================================================
+
+def process_one(path_in, path_out, options):
+    """
+    1枚を変換して保存し、metadata.json 用のエントリを返す。
+
+    crop → tone → quantize の各段は RenditionCache を通し、
+    パラメータが変わっていない段は計算し直さない。
+    """
+    started = time.monotonic()
+
+    cache = RenditionCache(
+        options["CACHE_DIR"],
+        options["CACHE_MB"] * 1024 * 1024,
+    )
+
+    reset_peak_rss()
+
+    source_key = file_digest(path_in) if cache.enabled else None
+    crop_key = stage_key(source_key, "crop", options, CROP_PARAMS)
+    tone_key = stage_key(crop_key, "tone", options, TONE_PARAMS)
+    quant_key = stage_key(tone_key, "quant", options, QUANT_PARAMS)
+
+    # 後段のキャッシュは前段が残っているときだけ使う。
+    # 撮影日時は crop 段の PNG に埋め込んである。
+    crop_path = cache.get("crop", crop_key)
+    tone_path = crop_path and cache.get("tone", tone_key)
+    quant_path = tone_path and cache.get("quant", quant_key)
+
+    hits = [
+        stage
+        for stage, path in (
+            ("crop", crop_path),
+            ("tone", tone_path),
+            ("quant", quant_path),
+        )
+        if path
+    ]
+    quality = ""
+    decode_seconds = 0.0
+
+    if crop_path:
+        with Image.open(crop_path) as cached:
+            capture_date = cached.text.get("capture_date") or None
+
+    tmp_out = path_out.with_name(f".{path_out.name}.tmp")
+
+    if quant_path:
+        shutil.copyfile(quant_path, tmp_out)
+
+    else:
+        if tone_path:
+            img = open_cached_rgb(tone_path)
+
+        else:
+            if crop_path:
+                img = open_cached_rgb(crop_path)
+
+            else:
+                decode_started = time.monotonic()
+
+                if options["LOW_MEMORY"]:
+                    img, capture_date = load_source_low_memory(
+                        path_in,
+                        max_rss_mb=options["MAX_RSS_MB"],
+                    )
+                else:
+                    img, capture_date = load_source(path_in)
+
+                decode_seconds = time.monotonic() - decode_started
+
+                if options.get("COMPARE_QUALITY"):
+                    # 比較用に通常パスでもデコードする（こちらはメモリを食う）
+                    reference, _ = load_source(path_in)
+                    quality = (
+                        f", PSNR vs full decode "
+                        f"{psnr(img, reference):.2f} dB"
+                    )
+                    del reference
+
+                info = PngImagePlugin.PngInfo()
+                info.add_text("capture_date", capture_date or "")
+                cache.put(
+                    "crop",
+                    crop_key,
+                    img,
+                    compress_level=1,
+                    pnginfo=info,
                 )
-            except TypeError:
-                # もし古い Pillow などで exif 引数が使えなければ、EXIF なしで保存
-                img.save(path_out, format="JPEG", quality=90, optimize=True)
+
+            img = apply_tone(img, options)
+            cache.put("tone", tone_key, img, compress_level=1)
+
+        indices = quantize(
+            img,
+            options["SATURATION"],
+            options["DITHER"],
+            options["DISPLAY_MODE"],
+            options["METRIC"],
+            options["LUT_BITS"],
+            options["DITHER_WORKERS"],
+        )
+
+        panel_image = to_panel_image(indices)
+        panel_image.save(tmp_out, format="PNG", optimize=True)
+        cache.put("quant", quant_key, panel_image, optimize=True)
+
+    peak_mb = read_proc_status_kb("VmHWM") / 1024
+
+    # slideshow 側に書きかけの PNG を拾わせない
+    os.replace(tmp_out, path_out)
+
+    elapsed = time.monotonic() - started
+
+    print(
+        f"OK: {path_out.name} ({elapsed:.2f}s, "
+        f"decode {decode_seconds:.2f}s, "
+        f"peak RSS {peak_mb:.1f} MB, "
+        f"cache hit: {','.join(hits) or 'none'}{quality})"
+    )
+
+    if (
+        options["MAX_RSS_MB"]
+        and not options.get("COMPARE_QUALITY")
+        and read_proc_status_kb("VmHWM") > options["MAX_RSS_MB"] * 1024
+    ):
+        print(
+            f"WARN: {path_out.name}: peak RSS "
+            f"{read_proc_status_kb('VmHWM') / 1024:.1f} MB "
+            f"exceeded budget {options['MAX_RSS_MB']} MB",
+            file=sys.stderr,
+        )
+
+    return {
+        "source": Path(path_in).name,
+        "output": path_out.name,
+        "capture_date": capture_date,
+        "display_mode": options["DISPLAY_MODE"],
+        "dither": options["DITHER"],
+        "metric": options["METRIC"],
+        "saturation": options["SATURATION"],
+        "gamma": options["GAMMA"],
+        "highlight_knee": options["HIGHLIGHT_KNEE"],
+        "highlight_strength": options["HIGHLIGHT_STRENGTH"],
+        "tone_saturation": options["TONE_SATURATION"],
+        "processed_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def _process_task(task):
+    path_in, path_out, options = task
+
+    try:
+        return path_out.name, process_one(path_in, path_out, options)
+
+    except Exception as exc:
+        print(f"NG: {Path(path_in).name}: {exc}", file=sys.stderr)
+        return path_out.name, None
+
+
+def collect_sources(raw_dir, out_dir, force=False):
+    """変換が必要な (元画像, 出力先) の組を返す。"""
+    tasks = []
+
+    for path_in in sorted(raw_dir.iterdir()):
+        if not path_in.is_file():
+            continue
+
+        if path_in.name.startswith("."):
+            continue
+
+        if path_in.suffix.lower() not in SOURCE_SUFFIXES:
+            continue
+
+        path_out = out_dir / f"{path_in.stem}.png"
+
+        if (
+            not force
+            and path_out.exists()
+            and path_out.stat().st_mtime >= path_in.stat().st_mtime
+        ):
+            continue
+
+        tasks.append((path_in, path_out))
+
+    return tasks
+
+
+# ============================================================
+# Metadata
+# ============================================================
+
+def load_metadata(metadata_file):
+    if not metadata_file.exists():
+        return {}
+
+    with metadata_file.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_metadata(metadata_file, metadata):
+    """tmp に書いてから rename し、読み込み途中の破損を防ぐ。"""
+    metadata_file.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_file = metadata_file.with_name(f".{metadata_file.name}.tmp")
+
+    with tmp_file.open("w", encoding="utf-8") as f:
+        json.dump(
+            metadata,
+            f,
+            ensure_ascii=False,
+            indent=2,
+            sort_keys=True,
+        )
+
+    os.replace(tmp_file, metadata_file)
+
+
+# ============================================================
+# LUT benchmark
+# ============================================================
+
+def benchmark_lut(image_path, saturation, metric, bits, display_mode="color"):
+    """
+    LUT 量子化と全探索を同じ画像で比較し、速度と一致率を表示する。
+
+    image_path が None なら、RGB 空間を一様に覆う合成画像を使う。
+    """
+    if image_path:
+        img, _ = load_source(image_path)
+        rgb = np.asarray(img)
+    else:
+        rng = np.random.default_rng(0)
+        rgb = rng.integers(
+            0,
+            256,
+            size=(TARGET_SIZE[1], TARGET_SIZE[0], 3),
+            dtype=np.uint8,
+        )
+
+    allowed = np.array(MODE_PALETTE_INDICES[display_mode], dtype=np.uint8)
+    palette = blend_palette(saturation)[allowed]
+
+    started = time.perf_counter()
+    lut = build_palette_lut(palette, bits, metric)
+    build_seconds = time.perf_counter() - started
+
+    get_palette_lut(palette, bits, metric)
+    _LUT_MEMO.clear()
+
+    started = time.perf_counter()
+    lut = get_palette_lut(palette, bits, metric)
+    load_seconds = time.perf_counter() - started
+
+    result = compare_lut(rgb, palette, lut, metric)
+
+    print(f"Image          : {image_path or 'uniform random RGB'}")
+    print(f"Metric / bits  : {metric} / {bits} ({1 << bits}^3 LUT)")
+    print(f"LUT build      : {build_seconds * 1000:.0f} ms (cold)")
+    print(f"LUT cache load : {load_seconds * 1000:.1f} ms")
+    print(f"LUT quantize   : {result['lut_seconds'] * 1000:.1f} ms")
+    print(f"Exact search   : {result['exact_seconds'] * 1000:.1f} ms")
+    print(
+        f"Speed-up       : "
+        f"{result['exact_seconds'] / result['lut_seconds']:.1f}x"
+    )
+    print(f"Match ratio    : {result['match_ratio'] * 100:.3f} %")
+    print(
+        f"Extra distance : mean {result['extra_mean']:.2f} / "
+        f"max {result['extra_max']:.2f} "
+        f"({metric} units, mismatched pixels only)"
+    )
+
+
+def compare_lut(rgb, palette, lut, metric):
+    """
+    LUT 量子化の結果を全探索と比べる。
+
+    返り値: match_ratio（一致率）、extra_mean / extra_max（外れた画素で、
+    選ばれた色が最適色よりどれだけ遠いか）、lut_seconds / exact_seconds
+    """
+    started = time.perf_counter()
+    fast = lut_lookup(rgb, lut)
+    lut_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    exact = nearest_palette_indices(rgb, palette, metric)
+    exact_seconds = time.perf_counter() - started
+
+    mismatch = fast != exact
+
+    space = to_metric_space(rgb[mismatch], metric)
+    space_palette = to_metric_space(palette, metric)
+
+    if len(space):
+        extra = (
+            np.linalg.norm(space - space_palette[fast[mismatch]], axis=1)
+            - np.linalg.norm(space - space_palette[exact[mismatch]], axis=1)
+        )
+        extra_mean = float(extra.mean())
+        extra_max = float(extra.max())
+    else:
+        extra_mean = extra_max = 0.0
+
+    return {
+        "match_ratio": 1.0 - float(np.mean(mismatch)),
+        "extra_mean": extra_mean,
+        "extra_max": extra_max,
+        "lut_seconds": lut_seconds,
+        "exact_seconds": exact_seconds,
+    }
+
+
+# ============================================================
+# Error diffusion scaling
+# ============================================================
+
+def benchmark_diffusion(image_path, saturation, metric, bits, max_workers=4):
+    """
+    floyd-steinberg-parallel を 1..max_workers ワーカーで実行し、
+    時間と workers=1 との一致を表示する。
+    """
+    if image_path:
+        img, _ = load_source(image_path)
+    else:
+        img = Image.open(
+            BASE_DIR
+            / "archive"
+            / "experiments-2026-08-09"
+            / "display-test-chart.png"
+        ).convert("RGB")
+
+    rgb = np.asarray(img)
+    palette = blend_palette(saturation)
+    lut = get_palette_lut(palette, bits, metric)
+
+    print(f"Image: {image_path or 'display-test-chart.png'} {img.size}")
+    print(f"CPUs : {os.cpu_count()}")
+    print(f"{'workers':>7} {'time':>8} {'speed-up':>9} {'identical':>10}")
+
+    reference = None
+    baseline = None
+
+    for workers in range(1, max_workers + 1):
+        started = time.perf_counter()
+        indices = error_diffusion_indices(rgb, palette, lut, workers)
+        elapsed = time.perf_counter() - started
+
+        if reference is None:
+            reference = indices
+            baseline = elapsed
+
+        print(
+            f"{workers:>7} {elapsed:>7.2f}s {baseline / elapsed:>8.2f}x "
+            f"{str(bool(np.array_equal(indices, reference))):>10}"
+        )
+
+
+# ============================================================
+# Dither comparison
+# ============================================================
+
+def compare_dither(
+    chart_path,
+    out_path,
+    saturation,
+    metric,
+    lut_bits,
+    workers=1,
+    repeats=3,
+):
+    """
+    全ディザモードでテストチャートを量子化し、処理時間と
+    ぼかし後 PSNR（パネルの実発色で描いたものと元画像の比較）を表示する。
+
+    結果は 3x2 に並べた RGB 画像として out_path に保存する。
+    """
+    from PIL import ImageDraw, ImageFilter
+
+    chart = Image.open(chart_path).convert("RGB")
+    chart = crop_to_target(chart) if chart.size != TARGET_SIZE else chart
+
+    panel_palette = blend_palette(saturation)
+    reference = chart.filter(ImageFilter.GaussianBlur(3))
+
+    width, height = TARGET_SIZE
+    columns = 3
+    rows = math.ceil(len(DITHER_MODES) / columns)
+    sheet = Image.new("RGB", (width * columns, height * rows), "white")
+    draw = ImageDraw.Draw(sheet)
+
+    print(f"Chart: {chart_path}")
+    print(f"{'mode':<26} {'time':>9} {'blurred PSNR':>13}")
+
+    for i, dither in enumerate(DITHER_MODES):
+        # LUT・しきい値行列の準備は初回だけなので計測から外す
+        quantize(
+            chart,
+            saturation,
+            dither,
+            "color",
+            metric,
+            lut_bits,
+            workers,
+        )
+
+        timings = []
+
+        for _ in range(repeats):
+            started = time.perf_counter()
+            indices = quantize(
+                chart,
+                saturation,
+                dither,
+                "color",
+                metric,
+                lut_bits,
+                workers,
+            )
+            timings.append(time.perf_counter() - started)
+
+        rendered = Image.fromarray(panel_palette[indices])
+        quality = psnr(
+            rendered.filter(ImageFilter.GaussianBlur(3)),
+            reference,
+        )
+
+        print(
+            f"{dither:<26} {min(timings) * 1000:>7.1f}ms "
+            f"{quality:>11.2f}dB"
+        )
+
+        x = (i % columns) * width
+        y = (i // columns) * height
+        sheet.paste(rendered, (x, y))
+        draw.rectangle((x, y, x + 420, y + 44), fill="white")
+        draw.text(
+            (x + 10, y + 10),
+            f"{dither}  {min(timings) * 1000:.0f}ms  {quality:.2f}dB",
+            fill="black",
+        )
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    sheet.save(out_path)
+
+    print(f"Saved: {out_path}")
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert photos into Spectra 6 P-mode PNGs",
+    )
+
+    parser.add_argument("--raw-dir", type=Path, default=RAW_DIR)
+    parser.add_argument("--out-dir", type=Path, default=OUT_DIR)
+    parser.add_argument("--metadata", type=Path, default=METADATA_FILE)
+
+    parser.add_argument("--gamma", type=float, default=CONFIG["GAMMA"])
+    parser.add_argument(
+        "--highlight-knee",
+        type=int,
+        default=CONFIG["HIGHLIGHT_KNEE"],
+    )
+    parser.add_argument(
+        "--highlight-strength",
+        type=float,
+        default=CONFIG["HIGHLIGHT_STRENGTH"],
+    )
+    parser.add_argument(
+        "--tone-saturation",
+        type=float,
+        default=CONFIG["TONE_SATURATION"],
+    )
+    parser.add_argument(
+        "--tone-order",
+        default=CONFIG["TONE_ORDER"],
+        help="comma separated curve order, e.g. gamma,highlight",
+    )
+    parser.add_argument(
+        "--saturation",
+        type=float,
+        default=CONFIG["SATURATION"],
+    )
+    parser.add_argument(
+        "--dither",
+        choices=DITHER_MODES,
+        default=None,
+        help="dither for every image; by default each image keeps the "
+        "dither recorded in metadata.json, falling back to "
+        "PREPROCESS_DITHER",
+    )
+    parser.add_argument(
+        "--dither-workers",
+        type=int,
+        default=CONFIG["DITHER_WORKERS"],
+        help="processes for floyd-steinberg-parallel",
+    )
+    parser.add_argument(
+        "--benchmark-diffusion",
+        nargs="?",
+        const="",
+        metavar="IMAGE",
+        help="time floyd-steinberg-parallel with 1..--dither-workers "
+        "processes and exit",
+    )
+    parser.add_argument(
+        "--compare-dither",
+        type=Path,
+        metavar="CHART",
+        help="time every dither mode on CHART, write a side-by-side "
+        "comparison and exit",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=DISPLAY_MODES,
+        default=CONFIG["DISPLAY_MODE"],
+    )
+    parser.add_argument(
+        "--metric",
+        choices=DISTANCE_METRICS,
+        default=CONFIG["METRIC"],
+    )
+    parser.add_argument(
+        "--lut-bits",
+        type=int,
+        choices=range(4, 9),
+        default=CONFIG["LUT_BITS"],
+    )
+    parser.add_argument(
+        "--benchmark-lut",
+        nargs="?",
+        const="",
+        metavar="IMAGE",
+        help="compare LUT quantization with exact search and exit",
+    )
+
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        default=CONFIG["LOW_MEMORY"],
+        help="reduced-scale JPEG decode and staged downscaling",
+    )
+    parser.add_argument(
+        "--max-rss-mb",
+        type=int,
+        default=CONFIG["MAX_RSS_MB"],
+        help="decode at a smaller scale, or skip the image, when the "
+        "estimated peak RSS exceeds this (implies --low-memory)",
+    )
+    parser.add_argument(
+        "--compare-quality",
+        action="store_true",
+        help="report PSNR of the low-memory decode against the full decode",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=Path(CONFIG["CACHE_DIR"]),
+    )
+    parser.add_argument(
+        "--cache-mb",
+        type=int,
+        default=CONFIG["CACHE_MB"],
+        help="rendition cache size limit; 0 disables the cache",
+    )
+
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="re-convert images whose PNG is already up to date",
+    )
+
+    args = parser.parse_args(argv)
+
+    error = check_highlight(args.highlight_knee, args.highlight_strength)
+
+    if error:
+        parser.error(error)
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.benchmark_lut is not None:
+        benchmark_lut(
+            args.benchmark_lut or None,
+            args.saturation,
+            args.metric,
+            args.lut_bits,
+            args.mode,
+        )
+        return
+
+    if args.benchmark_diffusion is not None:
+        benchmark_diffusion(
+            args.benchmark_diffusion or None,
+            args.saturation,
+            args.metric,
+            args.lut_bits,
+            max(1, args.dither_workers),
+        )
+        return
+
+    if args.compare_dither:
+        compare_dither(
+            args.compare_dither,
+            args.out_dir / "dither-comparison.png",
+            args.saturation,
+            args.metric,
+            args.lut_bits,
+            args.dither_workers,
+        )
+        return
+
+    if args.max_rss_mb and not args.low_memory:
+        # 見積もりと縮小デコードは省メモリ版のデコードにしかない
+        print("--max-rss-mb implies --low-memory")
+        args.low_memory = True
+
+    if args.jobs is None:
+        # 省メモリモードではワーカー数ぶんピークが積み上がるので直列で回す
+        args.jobs = 1 if args.low_memory else CONFIG["JOBS"]
+
+    cpus = os.cpu_count() or 1
+
+    if args.jobs > 1 and args.jobs * args.dither_workers > cpus:
+        # 画像単位のプールの各ワーカーがさらに誤差拡散のプロセスを立てるので、
+        # 掛け算で CPU 数を超えないよう誤差拡散側を減らす
+        args.dither_workers = max(1, cpus // args.jobs)
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+
+    options = {
+        "TONE_ORDER": args.tone_order,
+        "GAMMA": args.gamma,
+        "HIGHLIGHT_KNEE": args.highlight_knee,
+        "HIGHLIGHT_STRENGTH": args.highlight_strength,
+        "TONE_SATURATION": args.tone_saturation,
+        "SATURATION": args.saturation,
+        "DITHER": args.dither,
+        "DITHER_WORKERS": args.dither_workers,
+        "DISPLAY_MODE": args.mode,
+        "METRIC": args.metric,
+        "LUT_BITS": args.lut_bits,
+        "LOW_MEMORY": args.low_memory,
+        "MAX_RSS_MB": args.max_rss_mb,
+        "COMPARE_QUALITY": args.compare_quality and args.low_memory,
+        "CACHE_DIR": args.cache_dir,
+        "CACHE_MB": args.cache_mb,
+    }
+
+    metadata = load_metadata(args.metadata)
+
+    tasks = []
+
+    for path_in, path_out in collect_sources(
+        args.raw_dir,
+        args.out_dir,
+        force=args.force,
+    ):
+        task_options = dict(options)
+
+        if args.dither is None:
+            # 画像ごとに選んだディザは metadata.json に残っているので引き継ぐ
+            previous = metadata.get(path_out.name) or {}
+            task_options["DITHER"] = (
+                previous.get("dither")
+                if previous.get("dither") in DITHER_MODES
+                else CONFIG["DITHER"]
+            )
+
+        tasks.append((path_in, path_out, task_options))
+
+    if not tasks:
+        print("Nothing to do.")
+        return
+
+    started = time.monotonic()
+
+    cache = RenditionCache(args.cache_dir, args.cache_mb * 1024 * 1024)
+
+    try:
+        if args.jobs > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+                results = list(pool.map(_process_task, tasks))
         else:
-            img.save(path_out, format="JPEG", quality=90, optimize=True)
+            results = [_process_task(task) for task in tasks]
 
-        print(f"OK: {os.path.basename(path_out)}")
+    finally:
+        # ワーカーがすべて終わってから、1プロセスで1回だけ追い出す
+        if cache.enabled:
+            cache.evict()
 
+    converted = 0
 
-def main():
-    for name in sorted(os.listdir(RAW_DIR)):
-        if not name.lower().endswith((".jpg", ".jpeg", ".png")):
+    for output_name, entry in results:
+        if entry is None:
             continue
-        src = os.path.join(RAW_DIR, name)
-        dst = os.path.join(OUT_DIR, os.path.splitext(name)[0] + ".jpeg")
-        process_one(src, dst)
+
+        metadata[output_name] = entry
+        converted += 1
+
+    save_metadata(args.metadata, metadata)
+
+    print(
+        f"Converted {converted}/{len(tasks)} images "
+        f"in {time.monotonic() - started:.1f}s "
+        f"(jobs={args.jobs})"
+    )
 
 
 if __name__ == "__main__":
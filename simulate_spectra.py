@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Spectra 6 の見え方をオフラインで再現するプレビュー生成ツール。
+
+パネルへ送って全面リフレッシュを待たなくても変換結果を確認できるよう、
+P-mode の slideshow 用 PNG を「実測したパネルの6色」で RGB に置き換える。
+
+- measure: パネルに表示した display-test-chart.png を撮影した写真から、
+           6色それぞれの実際の見え方を測って JSON に保存する
+- render:  P-mode PNG（ファイルまたはディレクトリ）を実測パレットで RGB 化する
+           --overlay で slideshow.py と同じ日付・ステータス表示を重ねる
+
+6色ちょうどのパレットを持つ P-mode 画像はパネル側で再ディザされないので、
+各画素の index を実測色に置き換えるだけで、パネルの見え方になる。
+変換は 256 エントリの表引き1回なので、ライブラリ全体でもまとめて処理できる。
+
+例:
+  python3 simulate_spectra.py measure chart-photo.jpg
+  python3 simulate_spectra.py render photos/auto --out previews --overlay
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+from dotenv import load_dotenv
+
+import preprocess_photos as pp
+
+
+load_dotenv()
+
+
+# ============================================================
+# Paths / config
+# ============================================================
+
+BASE_DIR = Path(__file__).resolve().parent
+
+CONFIG = {
+    "PALETTE_FILE": Path(
+        os.path.expanduser(
+            os.getenv(
+                "SPECTRA_PALETTE_FILE",
+                str(BASE_DIR / "spectra_palette.json"),
+            )
+        )
+    ),
+
+    "JOBS": int(
+        os.getenv("SIMULATE_JOBS", str(os.cpu_count() or 1))
+    ),
+}
+
+PANEL_SIZE = pp.TARGET_SIZE
+
+# パネルの色順（preprocess_photos / inky と同じ）
+PANEL_COLOR_NAMES = (
+    "black",
+    "white",
+    "yellow",
+    "red",
+    "blue",
+    "green",
+)
+
+
+# ============================================================
+# Test chart geometry
+# ============================================================
+
+# archive/experiments-2026-08-09/create-display-test-chart.py の
+# 基本色ボックスと同じ配置。
+CHART_MARGIN = 50
+CHART_TOP = 110
+CHART_GAP = 10
+CHART_BOX_W = (PANEL_SIZE[0] - CHART_MARGIN * 2 - CHART_GAP * 3) // 4
+CHART_BOX_H = 190
+
+# チャート上の並び:
+#   RED, GREEN, BLUE, YELLOW / ORANGE, WHITE, BLACK, GRAY
+# のうち、パネルの純色がそのまま出るボックスの位置。
+CHART_BOX_INDEX = {
+    "black": 6,
+    "white": 5,
+    "yellow": 3,
+    "red": 0,
+    "blue": 2,
+    "green": 1,
+}
+
+
+def chart_sample_box(box_index):
+    """
+    ボックス内でラベル文字と枠線を避けた、上側の帯を返す。
+
+    ラベルはボックスの縦中央に描かれるので、
+    上から 10〜35% の範囲だけを測る。
+    """
+    row, col = divmod(box_index, 4)
+
+    x1 = CHART_MARGIN + col * (CHART_BOX_W + CHART_GAP)
+    y1 = CHART_TOP + row * (CHART_BOX_H + CHART_GAP)
+
+    return (
+        x1 + CHART_BOX_W * 15 // 100,
+        y1 + CHART_BOX_H * 10 // 100,
+        x1 + CHART_BOX_W * 85 // 100,
+        y1 + CHART_BOX_H * 35 // 100,
+    )
+
+
+# ============================================================
+# Measure
+# ============================================================
+
+def measure_palette(photo_path):
+    """
+    テストチャートを表示したパネルの写真から6色を測る。
+
+    写真はパネルの表示領域に合わせてトリミング済みであること
+    （台形補正まではしない）。1600x1200 に合わせてから、
+    各ボックスの中央値をその色の実測値とする。
+    """
+    with Image.open(photo_path) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+
+    if img.size != PANEL_SIZE:
+        img = img.resize(PANEL_SIZE, Image.Resampling.BOX)
+
+    pixels = np.asarray(img)
+    measured = {}
+
+    for name in PANEL_COLOR_NAMES:
+        x1, y1, x2, y2 = chart_sample_box(CHART_BOX_INDEX[name])
+        region = pixels[y1:y2, x1:x2].reshape(-1, 3)
+
+        measured[name] = [
+            int(value)
+            for value in np.median(region, axis=0).round()
+        ]
+
+    return measured
+
+
+def save_palette(palette_file, measured, source):
+    palette_file = Path(palette_file)
+    palette_file.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_file = palette_file.with_suffix(palette_file.suffix + ".tmp")
+
+    with tmp_file.open("w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "palette": measured,
+                "source": str(source),
+                "measured_at": datetime.now().isoformat(
+                    timespec="seconds"
+                ),
+            },
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+
+    os.replace(tmp_file, palette_file)
+
+
+def load_palette(palette_file):
+    """
+    実測パレットを (6, 3) uint8 で返す。
+
+    まだ測っていない場合は、inky の SATURATED_PALETTE を
+    目安として使う（理想値なので実物よりやや鮮やかに見える）。
+    """
+    palette_file = Path(palette_file)
+
+    try:
+        with palette_file.open("r", encoding="utf-8") as f:
+            data = json.load(f)["palette"]
+
+        return np.array(
+            [data[name] for name in PANEL_COLOR_NAMES],
+            dtype=np.uint8,
+        )
+
+    except FileNotFoundError:
+        print(
+            f"WARN: {palette_file} not found; "
+            f"using inky SATURATED_PALETTE",
+            file=sys.stderr,
+        )
+
+        return np.array(pp.SATURATED_PALETTE, dtype=np.uint8)
+
+
+# ============================================================
+# Simulate
+# ============================================================
+
+def panel_color_table(img, measured):
+    """
+    画像の 256 エントリのパレットを、パネルの色 index 経由で
+    実測 RGB へ写す (256, 3) の表を返す。
+
+    preprocess_photos.py の出力は純色6色なので index がそのまま対応する。
+    ほかのツールで作った P-mode でも、各パレット色をパネルの
+    最も近い純色へ寄せることで同じ表にできる。
+    """
+    raw = img.getpalette() or []
+    raw = raw + [0] * (768 - len(raw))
+
+    image_palette = np.array(raw[:768], dtype=np.uint8).reshape(1, 256, 3)
+
+    panel_indices = pp.nearest_palette_indices(
+        image_palette,
+        np.array(pp.DESATURATED_PALETTE, dtype=np.uint8),
+    )[0]
+
+    return measured[panel_indices]
+
+
+def simulate(img, measured):
+    """P-mode 画像を、実測パレットで塗った RGB 画像にする。"""
+    if img.mode != "P":
+        raise ValueError(
+            f"Expected P-mode image, got {img.mode}"
+        )
+
+    table = panel_color_table(img, measured)
+    rgb = table[np.asarray(img)]
+
+    return Image.fromarray(rgb, "RGB")
+
+
+def apply_overlays(img, image_path, metadata, slide_updated_at):
+    """
+    slideshow.py の add_date_overlay / add_status_overlay を
+    そのまま使って、表示時と同じオーバーレイを描く。
+    """
+    import slideshow
+
+    if slideshow.logger is None:
+        slideshow.logger = logging.getLogger("slideshow")
+
+    capture_date = slideshow.get_capture_date(image_path, metadata)
+
+    img, position = slideshow.add_date_overlay(img, capture_date)
+    img = slideshow.add_status_overlay(img, position, slide_updated_at)
+
+    return img
+
+
+# ============================================================
+# Batch
+# ============================================================
+
+def collect_slides(paths):
+    slides = []
+
+    for path in paths:
+        if path.is_dir():
+            slides.extend(
+                p
+                for p in sorted(path.rglob("*.png"))
+                if p.is_file() and not p.name.startswith(".")
+            )
+        else:
+            slides.append(path)
+
+    return slides
+
+
+def render_one(task):
+    """
+    1枚分のプレビューを書き出す。プロセスプールから呼ばれる。
+
+    返り値: (入力パス, エラー文字列 or None)
+    """
+    path_in, path_out, measured, options = task
+
+    try:
+        with Image.open(path_in) as source:
+            source.load()
+
+            img = source
+
+            if options["overlay"]:
+                # オーバーレイの位置を画像ごとに固定して、
+                # 何度作っても同じプレビューになるようにする。
+                random.seed(path_in.name)
+                img = apply_overlays(
+                    source.copy(),
+                    path_in,
+                    options["metadata"],
+                    options["updated_at"],
+                )
+
+            preview = simulate(img, measured)
+
+        if options["scale"] != 1.0:
+            preview = preview.resize(
+                (
+                    round(preview.width * options["scale"]),
+                    round(preview.height * options["scale"]),
+                ),
+                Image.Resampling.LANCZOS,
+            )
+
+        path_out.parent.mkdir(parents=True, exist_ok=True)
+        preview.save(path_out, format="PNG")
+
+        return path_in, None
+
+    except Exception as exc:
+        return path_in, f"{type(exc).__name__}: {exc}"
+
+
+def render_batch(slides, out_dir, measured, options, jobs):
+    tasks = [
+        (path, out_dir / f"{path.stem}.preview.png", measured, options)
+        for path in slides
+    ]
+
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(render_one, tasks, chunksize=4))
+    else:
+        results = [render_one(task) for task in tasks]
+
+    failed = 0
+
+    for path, error in results:
+        if error:
+            failed += 1
+            print(f"NG: {path.name}: {error}", file=sys.stderr)
+
+    return len(results) - failed, failed
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Preview how P-mode slides look on the Spectra 6 panel",
+    )
+
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    measure = sub.add_parser(
+        "measure",
+        help="measure the panel palette from a photo of the test chart",
+    )
+    measure.add_argument("photo", type=Path)
+    measure.add_argument(
+        "--palette",
+        type=Path,
+        default=CONFIG["PALETTE_FILE"],
+    )
+
+    render = sub.add_parser(
+        "render",
+        help="render P-mode PNG files or directories to RGB previews",
+    )
+    render.add_argument("paths", nargs="+", type=Path)
+    render.add_argument(
+        "--out",
+        type=Path,
+        default=Path("previews"),
+    )
+    render.add_argument(
+        "--palette",
+        type=Path,
+        default=CONFIG["PALETTE_FILE"],
+    )
+    render.add_argument(
+        "--overlay",
+        action="store_true",
+        help="draw the slideshow date/status overlays",
+    )
+    render.add_argument(
+        "--metadata",
+        type=Path,
+        default=pp.METADATA_FILE,
+    )
+    render.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="resize previews, e.g. 0.5 for 800x600",
+    )
+    render.add_argument(
+        "--jobs",
+        type=int,
+        default=CONFIG["JOBS"],
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "measure":
+        measured = measure_palette(args.photo)
+        save_palette(args.palette, measured, args.photo)
+
+        for name in PANEL_COLOR_NAMES:
+            print(f"{name:>6}: {tuple(measured[name])}")
+
+        print(f"Saved: {args.palette}")
+        return
+
+    measured = load_palette(args.palette)
+    slides = collect_slides(args.paths)
+
+    if not slides:
+        print("No PNG images found.")
+        return
+
+    options = {
+        "overlay": args.overlay,
+        "metadata": pp.load_metadata(args.metadata) if args.overlay else {},
+        "updated_at": datetime.now(),
+        "scale": args.scale,
+    }
+
+    print(f"Rendering {len(slides)} previews / jobs={args.jobs}")
+
+    started = time.monotonic()
+    done, failed = render_batch(slides, args.out, measured, options, args.jobs)
+
+    print(
+        f"Done: {done} ok / {failed} failed / "
+        f"{time.monotonic() - started:.1f}s -> {args.out}"
+    )
+
+
+if __name__ == "__main__":
+    main()
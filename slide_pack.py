@@ -0,0 +1,638 @@
+#!/usr/bin/env python3
+"""
+スライドライブラリを1ファイルにまとめるパック形式。
+
+photos/auto の数千枚の小さな PNG を1枚ずつ開く代わりに、1つのパックファイルを
+mmap して、固定長の索引からスライドを直接読む。Mac からの同期途中の
+書きかけ PNG を拾わないよう、パックは隣に作ってから rename で差し替える。
+
+形式（リトルエンディアン）:
+
+  header  32 バイト   magic "INKYPAK1", version, 索引レコード長
+  data    PNG をそのまま連結
+  index   256 バイト固定長 × 件数（name, offset, length, crc32,
+          capture_date, mode）。name 順
+  footer  32 バイト   magic "INKYIDX1", 索引の位置, 件数, 索引の crc32, 作成時刻
+
+- append は既存のバイトを書き換えず、末尾に PNG・新しい索引・footer を足す。
+  動いている slideshow の mmap（古い長さ）はそのまま読める
+- 読み込み時は末尾の footer を使う。append の途中で電源が落ちて
+  末尾が壊れていたら、その前の正しい footer まで戻って読む
+- build は <パック>.tmp に書いて fsync してから os.replace で差し替える
+
+例:
+  python3 slide_pack.py build photos photos.pack
+  python3 slide_pack.py append photos.pack photos/auto/new.png --root photos
+  python3 slide_pack.py list photos.pack
+  python3 slide_pack.py verify photos.pack
+"""
+
+import argparse
+import collections
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from pathlib import Path
+
+
+# ============================================================
+# Format
+# ============================================================
+
+MAGIC = b"INKYPAK1"
+FOOTER_MAGIC = b"INKYIDX1"
+VERSION = 1
+
+# magic, version, レコード長, 予約
+HEADER = struct.Struct("<8sHH20s")
+
+# name, offset, length, crc32, capture_date, mode, 予約
+RECORD = struct.Struct("<192sQQI19s16s9x")
+
+# magic, 索引の位置, 件数, 索引の crc32, 作成時刻 (unix)
+FOOTER = struct.Struct("<8sQIIQ")
+
+NAME_BYTES = 192
+DATE_BYTES = 19
+MODE_BYTES = 16
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+PackEntry = collections.namedtuple(
+    "PackEntry",
+    (
+        "name",
+        "offset",
+        "length",
+        "crc32",
+        "capture_date",
+        "mode",
+    ),
+)
+
+
+class PackError(Exception):
+    """パックが壊れている・形式が違う・スライドの crc32 が合わない。"""
+
+
+def is_complete_png(data):
+    """
+    PNG の先頭シグネチャと末尾の IEND があるか。
+
+    同期途中で書きかけのファイルをパックに入れないための確認。
+    """
+    return (
+        bytes(data[:8]) == PNG_SIGNATURE
+        and len(data) >= 20
+        and bytes(data[-8:-4]) == b"IEND"
+    )
+
+
+def _fixed(text, size, field):
+    raw = (text or "").encode("utf-8")
+
+    if len(raw) > size:
+        raise ValueError(f"{field} too long ({len(raw)} > {size} bytes): {text}")
+
+    return raw
+
+
+def _text(raw):
+    return raw.rstrip(b"\0").decode("utf-8")
+
+
+def pack_record(entry):
+    return RECORD.pack(
+        _fixed(entry.name, NAME_BYTES, "name"),
+        entry.offset,
+        entry.length,
+        entry.crc32,
+        _fixed(entry.capture_date, DATE_BYTES, "capture_date"),
+        _fixed(entry.mode, MODE_BYTES, "mode"),
+    )
+
+
+def unpack_record(raw):
+    name, offset, length, crc, capture_date, mode = RECORD.unpack(raw)
+
+    return PackEntry(
+        _text(name),
+        offset,
+        length,
+        crc,
+        _text(capture_date) or None,
+        _text(mode) or None,
+    )
+
+
+# ============================================================
+# Reader
+# ============================================================
+
+class PackMember:
+    """
+    パック内の1枚を、Image.open() に渡せるファイルとして読む。
+
+    view() と同じ mmap の memoryview を持つだけで、ディレクトリ検索も
+    open() もなく、ファイル全体を BytesIO などへ読み込むこともない。
+    Pillow は read() の戻り値に bytes のメソッドを使うので、read() は
+    頼まれた範囲（PNG のチャンク）だけを bytes にコピーして返す。
+    readinto() は渡されたバッファへ mmap から直接書く。
+    """
+
+    def __init__(self, pack, entry):
+        self.pack = pack
+        self.entry = entry
+        self.name = entry.name
+        self.pos = 0
+        self.data = pack.view(entry.name)
+
+    def read(self, size=-1):
+        end = len(self.data)
+
+        if size is not None and size >= 0:
+            end = min(end, self.pos + size)
+
+        data = self.data[self.pos:end].tobytes()
+
+        self.pos = max(self.pos, end)
+
+        return data
+
+    def readinto(self, buffer):
+        with memoryview(buffer).cast("B") as target:
+            data = self.data[self.pos:self.pos + len(target)]
+            target[:len(data)] = data
+
+        self.pos += len(data)
+
+        return len(data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.entry.length
+
+        if offset < 0:
+            raise ValueError("negative seek position")
+
+        self.pos = offset
+
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        # memoryview を放しておくと、SlidePack.close() で mmap を閉じられる
+        self.data.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SlidePack:
+    """
+    パックを mmap して索引を読む。
+
+    差し替え（os.replace）や append の後も、開いた時点の内容を読み続ける。
+    新しい内容を読むには開き直す（stat_key() が変わったら開き直す）。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+        with self.path.open("rb") as f:
+            st = os.fstat(f.fileno())
+
+            if st.st_size < HEADER.size + FOOTER.size:
+                raise PackError(f"Too small for a slide pack: {self.path}")
+
+            self.mm = mmap.mmap(
+                f.fileno(),
+                0,
+                access=mmap.ACCESS_READ,
+            )
+
+        self.stat = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+        magic, version, record_size, _ = HEADER.unpack_from(self.mm, 0)
+
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise PackError(f"Not a version {VERSION} slide pack: {self.path}")
+
+        (
+            self.footer_offset,
+            self.created,
+            entries,
+        ) = self._read_index()
+
+        self.entries = {entry.name: entry for entry in entries}
+
+        # 末尾の footer より前で見つかった = append が途中で止まっていた
+        self.truncated_tail = (
+            len(self.mm) - (self.footer_offset + FOOTER.size)
+        )
+
+    def _read_footer(self, offset):
+        magic, index_offset, count, index_crc, created = FOOTER.unpack_from(
+            self.mm,
+            offset,
+        )
+
+        if magic != FOOTER_MAGIC:
+            return None
+
+        if index_offset + count * RECORD.size != offset:
+            return None
+
+        if index_offset < HEADER.size:
+            return None
+
+        index = self.mm[index_offset:offset]
+
+        if zlib.crc32(index) != index_crc:
+            return None
+
+        return created, [
+            unpack_record(index[i:i + RECORD.size])
+            for i in range(0, len(index), RECORD.size)
+        ]
+
+    def _read_index(self):
+        offset = len(self.mm) - FOOTER.size
+
+        while offset >= HEADER.size:
+            found = self._read_footer(offset)
+
+            if found is not None:
+                created, entries = found
+                return offset, created, entries
+
+            # 壊れた末尾を飛ばして、前の footer を探す
+            offset = self.mm.rfind(FOOTER_MAGIC, HEADER.size, offset)
+
+        raise PackError(f"No valid index found: {self.path}")
+
+    def stat_key(self):
+        return self.stat
+
+    def names(self):
+        return sorted(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def entry(self, name):
+        try:
+            return self.entries[name]
+        except KeyError:
+            raise KeyError(f"{name} not in {self.path}") from None
+
+    def view(self, name):
+        """スライドの PNG バイト列を memoryview で返す（コピーしない）。"""
+        entry = self.entry(name)
+
+        return memoryview(self.mm)[entry.offset:entry.offset + entry.length]
+
+    def verify(self, name):
+        entry = self.entry(name)
+
+        with self.view(name) as data:
+            if zlib.crc32(data) != entry.crc32:
+                raise PackError(f"crc32 mismatch: {name} in {self.path}")
+
+    def open(self, name, verify=True):
+        if verify:
+            self.verify(name)
+
+        return PackMember(self, self.entry(name))
+
+    def sha256(self, name):
+        with self.view(name) as data:
+            return hashlib.sha256(data).hexdigest()
+
+    def close(self):
+        # 開いている PackMember や memoryview があると閉じられないので、
+        # そのときは GC に任せる
+        try:
+            self.mm.close()
+        except BufferError:
+            pass
+
+
+# ============================================================
+# Writer
+# ============================================================
+
+def write_tail(f, entries, created=None):
+    """現在位置に索引と footer を書く。"""
+    ordered = sorted(entries, key=lambda entry: entry.name)
+    index = b"".join(pack_record(entry) for entry in ordered)
+
+    index_offset = f.tell()
+
+    f.write(index)
+    f.write(
+        FOOTER.pack(
+            FOOTER_MAGIC,
+            index_offset,
+            len(ordered),
+            zlib.crc32(index),
+            int(time.time() if created is None else created),
+        )
+    )
+
+
+def write_slides(f, sources, entries):
+    """
+    sources の PNG を現在位置から書き、entries (name -> PackEntry) を更新する。
+
+    sources: (name, path, capture_date, mode) の列
+    返り値: (追加した件数, 書きかけなどで飛ばしたパスの一覧)
+    """
+    added = 0
+    skipped = []
+
+    for name, path, capture_date, mode in sources:
+        data = Path(path).read_bytes()
+
+        if not is_complete_png(data):
+            skipped.append(path)
+            continue
+
+        entries[name] = PackEntry(
+            name,
+            f.tell(),
+            len(data),
+            zlib.crc32(data),
+            capture_date,
+            mode,
+        )
+
+        f.write(data)
+        added += 1
+
+    return added, skipped
+
+
+def fsync_dir(path):
+    fd = os.open(Path(path).parent, os.O_RDONLY)
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def build_pack(pack_path, sources):
+    """
+    新しいパックを <pack_path>.tmp に作り、os.replace で差し替える。
+
+    動いている slideshow は古いパックの mmap を持ったまま読み続け、
+    次の再スキャンで新しいパックを開き直す。
+    """
+    pack_path = Path(pack_path)
+    tmp_path = pack_path.with_name(pack_path.name + ".tmp")
+
+    entries = {}
+
+    try:
+        with tmp_path.open("wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, b""))
+
+            added, skipped = write_slides(f, sources, entries)
+
+            write_tail(f, entries.values())
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, pack_path)
+        fsync_dir(pack_path)
+
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    return added, skipped
+
+
+def append_to_pack(pack_path, sources):
+    """
+    既存のパックの末尾に PNG と新しい索引を足す。同じ name は新しい方で置き換える。
+
+    既存のバイトは書き換えないので、途中で失敗しても元の長さに戻すだけでよく、
+    電源断で末尾が壊れても読み込み側が前の索引に戻る。
+    置き換えた古い PNG の分は build し直すまで残る。
+    """
+    pack_path = Path(pack_path)
+
+    pack = SlidePack(pack_path)
+    entries = dict(pack.entries)
+    original_size = pack.footer_offset + FOOTER.size
+    pack.close()
+
+    with pack_path.open("r+b") as f:
+        # 前回の append の壊れた末尾があれば、その上に書く
+        f.seek(original_size)
+
+        try:
+            added, skipped = write_slides(f, sources, entries)
+
+            write_tail(f, entries.values())
+            f.truncate()
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        except BaseException:
+            f.truncate(original_size)
+            raise
+
+    return added, skipped
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+def load_metadata_index(metadata_file):
+    """ファイル名 -> metadata のエントリ（slideshow.index_metadata と同じ別名も引く）。"""
+    try:
+        with Path(metadata_file).open("r", encoding="utf-8") as f:
+            data = json.load(f)
+
+    except FileNotFoundError:
+        return {}
+
+    index = {}
+
+    for key, entry in data.items():
+        if not isinstance(entry, dict):
+            continue
+
+        for name in (
+            key,
+            entry.get("output"),
+            entry.get("output_name"),
+            entry.get("filename"),
+        ):
+            if name:
+                index.setdefault(Path(str(name)).name, entry)
+
+    return index
+
+
+def describe_source(path, root, metadata):
+    entry = metadata.get(path.name, {})
+
+    capture_date = entry.get("capture_date")
+    mode = entry.get("display_mode") or entry.get("mode")
+
+    return (
+        path.relative_to(root).as_posix(),
+        path,
+        # slideshow.parse_capture_date は先頭 19 文字だけを読む
+        str(capture_date)[:DATE_BYTES] if capture_date else None,
+        str(mode)[:MODE_BYTES] if mode else None,
+    )
+
+
+def collect_sources(root, paths, metadata):
+    root = Path(root).resolve()
+    sources = []
+
+    for path in paths:
+        path = Path(path).resolve()
+
+        if path.is_dir():
+            files = sorted(path.rglob("*.png"))
+        else:
+            files = [path]
+
+        sources.extend(
+            describe_source(p, root, metadata)
+            for p in files
+            if p.is_file() and not p.name.startswith(".")
+        )
+
+    return sources
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build, append to and inspect slide pack files",
+    )
+
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="pack a photo directory (atomic swap)")
+    build.add_argument("photo_dir", type=Path)
+    build.add_argument("pack", type=Path)
+    build.add_argument("--metadata", type=Path, default=None)
+
+    append = sub.add_parser("append", help="append PNG files or directories")
+    append.add_argument("pack", type=Path)
+    append.add_argument("paths", nargs="+", type=Path)
+    append.add_argument(
+        "--root",
+        type=Path,
+        default=Path("photos"),
+        help="slide names are relative to this directory",
+    )
+    append.add_argument("--metadata", type=Path, default=None)
+
+    listing = sub.add_parser("list", help="print the index")
+    listing.add_argument("pack", type=Path)
+
+    verify = sub.add_parser("verify", help="check every slide's crc32")
+    verify.add_argument("pack", type=Path)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command in ("build", "append"):
+        root = args.photo_dir if args.command == "build" else args.root
+        metadata_file = args.metadata or Path(root) / "metadata.json"
+        metadata = load_metadata_index(metadata_file)
+
+        started = time.monotonic()
+
+        if args.command == "build":
+            sources = collect_sources(root, [root], metadata)
+            added, skipped = build_pack(args.pack, sources)
+        else:
+            sources = collect_sources(root, args.paths, metadata)
+            added, skipped = append_to_pack(args.pack, sources)
+
+        for path in skipped:
+            print(f"SKIP (incomplete PNG): {path}", file=sys.stderr)
+
+        pack = SlidePack(args.pack)
+
+        print(
+            f"{args.command}: {added} added / {len(skipped)} skipped / "
+            f"{len(pack)} slides / {pack.stat[1] / 1024 / 1024:.1f}MB / "
+            f"{time.monotonic() - started:.1f}s -> {args.pack}"
+        )
+        return
+
+    pack = SlidePack(args.pack)
+
+    if pack.truncated_tail:
+        print(
+            f"WARN: ignored {pack.truncated_tail} bytes after the last valid index",
+            file=sys.stderr,
+        )
+
+    if args.command == "list":
+        for name in pack.names():
+            entry = pack.entry(name)
+            print(
+                f"{entry.length:>9}  {entry.crc32:08x}  "
+                f"{entry.capture_date or '-':19}  {entry.mode or '-':10}  {name}"
+            )
+
+        print(f"{len(pack)} slides")
+        return
+
+    bad = 0
+
+    for name in pack.names():
+        try:
+            pack.verify(name)
+        except PackError as exc:
+            bad += 1
+            print(f"NG: {exc}", file=sys.stderr)
+
+    print(f"verify: {len(pack) - bad} ok / {bad} bad")
+
+    if bad:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
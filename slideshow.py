@@ -12,85 +12,339 @@ v1.1 preprocessing pipeline 対応スライドショー
 - Pi側では日付・更新時刻・uptimeだけをオーバーレイ
 """
 
+import time
+
+# 起動タイムライン（imports の段）の基準
+STARTUP_STARTED = time.perf_counter()
+
+import asyncio
+import atexit
+import collections
+import contextlib
+import functools
+import hashlib
+import importlib
 import json
 import logging
+import logging.handlers
 import os
 import random
+import shutil
+import signal
 import subprocess
 import threading
-import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from queue import SimpleQueue
+from datetime import datetime, timedelta
 from pathlib import Path
 
-from PIL import Image, ImageDraw, ImageFont
-from dotenv import load_dotenv
+from PIL import Image
+from dotenv import dotenv_values
 
+from panel_driver import (
+    PANEL_PALETTE_BYTES,
+    forget_display_model,
+    open_display,
+    supports_direct_write,
+    write_indices,
+)
+
+# ImageDraw / ImageFont はオーバーレイを描くときに、
+# inky と gpiozero は使う関数の中で import する（起動を速くするため）。
+# gzip（ローテーション）/ socket（sd_notify）/ tracemalloc（メモリ計測）も、
+# 最初のフレームに要らないので使うところで import する。
+# numpy は FrameBuffer まで要らないので、main() の初めから別スレッドで読み込む。
 
-load_dotenv()
+IMPORTS_DONE = time.perf_counter()
 
 
 # ============================================================
-# Paths / state
+# Environment
 # ============================================================
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 
-IMAGE_DIR = Path(
+ENV_FILE = Path(
     os.getenv(
-        "PHOTO_DIR",
-        str(SCRIPT_DIR / "photos" / "auto"),
+        "SLIDESHOW_ENV_FILE",
+        str(SCRIPT_DIR / ".env"),
     )
 )
 
-METADATA_FILE = Path(
-    os.getenv(
-        "METADATA_FILE",
-        str(SCRIPT_DIR / "photos" / "metadata.json"),
+# systemd の Environment= などで最初から与えられた変数。
+# load_dotenv() と同じく、これらは .env より優先する。
+BASE_ENVIRON = frozenset(os.environ)
+
+# 直前に .env から読み込んだ変数名
+_ENV_FROM_FILE = set()
+
+
+def load_env_file():
+    """
+    .env を os.environ へ反映する。
+
+    再読み込みでは、.env から消えた変数も環境から取り除く。
+    """
+    global _ENV_FROM_FILE
+
+    try:
+        values = dotenv_values(ENV_FILE)
+    except OSError:
+        values = {}
+
+    for key in _ENV_FROM_FILE - set(values):
+        os.environ.pop(key, None)
+
+    loaded = set()
+
+    for key, value in values.items():
+        if key in BASE_ENVIRON or value is None:
+            continue
+
+        os.environ[key] = value
+        loaded.add(key)
+
+    _ENV_FROM_FILE = loaded
+
+
+load_env_file()
+
+
+# ============================================================
+# Paths / state
+# ============================================================
+
+def resolve_paths():
+    image_dir = Path(
+        os.getenv(
+            "PHOTO_DIR",
+            str(SCRIPT_DIR / "photos" / "auto"),
+        )
+    )
+
+    metadata_file = Path(
+        os.getenv(
+            "METADATA_FILE",
+            str(SCRIPT_DIR / "photos" / "metadata.json"),
+        )
+    )
+
+    # 設定するとフォルダの代わりにパック（slide_pack.py）からスライドを読む
+    photo_pack = os.getenv("PHOTO_PACK", "").strip()
+
+    return (
+        image_dir,
+        metadata_file,
+        Path(photo_pack) if photo_pack else None,
     )
-)
+
+
+IMAGE_DIR, METADATA_FILE, PHOTO_PACK = resolve_paths()
 
 STATE_FILE = Path.home() / ".cache" / "slideshow_state_133.json"
 COUNTER_FILE = Path.home() / ".logs" / "slideshow_counter_133.txt"
+BUDGET_FILE = Path.home() / ".cache" / "slideshow_refresh_budget_133.json"
+DISPLAY_RECORD_FILE = Path.home() / ".cache" / "slideshow_display_133.json"
+STAGE_HISTORY_FILE = Path.home() / ".cache" / "slideshow_stage_history_133.json"
+LIBRARY_CHANGES_FILE = (
+    Path.home() / ".cache" / "slideshow_library_changes_133.jsonl"
+)
 HEARTBEAT_PATH = Path("/tmp/inky_slideshow_heartbeat")
 
+# 長い待ち（静音時間帯・回数上限で翌日まで延期など）の間も、
+# watch_slideshow_heartbeat.py のしきい値より十分短い間隔でハートビートを書く
+HEARTBEAT_REFRESH_SECONDS = 300
+MEMORY_REPORT_FILE = (
+    Path.home() / ".logs" / "slideshow_logs" / "memory_report_133.json"
+)
+
 
 # ============================================================
-# Runtime state
+# Configuration
 # ============================================================
 
-NEXT_IMAGE_EVENT = threading.Event()
-BUTTON_B_PRESSED_AT = None
+def build_config():
+    return {
+        "FONT_PATH": os.getenv(
+            "FONT_PATH",
+            "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+        ),
+
+        "INTERVAL_SECONDS": int(
+            os.getenv("INTERVAL_SECONDS", "1800")
+        ),
 
+        # 例: "23:00-06:30,12:00-12:30"（空なら無効）
+        "QUIET_HOURS": os.getenv("QUIET_HOURS", ""),
 
-# ============================================================
-# Configuration
-# ============================================================
+        # 1日あたりのリフレッシュ上限（0 = 無制限）
+        "DAILY_REFRESH_BUDGET": int(
+            os.getenv("DAILY_REFRESH_BUDGET", "0")
+        ),
 
-CONFIG = {
-    "FONT_PATH": os.getenv(
-        "FONT_PATH",
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-    ),
+        # show() 直前に get_throttled を確認し、電圧低下中は延期する
+        "POWER_GUARD": os.getenv("POWER_GUARD", "1") == "1",
+        "POWER_BACKOFF_SECONDS": int(
+            os.getenv("POWER_BACKOFF_SECONDS", "60")
+        ),
+        "POWER_BACKOFF_MAX_SECONDS": int(
+            os.getenv("POWER_BACKOFF_MAX_SECONDS", "900")
+        ),
 
-    "INTERVAL_SECONDS": int(
-        os.getenv("INTERVAL_SECONDS", "1800")
-    ),
+        # バックグラウンドの定期処理（秒）
+        "RESCAN_SECONDS": int(
+            os.getenv("RESCAN_SECONDS", "600")
+        ),
+        # .env / metadata.json の更新確認間隔
+        "RELOAD_CHECK_SECONDS": int(
+            os.getenv("RELOAD_CHECK_SECONDS", "30")
+        ),
+        "TELEMETRY_SECONDS": int(
+            os.getenv("TELEMETRY_SECONDS", "900")
+        ),
 
-    "FONT_SIZE": 20,
-    "DATE_FONT_SIZE": 24,
+        # メモリ観測モード（既定はオフ）
+        "MEMORY_MONITOR": os.getenv("MEMORY_MONITOR", "0") == "1",
+        # 何枚ごとに tracemalloc のスナップショット差分を取るか
+        "MEMORY_SNAPSHOT_EVERY": int(
+            os.getenv("MEMORY_SNAPSHOT_EVERY", "50")
+        ),
+        # 単調増加を判定する窓（枚数）と、窓内の増加量のしきい値
+        "MEMORY_WINDOW": int(
+            os.getenv("MEMORY_WINDOW", "200")
+        ),
+        "MEMORY_GROWTH_MB": float(
+            os.getenv("MEMORY_GROWTH_MB", "8")
+        ),
 
-    "DATE_POSITIONS": [
-        "bottom-right",
-        "top-right",
-        "top-left",
-        "bottom-left",
-    ],
+        # デコード〜パネルバッファ書き込みまでの、1枚あたりのピーク増分の上限
+        "FRAME_PEAK_BUDGET_MB": float(
+            os.getenv("FRAME_PEAK_BUDGET_MB", "8")
+        ),
 
-    "MARGIN": 25,
-    "BACKGROUND_PADDING": 15,
-    "TEXT_PADDING": 12,
-    "LINE_SPACING": 8,
-}
+        # ログのローテーション（LOG_MAX_BYTES ごと、gzip で LOG_BACKUP_COUNT 世代）
+        "LOG_MAX_BYTES": int(
+            os.getenv("LOG_MAX_BYTES", str(5 * 1024 * 1024))
+        ),
+        "LOG_BACKUP_COUNT": int(
+            os.getenv("LOG_BACKUP_COUNT", "5")
+        ),
+
+        # RAM にバッファして SD カードへの書き込みをまとめる
+        # （WARNING 以上はすぐ書き出す）。電源断ではバッファ分の INFO が
+        # 失われるので、既定は無効。
+        "LOG_BUFFER": os.getenv("LOG_BUFFER", "0") == "1",
+        "LOG_BUFFER_CAPACITY": int(
+            os.getenv("LOG_BUFFER_CAPACITY", "200")
+        ),
+        "LOG_FLUSH_SECONDS": int(
+            os.getenv("LOG_FLUSH_SECONDS", "60")
+        ),
+
+        # スライドは PNG の plugin だけで開く（ほかの形式の判定を試さない）
+        "PNG_ONLY": os.getenv("PNG_ONLY", "1") == "1",
+
+        # inky.auto で検出したドライバを覚えて、次回から EEPROM の検出を省く
+        "DISPLAY_MODEL_CACHE": os.getenv("DISPLAY_MODEL_CACHE", "1") == "1",
+
+        # パネルドライバを別プロセス (display_worker.py) で動かす
+        "DISPLAY_WORKER": os.getenv("DISPLAY_WORKER", "1") == "1",
+        "DISPLAY_WORKER_INIT_TIMEOUT": float(
+            os.getenv("DISPLAY_WORKER_INIT_TIMEOUT", "120")
+        ),
+        "DISPLAY_WORKER_COMMAND_TIMEOUT": float(
+            os.getenv("DISPLAY_WORKER_COMMAND_TIMEOUT", "30")
+        ),
+        "DISPLAY_WORKER_SHOW_TIMEOUT": float(
+            os.getenv("DISPLAY_WORKER_SHOW_TIMEOUT", "180")
+        ),
+
+        # 段ごとのハング検出（decode / overlay / set_image / show / persist）
+        "STAGE_WATCHDOG": os.getenv("STAGE_WATCHDOG", "1") == "1",
+        # タイムアウト = 直近の所要時間の最大値 × FACTOR（MIN_SECONDS 以上）
+        "STAGE_TIMEOUT_FACTOR": float(
+            os.getenv("STAGE_TIMEOUT_FACTOR", "4")
+        ),
+        "STAGE_TIMEOUT_MIN_SECONDS": float(
+            os.getenv("STAGE_TIMEOUT_MIN_SECONDS", "30")
+        ),
+
+        "FONT_SIZE": 20,
+        "DATE_FONT_SIZE": 24,
+
+        "DATE_POSITIONS": [
+            "bottom-right",
+            "top-right",
+            "top-left",
+            "bottom-left",
+        ],
+
+        "MARGIN": 25,
+        "BACKGROUND_PADDING": 15,
+        "TEXT_PADDING": 12,
+        "LINE_SPACING": 8,
+    }
+
+
+CONFIG = build_config()
+
+
+def reload_environment():
+    """
+    .env を読み直して、CONFIG とパスを組み立て直す。
+
+    CONFIG は同じ dict を書き換えるので、参照している側はそのまま使える。
+
+    返り値: 値が変わったキーの一覧
+    """
+    global IMAGE_DIR
+    global METADATA_FILE
+    global PHOTO_PACK
+
+    old_config = dict(CONFIG)
+    old_paths = {
+        "PHOTO_DIR": IMAGE_DIR,
+        "METADATA_FILE": METADATA_FILE,
+        "PHOTO_PACK": PHOTO_PACK,
+    }
+
+    load_env_file()
+
+    # 値が壊れていたら（int() の失敗など）ここで例外になり、
+    # 今の CONFIG はそのまま残る。
+    new_config = build_config()
+
+    IMAGE_DIR, METADATA_FILE, PHOTO_PACK = resolve_paths()
+
+    CONFIG.clear()
+    CONFIG.update(new_config)
+
+    new_paths = {
+        "PHOTO_DIR": IMAGE_DIR,
+        "METADATA_FILE": METADATA_FILE,
+        "PHOTO_PACK": PHOTO_PACK,
+    }
+
+    changed = [
+        key
+        for key in CONFIG
+        if CONFIG[key] != old_config.get(key)
+    ]
+
+    changed.extend(
+        key
+        for key in new_paths
+        if new_paths[key] != old_paths[key]
+    )
+
+    return changed
+
+
+def file_mtime(path):
+    try:
+        return Path(path).stat().st_mtime_ns
+    except OSError:
+        return None
 
 
 logger = None
@@ -100,38 +354,314 @@ logger = None
 # Logging
 # ============================================================
 
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# setup_logging() が登録する、キューとバッファを書き出して閉じる関数
+LOG_SHUTDOWN = None
+
+
+def gzip_namer(name):
+    return name + ".gz"
+
+
+def gzip_rotator(source, dest):
+    """ローテートしたログを gzip で圧縮して保存する。"""
+    import gzip
+
+    with open(source, "rb") as f_in:
+        with gzip.open(dest, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+
+    os.remove(source)
+
+
+def start_periodic_flush(handler, interval_seconds):
+    """バッファしたログを interval_seconds ごとに SD カードへ書き出す。"""
+    def run():
+        while True:
+            time.sleep(interval_seconds)
+            handler.flush()
+
+    thread = threading.Thread(
+        target=run,
+        name="log-flush",
+        daemon=True,
+    )
+    thread.start()
+
+    return thread
+
+
 def setup_logging():
+    """
+    ログは QueueHandler でキューへ入れるだけにして、
+    ファイル・標準エラーへの書き込みは QueueListener のスレッドで行う。
+    表示ループや gpiozero のスレッドがログの書き込みで止まらない。
+
+    - ファイルは LOG_MAX_BYTES でローテートし、古いものは gzip で圧縮
+    - LOG_BUFFER=1 なら RAM 上にバッファし、LOG_FLUSH_SECONDS ごと
+      または WARNING 以上が来たらすぐに SD カードへ書き出す
+    """
     log_dir = Path.home() / ".logs" / "slideshow_logs"
     log_dir.mkdir(parents=True, exist_ok=True)
 
     log_file = log_dir / "slideshow_133.log"
 
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file,
+        maxBytes=CONFIG["LOG_MAX_BYTES"],
+        backupCount=CONFIG["LOG_BACKUP_COUNT"],
+        encoding="utf-8",
+    )
+    file_handler.namer = gzip_namer
+    file_handler.rotator = gzip_rotator
+    file_handler.setFormatter(formatter)
+
+    if CONFIG["LOG_BUFFER"]:
+        file_target = logging.handlers.MemoryHandler(
+            capacity=CONFIG["LOG_BUFFER_CAPACITY"],
+            flushLevel=logging.WARNING,
+            target=file_handler,
+        )
+
+        start_periodic_flush(
+            file_target,
+            CONFIG["LOG_FLUSH_SECONDS"],
+        )
+
+    else:
+        file_target = file_handler
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue = SimpleQueue()
+
+    listener = logging.handlers.QueueListener(
+        log_queue,
+        file_target,
+        stream_handler,
+        respect_handler_level=True,
+    )
+    listener.start()
+
+    def shutdown():
+        # キューに残ったレコードを処理してから、バッファを書き出す
+        listener.stop()
+        file_target.close()
+        file_handler.close()
+
+    atexit.register(shutdown)
+
+    global LOG_SHUTDOWN
+    LOG_SHUTDOWN = shutdown
+
+    # QueueHandler はメッセージ（と例外のトレースバック）だけを文字列にし、
+    # 時刻・レベルの書式はリスナー側のハンドラで付ける。
     logging.basicConfig(
         level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(message)s",
+        format="%(message)s",
         handlers=[
-            logging.FileHandler(log_file),
-            logging.StreamHandler(),
+            logging.handlers.QueueHandler(log_queue),
         ],
     )
 
     return logging.getLogger(__name__)
 
 
+# ============================================================
+# Startup
+# ============================================================
+
+def process_age_seconds():
+    """プロセスが起動してからの秒数（/proc/self/stat の starttime）。"""
+    try:
+        with open("/proc/self/stat", "r", encoding="utf-8") as f:
+            # comm に空白が入ることがあるので ")" の後ろから数える
+            fields = f.read().rsplit(")", 1)[1].split()
+
+        with open("/proc/uptime", "r", encoding="utf-8") as f:
+            uptime = float(f.read().split()[0])
+
+        # starttime は stat の22番目（")" の後ろでは20番目）
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def slide_formats():
+    """
+    スライドの Image.open() に渡す formats。
+
+    PNG_ONLY=1 なら PNG の plugin だけで判定し、ほかの形式の判定を試さない。
+    スライドは preprocess_photos.py が書き出す PNG だけなので、
+    PNG 以外が来たら開けないエラーにする。
+    """
+    return ("PNG",) if CONFIG["PNG_ONLY"] else None
+
+
+class StartupTimeline:
+    """
+    起動から最初のフレームまでを段ごとに測り、1行でログに出す。
+
+    python（インタプリタの起動）/ imports / config / logging / metadata /
+    display / queue / first frame の順。time-to-first-frame の悪化をログで追える。
+    """
+
+    def __init__(self, started):
+        self.started = started
+        self.last = started
+        self.phases = []
+        self.notes = {}
+        self.reported = False
+
+        # perf_counter の基準より前（インタプリタの起動と site の import）
+        age = process_age_seconds()
+
+        self.interpreter_seconds = (
+            max(0.0, age - (time.perf_counter() - started))
+            if age is not None
+            else None
+        )
+
+    def mark(self, phase, at=None):
+        now = time.perf_counter() if at is None else at
+
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def note(self, phase, text):
+        """段に添える補足（別スレッドで済んだ import など）。"""
+        self.notes.setdefault(phase, []).append(text)
+
+    def report(self, note=None):
+        if self.reported:
+            return
+
+        self.reported = True
+
+        phases = list(self.phases)
+
+        if self.interpreter_seconds is not None:
+            phases.insert(0, ("python", self.interpreter_seconds))
+
+        logger.info(
+            "Startup timeline: %s / total %.2fs%s",
+            ", ".join(
+                f"{phase} {seconds:.2f}s"
+                + (
+                    f" ({', '.join(self.notes[phase])})"
+                    if phase in self.notes
+                    else ""
+                )
+                for phase, seconds in phases
+            ),
+            sum(seconds for _, seconds in phases),
+            f" ({note})" if note else "",
+        )
+
+
+def preload_module(name, startup=None):
+    """
+    最初のフレームまでに要るが、main() の初めにはまだ要らないモジュールを
+    別スレッドで import する。設定・ログ・metadata の準備と並行して読み込める。
+
+    使う側は普通に import すればよく、読み込み中ならそこで待つ。
+    かかった時間は起動タイムラインの imports の段に添える。
+    """
+    def run():
+        started = time.perf_counter()
+
+        try:
+            importlib.import_module(name)
+
+        except ImportError:
+            # 使う側の import で改めて例外になる
+            return
+
+        if startup is not None:
+            startup.note(
+                "imports",
+                f"{name} {time.perf_counter() - started:.2f}s in background",
+            )
+
+    thread = threading.Thread(
+        target=run,
+        name=f"import-{name}",
+        daemon=True,
+    )
+    thread.start()
+
+    return thread
+
+
 # ============================================================
 # Inky
 # ============================================================
 
 def initialize_display():
+    """
+    13.3" Spectra 6 を初期化する。
+
+    キャッシュしたドライバで初期化に失敗した場合は、キャッシュを消して
+    inky.auto の検出からもう一度だけやり直す。
+    """
+    try:
+        return create_display()
+
+    except Exception:
+        if not (
+            CONFIG["DISPLAY_MODEL_CACHE"]
+            and forget_display_model()
+        ):
+            raise
+
+        logger.exception(
+            "Display init failed with the cached display model; "
+            "retrying with inky.auto"
+        )
+
+        return create_display()
+
+
+def create_display():
     """
     13.3" Spectra 6 を自動検出する。
 
     Dummy displayへ黙ってフォールバックしない。
     ハードウェア初期化に失敗した場合は、その場で異常終了させる。
+
+    DISPLAY_WORKER=1 では、ドライバは表示ワーカーのプロセスで作り、
+    ここでは同じ形で使える DisplayWorker を返す。
     """
-    from inky.auto import auto
+    if CONFIG["DISPLAY_WORKER"]:
+        from display_worker import DisplayWorker
+
+        inky = DisplayWorker(
+            factory="panel_driver:open_display",
+            factory_kwargs={
+                "use_cache": CONFIG["DISPLAY_MODEL_CACHE"],
+            },
+            init_timeout=CONFIG["DISPLAY_WORKER_INIT_TIMEOUT"],
+            command_timeout=CONFIG["DISPLAY_WORKER_COMMAND_TIMEOUT"],
+            show_timeout=CONFIG["DISPLAY_WORKER_SHOW_TIMEOUT"],
+        )
+
+        logger.info(
+            "Detected display: %s (display worker) / %dx%d",
+            inky.driver,
+            inky.width,
+            inky.height,
+        )
+
+        return inky
 
-    inky = auto(verbose=True)
+    inky = open_display(
+        use_cache=CONFIG["DISPLAY_MODEL_CACHE"],
+    )
 
     logger.info(
         "Detected display: %s / %dx%d",
@@ -156,9 +686,13 @@ def initialize_display():
 # Buttons
 # ============================================================
 
-def setup_buttons():
-    global BUTTON_B_PRESSED_AT
+def setup_buttons(on_event):
+    """
+    gpiozero のコールバックは gpiozero のスレッドで呼ばれる。
 
+    ここでは (ボタン名, "pressed"/"released", monotonic 時刻) を
+    on_event へ渡すだけにして、状態の更新はイベントループ側で行う。
+    """
     try:
         from gpiozero import Button
     except Exception as exc:
@@ -180,55 +714,23 @@ def setup_buttons():
         bounce_time=0.08,
     )
 
-    def on_a_pressed():
-        logger.info(
-            "Button A pressed: next image requested"
-        )
-        NEXT_IMAGE_EVENT.set()
-
-    def on_b_pressed():
-        global BUTTON_B_PRESSED_AT
-
-        BUTTON_B_PRESSED_AT = time.monotonic()
-
-        logger.info("Button B pressed")
-
-    def on_b_released():
-        global BUTTON_B_PRESSED_AT
-
-        if BUTTON_B_PRESSED_AT is None:
-            return
-
-        held = (
-            time.monotonic()
-            - BUTTON_B_PRESSED_AT
-        )
-
-        BUTTON_B_PRESSED_AT = None
-
-        if held >= 3.0:
-            logger.warning(
-                "Button B long press %.2fs: poweroff",
-                held,
-            )
-
-            subprocess.Popen(
-                ["sudo", "/usr/sbin/poweroff"]
-            )
-
-        else:
-            logger.warning(
-                "Button B short press %.2fs: reboot",
-                held,
-            )
+    btn_a.when_pressed = lambda: on_event(
+        "A",
+        "pressed",
+        time.monotonic(),
+    )
 
-            subprocess.Popen(
-                ["sudo", "/usr/sbin/reboot"]
-            )
+    btn_b.when_pressed = lambda: on_event(
+        "B",
+        "pressed",
+        time.monotonic(),
+    )
 
-    btn_a.when_pressed = on_a_pressed
-    btn_b.when_pressed = on_b_pressed
-    btn_b.when_released = on_b_released
+    btn_b.when_released = lambda: on_event(
+        "B",
+        "released",
+        time.monotonic(),
+    )
 
     logger.info(
         "Buttons enabled: "
@@ -238,6 +740,19 @@ def setup_buttons():
     return [btn_a, btn_b]
 
 
+def skip_queue_entries(queue, count):
+    """
+    連打された分だけ、描画せずにキューを進める。
+
+    返り値: 実際に飛ばしたパス
+    """
+    skipped = queue[:max(0, count)]
+
+    del queue[:len(skipped)]
+
+    return skipped
+
+
 # ============================================================
 # Metadata
 # ============================================================
@@ -262,7 +777,7 @@ def load_metadata():
             len(data),
         )
 
-        return data
+        return index_metadata(data)
 
     except Exception:
         logger.exception(
@@ -272,6 +787,33 @@ def load_metadata():
         return {}
 
 
+def index_metadata(data):
+    """
+    ファイル名だけで引けるよう、output 系のキーも別名として加えた dict を返す。
+
+    get_metadata_entry() の線形探索を、表示のたびに走らせないための索引。
+    """
+    index = dict(data)
+
+    for key, entry in data.items():
+        if not isinstance(entry, dict):
+            continue
+
+        for name in (
+            Path(str(key)).name,
+            entry.get("output"),
+            entry.get("output_name"),
+            entry.get("filename"),
+        ):
+            if name:
+                index.setdefault(
+                    Path(str(name)).name,
+                    entry,
+                )
+
+    return index
+
+
 def parse_capture_date(value):
     """
     Mac側metadataに保存される各種日時表記を受け入れる。
@@ -345,7 +887,7 @@ def get_metadata_entry(image_path, metadata):
         if filename in possible_names:
             return entry
 
-    return None
+    return pack_metadata_entry(image_path)
 
 
 def get_capture_date(
@@ -452,6 +994,149 @@ def reset_state():
         pass
 
 
+# ============================================================
+# Display record
+# ============================================================
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+
+            if not chunk:
+                break
+
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def write_display_record(record):
+    """
+    表示記録を原子的に書き込む。
+
+    電源断の最中でも、古い記録か新しい記録のどちらかが残るようにする。
+    """
+    try:
+        DISPLAY_RECORD_FILE.parent.mkdir(
+            parents=True,
+            exist_ok=True,
+        )
+
+        tmp_file = DISPLAY_RECORD_FILE.with_suffix(".tmp")
+
+        with tmp_file.open(
+            "w",
+            encoding="utf-8",
+        ) as f:
+            json.dump(
+                record,
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_file, DISPLAY_RECORD_FILE)
+
+    except Exception:
+        logger.exception(
+            "Failed to save display record"
+        )
+
+
+def mark_display_pending(image_path):
+    """
+    show() の直前に呼ぶ。
+
+    リフレッシュの途中で落ちた場合、パネルの中身は分からないので、
+    次の起動では必ずリフレッシュさせる。
+    """
+    write_display_record(
+        {
+            "pending": str(image_path),
+        }
+    )
+
+
+def save_display_record(
+    image_path,
+    frame_sha256,
+    shown_at,
+    interval_seconds,
+    size,
+):
+    """show() が終わったら、今パネルに出ているフレームを記録する。"""
+    write_display_record(
+        {
+            "path": str(image_path),
+            "source_sha256": slide_sha256(image_path),
+            "frame_sha256": frame_sha256,
+            "size": list(size),
+            "shown_at": shown_at.timestamp(),
+            "deadline": shown_at.timestamp() + interval_seconds,
+        }
+    )
+
+
+def load_display_record():
+    try:
+        with DISPLAY_RECORD_FILE.open(
+            "r",
+            encoding="utf-8",
+        ) as f:
+            return json.load(f)
+
+    except Exception:
+        return None
+
+
+def startup_resume_delay(record, size, now=None):
+    """
+    起動直後のリフレッシュを省略できるなら、次の表示までの秒数を返す。
+    省略できなければ None。
+
+    - 前回の show() が最後まで終わっている
+    - 元の PNG が残っていて、内容（sha256）が変わっていない
+    - パネルの解像度が同じ
+    - 保存した締め切りをまだ過ぎていない
+
+    Zero 2 W には RTC がなく、起動直後は時計がずれていることがあるので、
+    待ち時間は INTERVAL_SECONDS を上限にする。
+    """
+    if not record or "pending" in record:
+        return None
+
+    path = record.get("path")
+
+    if not path or not slide_exists(path):
+        return None
+
+    if record.get("size") != list(size):
+        return None
+
+    try:
+        if slide_sha256(path) != record.get("source_sha256"):
+            return None
+    except OSError:
+        return None
+
+    now = time.time() if now is None else now
+    remaining = record.get("deadline", 0) - now
+
+    if remaining <= 0:
+        return None
+
+    return min(
+        remaining,
+        CONFIG["INTERVAL_SECONDS"],
+    )
+
+
 # ============================================================
 # Display counter
 # ============================================================
@@ -486,11 +1171,22 @@ def save_display_counter(counter):
 # Heartbeat
 # ============================================================
 
-def update_heartbeat():
+def update_heartbeat(details=None):
+    """
+    ハートビートを JSON で書く。
+
+    watch_slideshow_heartbeat.py は mtime だけを見るので、
+    中身は人間とログ解析向けの詳細（今の段、所要時間など）。
+    """
     try:
         HEARTBEAT_PATH.write_text(
-            datetime.now().isoformat(
-                timespec="minutes"
+            json.dumps(
+                {
+                    "updated_at": datetime.now().isoformat(
+                        timespec="seconds"
+                    ),
+                    **(details or {}),
+                }
             )
         )
 
@@ -500,6 +1196,429 @@ def update_heartbeat():
         )
 
 
+# ============================================================
+# Stage watchdog
+# ============================================================
+
+STAGES = (
+    "decode",
+    "overlay",
+    "set_image",
+    "show",
+    "persist",
+)
+
+# 履歴がたまるまでのタイムアウト（秒）。
+# show は inky 側の refresh 待ち (65s) に余裕を持たせる。
+DEFAULT_STAGE_TIMEOUTS = {
+    "decode": 120,
+    "overlay": 60,
+    "set_image": 60,
+    "show": 300,
+    "persist": 60,
+}
+
+# 段のタイムアウトで終了するときの終了コード（EX_TEMPFAIL）。
+# systemd の Restart=always で再起動され、ログで普通の異常終了と区別できる。
+EXIT_STAGE_TIMEOUT = 75
+
+# 履歴から決めるのに必要な最低サンプル数
+STAGE_HISTORY_MIN_SAMPLES = 5
+
+
+def flush_logging(timeout=5.0):
+    """
+    os._exit() の前に、キューとバッファのログを書き出す。
+
+    SD カードが詰まっていても終了できるよう、timeout で打ち切る。
+    """
+    if LOG_SHUTDOWN is None:
+        return
+
+    thread = threading.Thread(
+        target=LOG_SHUTDOWN,
+        daemon=True,
+    )
+    thread.start()
+    thread.join(timeout)
+
+
+class StageTracker:
+    """
+    表示処理のどの段にいるか、いつからかを記録し、
+    別スレッドの watchdog で段ごとのタイムアウトを監視する。
+
+    タイムアウトは段ごとの直近の所要時間から決める
+    (最大値 × factor、min_seconds 以上)。履歴はファイルに残すので、
+    再起動しても学習し直さない。
+
+    on_timeout と clock は差し替え可能。
+    """
+
+    def __init__(
+        self,
+        history_file=STAGE_HISTORY_FILE,
+        factor=4.0,
+        min_seconds=30.0,
+        history_size=50,
+        check_interval=5.0,
+        clock=time.monotonic,
+        on_timeout=None,
+    ):
+        self.history_file = Path(history_file)
+        self.factor = factor
+        self.min_seconds = min_seconds
+        self.check_interval = check_interval
+        self.clock = clock
+        self.on_timeout = on_timeout or self.exit_on_timeout
+
+        self.lock = threading.Lock()
+        self.stage = None
+        self.stage_started = None
+        self.slide = None
+
+        # 別の仕組みがタイムアウトを見ている段（時間は記録するが終了しない）
+        self.supervised = set()
+
+        # 段に入るたびに (段, スライド名) で呼ばれる（systemd の STATUS 用）
+        self.listener = None
+
+        self.history = {
+            stage: collections.deque(maxlen=history_size)
+            for stage in STAGES
+        }
+
+        self._load_history()
+
+    # ---------- history ----------
+
+    def _load_history(self):
+        try:
+            with self.history_file.open(
+                "r",
+                encoding="utf-8",
+            ) as f:
+                data = json.load(f)
+
+            for stage, values in data.items():
+                if stage in self.history:
+                    self.history[stage].extend(
+                        float(value) for value in values
+                    )
+
+        except Exception:
+            pass
+
+    def save_history(self):
+        try:
+            self.history_file.parent.mkdir(
+                parents=True,
+                exist_ok=True,
+            )
+
+            with self.lock:
+                data = {
+                    stage: [round(value, 3) for value in values]
+                    for stage, values in self.history.items()
+                }
+
+            self.history_file.write_text(
+                json.dumps(data)
+            )
+
+        except Exception:
+            logger.exception(
+                "Failed to save stage history"
+            )
+
+    def timeout_for(self, stage):
+        values = self.history[stage]
+
+        if len(values) < STAGE_HISTORY_MIN_SAMPLES:
+            return DEFAULT_STAGE_TIMEOUTS[stage]
+
+        return max(
+            self.min_seconds,
+            max(values) * self.factor,
+        )
+
+    # ---------- stages ----------
+
+    @contextlib.contextmanager
+    def track(self, stage, slide=None):
+        """with の間をその段として記録する。成功したときだけ履歴に入れる。"""
+        with self.lock:
+            self.stage = stage
+            self.stage_started = self.clock()
+            self.slide = slide or self.slide
+
+        self.heartbeat()
+
+        if self.listener is not None:
+            self.listener(stage, self.slide)
+
+        completed = False
+
+        try:
+            yield
+            completed = True
+
+        finally:
+            with self.lock:
+                if completed:
+                    self.history[stage].append(
+                        self.clock() - self.stage_started
+                    )
+
+                self.stage = None
+                self.stage_started = None
+
+    def snapshot(self):
+        with self.lock:
+            now = self.clock()
+
+            return {
+                "stage": self.stage or "idle",
+                "stage_elapsed": (
+                    round(now - self.stage_started, 1)
+                    if self.stage_started is not None
+                    else None
+                ),
+                "slide": self.slide,
+                "timeouts": {
+                    stage: round(self.timeout_for(stage), 1)
+                    for stage in STAGES
+                },
+                "last_seconds": {
+                    stage: round(values[-1], 2)
+                    for stage, values in self.history.items()
+                    if values
+                },
+            }
+
+    def heartbeat(self):
+        update_heartbeat(self.snapshot())
+
+    # ---------- watchdog ----------
+
+    def start(self):
+        thread = threading.Thread(
+            target=self._watch,
+            name="stage-watchdog",
+            daemon=True,
+        )
+        thread.start()
+
+        logger.info(
+            "Stage watchdog started: %s",
+            ", ".join(
+                f"{stage}={self.timeout_for(stage):.0f}s"
+                for stage in STAGES
+            ),
+        )
+
+        return thread
+
+    def overdue(self):
+        """
+        タイムアウトを過ぎている段を (段, 経過秒, 上限秒, スライド名) で返す。
+
+        ほかの仕組みが見ている段 (supervised) と、段の外（idle）では None。
+        """
+        with self.lock:
+            stage = self.stage
+            started = self.stage_started
+            slide = self.slide
+
+        if stage is None or stage in self.supervised:
+            return None
+
+        elapsed = self.clock() - started
+        limit = self.timeout_for(stage)
+
+        if elapsed <= limit:
+            return None
+
+        return stage, elapsed, limit, slide
+
+    def check(self):
+        """タイムアウトした段があれば on_timeout を呼ぶ。watchdog スレッドから呼ばれる。"""
+        overdue = self.overdue()
+
+        if overdue is None:
+            return False
+
+        self.on_timeout(*overdue)
+
+        return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.check_interval)
+
+            try:
+                self.check()
+            except Exception:
+                logger.exception(
+                    "Stage watchdog check failed"
+                )
+
+    def exit_on_timeout(self, stage, elapsed, limit, slide):
+        """
+        ハングした SPI/GPIO 呼び出しは中断できないので、プロセスごと終了する。
+        """
+        logger.critical(
+            "Stage '%s' stuck for %.0fs (limit %.0fs, slide %s); "
+            "exiting with code %d for systemd to restart",
+            stage,
+            elapsed,
+            limit,
+            slide,
+            EXIT_STAGE_TIMEOUT,
+        )
+
+        details = self.snapshot()
+        details["timed_out"] = stage
+
+        update_heartbeat(details)
+        flush_logging()
+
+        os._exit(EXIT_STAGE_TIMEOUT)
+
+
+def create_stage_tracker():
+    return StageTracker(
+        factor=CONFIG["STAGE_TIMEOUT_FACTOR"],
+        min_seconds=CONFIG["STAGE_TIMEOUT_MIN_SECONDS"],
+    )
+
+
+# ============================================================
+# systemd notify
+# ============================================================
+
+def watchdog_interval_seconds(environ=None):
+    """
+    systemd の WatchdogSec（WATCHDOG_USEC）を秒で返す。設定されていなければ None。
+
+    WATCHDOG_PID があり、自分の pid でなければ None（子プロセス向けではない）。
+    """
+    environ = os.environ if environ is None else environ
+
+    usec = environ.get("WATCHDOG_USEC")
+    pid = environ.get("WATCHDOG_PID")
+
+    if not usec:
+        return None
+
+    try:
+        if pid and int(pid) != os.getpid():
+            return None
+
+        seconds = int(usec) / 1_000_000
+
+    except ValueError:
+        return None
+
+    return seconds if seconds > 0 else None
+
+
+class SystemdNotifier:
+    """
+    sd_notify プロトコルを、$NOTIFY_SOCKET への AF_UNIX データグラムで送る。
+
+    - "@" で始まるアドレスは abstract namespace（先頭を NUL にする）
+    - NOTIFY_SOCKET がなければ（systemd の外・Type=simple）何もしない
+    - 送信の失敗は最初の1回だけ警告し、表示は止めない
+
+    address と environ は差し替え可能。
+    """
+
+    def __init__(
+        self,
+        address=None,
+        environ=None,
+    ):
+        environ = os.environ if environ is None else environ
+
+        if address is None:
+            address = environ.get("NOTIFY_SOCKET", "")
+
+        if address.startswith("@"):
+            address = "\0" + address[1:]
+
+        self.address = address or None
+        self.sock = None
+
+        if self.address:
+            import socket
+
+            self.sock = socket.socket(
+                socket.AF_UNIX,
+                socket.SOCK_DGRAM | socket.SOCK_CLOEXEC,
+            )
+
+        self.watchdog_seconds = (
+            watchdog_interval_seconds(environ)
+            if self.address
+            else None
+        )
+
+        self.last_status = None
+        self.send_failed = False
+
+    @property
+    def enabled(self):
+        return self.sock is not None
+
+    def send(self, *fields):
+        if self.sock is None:
+            return False
+
+        try:
+            self.sock.sendto(
+                "\n".join(fields).encode("utf-8"),
+                self.address,
+            )
+
+            return True
+
+        except OSError as exc:
+            if not self.send_failed:
+                self.send_failed = True
+
+                logger.warning(
+                    "sd_notify failed (%s): %s",
+                    self.address.replace("\0", "@"),
+                    exc,
+                )
+
+            return False
+
+    def ready(self, status):
+        self.last_status = status
+
+        return self.send(
+            "READY=1",
+            f"STATUS={status}",
+        )
+
+    def status(self, text):
+        # 同じ内容は送り直さない
+        if text == self.last_status:
+            return False
+
+        self.last_status = text
+
+        return self.send(f"STATUS={text}")
+
+    def ping(self):
+        return self.send("WATCHDOG=1")
+
+    def stopping(self):
+        return self.send("STOPPING=1")
+
+
 # ============================================================
 # uptime
 # ============================================================
@@ -558,46 +1677,535 @@ def format_uptime_htop(uptime_seconds):
 
 
 # ============================================================
-# Image collection
+# Refresh scheduler
 # ============================================================
 
-def collect_images():
-    if not IMAGE_DIR.exists():
-        return []
-
-    images = []
+# get_throttled のうち「今まさに電圧が落ちている」ビット
+UNDER_VOLTAGE_NOW = 0x1
 
-    for path in IMAGE_DIR.rglob("*.png"):
-        if not path.is_file():
-            continue
 
-        if path.name.startswith("."):
-            continue
+def read_throttled():
+    """
+    vcgencmd get_throttled の値を返す。取れなければ None。
 
-        images.append(
-            str(path.resolve())
+    monitor_throttled.py と同じ出力形式 (throttled=0x50005) を読む。
+    """
+    try:
+        result = subprocess.run(
+            ["vcgencmd", "get_throttled"],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=5,
         )
 
-    return sorted(images)
+        _, value = result.stdout.strip().split("=", 1)
 
+        return int(value.strip(), 0)
 
-def reconcile_queue(
-    queue,
-    current_images,
-):
+    except Exception as exc:
+        logger.warning(
+            "get_throttled unavailable: %s",
+            exc,
+        )
+        return None
+
+
+def parse_quiet_hours(text):
     """
-    古いphotos/パスがstateに残っていても安全に捨てる。
+    "23:00-06:30,12:00-12:30" を [(開始分, 終了分), ...] にする。
 
-    入力画像が増減した場合は、新しいシャッフルキューを作る。
+    開始 > 終了 の場合は日付をまたぐ窓として扱う。
     """
-    current_set = set(current_images)
+    windows = []
 
-    valid_queue = [
-        path
-        for path in queue
-        if path in current_set
-        and os.path.exists(path)
-    ]
+    for part in text.split(","):
+        part = part.strip()
+
+        if not part:
+            continue
+
+        start, end = part.split("-", 1)
+
+        windows.append(
+            (
+                _parse_hhmm(start),
+                _parse_hhmm(end),
+            )
+        )
+
+    return windows
+
+
+def _parse_hhmm(value):
+    hh, mm = value.strip().split(":", 1)
+
+    return int(hh) * 60 + int(mm)
+
+
+class RefreshDecision:
+    def __init__(self, allowed, reason, delay=0):
+        self.allowed = allowed
+        self.reason = reason
+        self.delay = delay
+
+
+class RefreshScheduler:
+    """
+    リフレッシュしてよいかを決める。
+
+    - 静音時間帯（quiet hours）の間は延期
+    - 1日のリフレッシュ回数が上限に達したら翌日まで延期
+    - show() 直前に電圧低下を検出したら、バックオフしながら延期
+
+    Button A による手動リフレッシュは静音時間帯と上限を無視するが、
+    電圧低下の確認は常に行う。
+
+    read_throttled と now は差し替え可能で、
+    実機なしでも判断ロジックだけを確かめられる。
+    """
+
+    def __init__(
+        self,
+        quiet_hours=(),
+        daily_budget=0,
+        power_guard=True,
+        backoff_seconds=60,
+        backoff_max_seconds=900,
+        budget_file=None,
+        read_throttled=read_throttled,
+        now=datetime.now,
+    ):
+        self.quiet_hours = list(quiet_hours)
+        self.daily_budget = daily_budget
+        self.power_guard = power_guard
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.budget_file = budget_file
+        self.read_throttled = read_throttled
+        self.now = now
+
+        self.deferrals = 0
+        self.budget_date, self.budget_used = self._load_budget()
+
+    # ---------- budget ----------
+
+    def _load_budget(self):
+        if self.budget_file is None:
+            return None, 0
+
+        try:
+            with Path(self.budget_file).open(
+                "r",
+                encoding="utf-8",
+            ) as f:
+                data = json.load(f)
+
+            return data.get("date"), int(data.get("count", 0))
+
+        except Exception:
+            return None, 0
+
+    def _save_budget(self):
+        if self.budget_file is None:
+            return
+
+        try:
+            Path(self.budget_file).parent.mkdir(
+                parents=True,
+                exist_ok=True,
+            )
+
+            Path(self.budget_file).write_text(
+                json.dumps(
+                    {
+                        "date": self.budget_date,
+                        "count": self.budget_used,
+                    }
+                )
+            )
+
+        except Exception:
+            logger.exception(
+                "Failed to save refresh budget"
+            )
+
+    def _refreshes_today(self, now):
+        if self.budget_date != now.date().isoformat():
+            return 0
+
+        return self.budget_used
+
+    # ---------- checks ----------
+
+    def _quiet_window_remaining(self, now):
+        """静音時間帯なら終了までの秒数、そうでなければ None。"""
+        minute = now.hour * 60 + now.minute
+
+        for start, end in self.quiet_hours:
+            if start <= end:
+                inside = start <= minute < end
+            else:
+                inside = minute >= start or minute < end
+
+            if inside:
+                remaining = (end - minute) % (24 * 60)
+
+                return remaining * 60 - now.second
+
+        return None
+
+    def check(self, manual=False):
+        """
+        今リフレッシュしてよいかを判断し、ログに残す。
+
+        返り値: RefreshDecision
+        """
+        decision = self._decide(manual)
+
+        if decision.allowed:
+            logger.info(
+                "Refresh allowed: %s",
+                decision.reason,
+            )
+        else:
+            logger.warning(
+                "Refresh deferred %ds: %s",
+                decision.delay,
+                decision.reason,
+            )
+
+        return decision
+
+    def _decide(self, manual):
+        now = self.now()
+
+        if not manual:
+            quiet = self._quiet_window_remaining(now)
+
+            if quiet is not None:
+                return RefreshDecision(
+                    False,
+                    "quiet hours",
+                    max(1, quiet),
+                )
+
+            if (
+                self.daily_budget
+                and self._refreshes_today(now) >= self.daily_budget
+            ):
+                tomorrow = datetime.combine(
+                    now.date(),
+                    datetime.min.time(),
+                ) + timedelta(days=1)
+
+                return RefreshDecision(
+                    False,
+                    f"daily budget {self.daily_budget} used",
+                    max(1, int((tomorrow - now).total_seconds())),
+                )
+
+        if self.power_guard:
+            value = self.read_throttled()
+
+            if value is not None and value & UNDER_VOLTAGE_NOW:
+                delay = min(
+                    self.backoff_seconds * (2 ** self.deferrals),
+                    self.backoff_max_seconds,
+                )
+
+                self.deferrals += 1
+
+                return RefreshDecision(
+                    False,
+                    f"under-voltage now (throttled=0x{value:X}, "
+                    f"deferral #{self.deferrals})",
+                    delay,
+                )
+
+            power = (
+                "power unknown"
+                if value is None
+                else f"throttled=0x{value:X}"
+            )
+        else:
+            power = "power guard off"
+
+        self.deferrals = 0
+
+        return RefreshDecision(
+            True,
+            f"{'manual' if manual else 'timer'}, {power}, "
+            f"today={self._refreshes_today(now)}",
+        )
+
+    def record_refresh(self):
+        """show() が終わったら呼ぶ。1日の回数に数える。"""
+        today = self.now().date().isoformat()
+
+        if self.budget_date != today:
+            self.budget_date = today
+            self.budget_used = 0
+
+        self.budget_used += 1
+        self._save_budget()
+
+
+def create_scheduler():
+    return RefreshScheduler(
+        quiet_hours=parse_quiet_hours(CONFIG["QUIET_HOURS"]),
+        daily_budget=CONFIG["DAILY_REFRESH_BUDGET"],
+        power_guard=CONFIG["POWER_GUARD"],
+        backoff_seconds=CONFIG["POWER_BACKOFF_SECONDS"],
+        backoff_max_seconds=CONFIG["POWER_BACKOFF_MAX_SECONDS"],
+        budget_file=BUDGET_FILE,
+    )
+
+
+# ============================================================
+# Slide pack
+# ============================================================
+
+# パック内のスライドは "<パック>::/<name>" というパスで扱う。
+# Path(...).name はそのままファイル名になるので、ログや metadata の検索は変わらない。
+PACK_SEPARATOR = "::/"
+
+SLIDE_PACK = None
+SLIDE_PACK_LOCK = threading.Lock()
+
+
+def split_pack_path(image_path):
+    """"<パック>::/<name>" を (パック, name) に分ける。通常のファイルは (None, パス)。"""
+    pack_path, separator, name = str(image_path).partition(PACK_SEPARATOR)
+
+    if not separator:
+        return None, str(image_path)
+
+    return pack_path, name
+
+
+def current_slide_pack():
+    """
+    PHOTO_PACK を開いて返す。開けなければ None。
+
+    ファイルが差し替え・追記されていたら（inode / サイズ / mtime が変わったら）
+    開き直す。古い SlidePack は、読み込み中のスライドが参照している間は
+    mmap ごと残るので、差し替えの瞬間に表示中の1枚が壊れることはない。
+    """
+    global SLIDE_PACK
+
+    # 起動を軽くするため、パックを使うときだけ読む
+    import slide_pack
+
+    with SLIDE_PACK_LOCK:
+        try:
+            st = PHOTO_PACK.stat()
+        except (AttributeError, OSError):
+            return None
+
+        if (
+            SLIDE_PACK is not None
+            and SLIDE_PACK.path == PHOTO_PACK
+            and SLIDE_PACK.stat_key()
+            == (st.st_ino, st.st_size, st.st_mtime_ns)
+        ):
+            return SLIDE_PACK
+
+        started = time.monotonic()
+
+        try:
+            pack = slide_pack.SlidePack(PHOTO_PACK)
+
+        except (OSError, slide_pack.PackError) as e:
+            logger.error(
+                "Failed to open slide pack %s: %s",
+                PHOTO_PACK,
+                e,
+            )
+
+            # 同じパックの前の内容が開いていれば、それを使い続ける
+            if SLIDE_PACK is not None and SLIDE_PACK.path == PHOTO_PACK:
+                return SLIDE_PACK
+
+            return None
+
+        if pack.truncated_tail:
+            logger.warning(
+                "Slide pack %s: ignored %d bytes after the last valid index",
+                PHOTO_PACK,
+                pack.truncated_tail,
+            )
+
+        logger.info(
+            "Slide pack opened: %s (%d slides, %.1fMB, %.1fms)",
+            PHOTO_PACK,
+            len(pack),
+            pack.stat_key()[1] / 1024 / 1024,
+            (time.monotonic() - started) * 1000,
+        )
+
+        SLIDE_PACK = pack
+
+        return pack
+
+
+def find_pack_slide(image_path):
+    """
+    パック内のスライドなら (SlidePack, name) を返す。
+
+    今のパックに無い（PHOTO_PACK が変わった・差し替えで消えた）場合は (None, name)。
+    """
+    pack_path, name = split_pack_path(image_path)
+    pack = current_slide_pack()
+
+    if (
+        pack is None
+        or str(pack.path) != pack_path
+        or name not in pack
+    ):
+        return None, name
+
+    return pack, name
+
+
+def collect_pack_images():
+    pack = current_slide_pack()
+
+    if pack is None:
+        return []
+
+    return [
+        f"{pack.path}{PACK_SEPARATOR}{name}"
+        for name in pack.names()
+    ]
+
+
+def slide_exists(image_path):
+    if split_pack_path(image_path)[0] is None:
+        return os.path.exists(image_path)
+
+    return find_pack_slide(image_path)[0] is not None
+
+
+def slide_version(image_path):
+    """
+    同名のまま差し替えられたかを見るための値（先読みの確認用）。
+
+    ファイルは mtime、パックは追記で置き換わると変わる (offset, crc32)。
+    """
+    if split_pack_path(image_path)[0] is None:
+        return file_mtime(image_path)
+
+    pack, name = find_pack_slide(image_path)
+
+    if pack is None:
+        return None
+
+    entry = pack.entry(name)
+
+    return entry.offset, entry.crc32
+
+
+def slide_sha256(image_path):
+    if split_pack_path(image_path)[0] is None:
+        return file_sha256(image_path)
+
+    pack, name = find_pack_slide(image_path)
+
+    if pack is None:
+        raise FileNotFoundError(image_path)
+
+    return pack.sha256(name)
+
+
+def slide_source(image_path):
+    """
+    Image.open() に渡すもの。
+
+    ファイルはパスのまま、パック内のスライドは crc32 を確かめてから
+    mmap を直接読むファイルオブジェクトを返す。
+    """
+    if split_pack_path(image_path)[0] is None:
+        return image_path
+
+    pack, name = find_pack_slide(image_path)
+
+    if pack is None:
+        raise FileNotFoundError(image_path)
+
+    return pack.open(name)
+
+
+def pack_metadata_entry(image_path):
+    """metadata.json に無いパック内のスライドは、パックの索引の撮影日・モードを使う。"""
+    if split_pack_path(image_path)[0] is None:
+        return None
+
+    pack, name = find_pack_slide(image_path)
+
+    if pack is None:
+        return None
+
+    entry = pack.entry(name)
+
+    if not entry.capture_date and not entry.mode:
+        return None
+
+    return {
+        "capture_date": entry.capture_date,
+        "display_mode": entry.mode,
+    }
+
+
+# ============================================================
+# Image collection
+# ============================================================
+
+def slide_library():
+    """スライドを読んでいる場所（ログ用）。"""
+    return PHOTO_PACK if PHOTO_PACK is not None else IMAGE_DIR
+
+
+def collect_images():
+    if PHOTO_PACK is not None:
+        return collect_pack_images()
+
+    if not IMAGE_DIR.exists():
+        return []
+
+    images = []
+
+    for path in IMAGE_DIR.rglob("*.png"):
+        if not path.is_file():
+            continue
+
+        if path.name.startswith("."):
+            continue
+
+        images.append(
+            str(path.resolve())
+        )
+
+    return sorted(images)
+
+
+def reconcile_queue(
+    queue,
+    current_images,
+):
+    """
+    古いphotos/パスがstateに残っていても安全に捨てる。
+
+    入力画像が増減した場合は、新しいシャッフルキューを作る。
+    """
+    current_set = set(current_images)
+
+    valid_queue = [
+        path
+        for path in queue
+        if path in current_set
+        and slide_exists(path)
+    ]
 
     if (
         len(current_images)
@@ -609,6 +2217,39 @@ def reconcile_queue(
     return valid_queue
 
 
+def read_library_changes():
+    """
+    sync_receiver.py が書く変更記録を読む。
+
+    1行1件の JSON: {"seq": 連番, "added": [...], "changed": [...], "removed": [...]}
+    パスは collect_images() と同じ絶対パス。
+    """
+    entries = []
+
+    try:
+        with LIBRARY_CHANGES_FILE.open(
+            "r",
+            encoding="utf-8",
+        ) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+
+    except OSError:
+        pass
+
+    return entries
+
+
+def last_change_seq(entries):
+    return max(
+        (entry.get("seq", 0) for entry in entries),
+        default=0,
+    )
+
+
 # ============================================================
 # Date text
 # ============================================================
@@ -679,9 +2320,20 @@ def format_date_and_elapsed_time(
 # Fonts
 # ============================================================
 
+# (フォントパス, サイズ) -> フォント。.env の再読み込みで空にする。
+FONT_CACHE = {}
+
+
 def load_font(size):
+    key = (CONFIG["FONT_PATH"], size)
+
+    if key in FONT_CACHE:
+        return FONT_CACHE[key]
+
+    from PIL import ImageFont
+
     try:
-        return ImageFont.truetype(
+        font = ImageFont.truetype(
             CONFIG["FONT_PATH"],
             size,
         )
@@ -691,7 +2343,11 @@ def load_font(size):
             CONFIG["FONT_PATH"],
         )
 
-        return ImageFont.load_default()
+        font = ImageFont.load_default()
+
+    FONT_CACHE[key] = font
+
+    return font
 
 
 # ============================================================
@@ -716,6 +2372,8 @@ def add_date_overlay(
             f"Expected P-mode image, got {img.mode}"
         )
 
+    from PIL import ImageDraw
+
     draw = ImageDraw.Draw(img)
 
     font_small = load_font(
@@ -856,6 +2514,8 @@ def add_status_overlay(
             f"Expected P-mode image, got {img.mode}"
         )
 
+    from PIL import ImageDraw
+
     draw = ImageDraw.Draw(img)
 
     font = load_font(
@@ -962,13 +2622,20 @@ def add_status_overlay(
 # Prepare final display image
 # ============================================================
 
-def prepare_image(
+def load_slide(
     image_path,
     inky_display,
-    slide_updated_at,
-    metadata,
 ):
-    with Image.open(image_path) as source:
+    """
+    PNG をデコードして、独立した P-mode 画像として返す。
+
+    オーバーレイは時刻に依存するので含めない。
+    先読み（prefetch）はここまでを済ませておく。
+    """
+    with Image.open(
+        slide_source(image_path),
+        formats=slide_formats(),
+    ) as source:
         if source.mode != "P":
             raise ValueError(
                 f"Generated image must be P-mode: "
@@ -995,6 +2662,15 @@ def prepare_image(
             f"Missing palette: {image_path}"
         )
 
+    return img
+
+
+def apply_overlays(
+    img,
+    image_path,
+    slide_updated_at,
+    metadata,
+):
     capture_date = get_capture_date(
         image_path,
         metadata,
@@ -1014,175 +2690,1695 @@ def prepare_image(
     return img
 
 
-# ============================================================
-# Main
-# ============================================================
+def prepare_image(
+    image_path,
+    inky_display,
+    slide_updated_at,
+    metadata,
+):
+    img = load_slide(
+        image_path,
+        inky_display,
+    )
 
-def main():
-    global logger
+    return apply_overlays(
+        img,
+        image_path,
+        slide_updated_at,
+        metadata,
+    )
+
+
+# ============================================================
+# Frame buffer
+# ============================================================
+
+# FrameBuffer の直接デコードは Pillow の内部（Image.readonly と Image.im の
+# 差し替え）に頼っている。動作を確かめた範囲 [下限, 上限) の外では、
+# 独立した画像へデコードして numpy 配列へ書き写す経路にする。
+PILLOW_DIRECT_FRAME_VERSIONS = ((9, 1), (13, 0))
+
+
+def pillow_version():
+    return tuple(
+        int(part)
+        for part in Image.__version__.split(".")[:2]
+    )
+
+
+def pillow_supports_direct_frame(version=None):
+    low, high = PILLOW_DIRECT_FRAME_VERSIONS
+
+    return low <= (version or pillow_version()) < high
+
+
+def has_panel_palette(source):
+    """
+    PNG のパレットが6色の純色パレットそのものかを、デコード前に調べる。
+
+    PngImagePlugin は open() の時点で PLTE を読んでいるので、
+    getpalette()（= load()）を呼ばずに判定できる。
+    """
+    palette = source.palette
+
+    return (
+        palette is not None
+        and palette.mode == "RGB"
+        and bytes(palette.palette) == PANEL_PALETTE_BYTES
+    )
+
+
+def read_proc_status_kb(field):
+    """/proc/self/status の VmRSS / VmHWM などを kB で返す。"""
+    try:
+        with open(
+            "/proc/self/status",
+            "r",
+            encoding="utf-8",
+        ) as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+
+    except (OSError, ValueError):
+        pass
+
+    return 0
+
+
+def reset_peak_rss():
+    """
+    VmHWM（ピーク RSS）を現在値にリセットする。
+
+    返り値: リセットできたら True
+    """
+    try:
+        with open(
+            "/proc/self/clear_refs",
+            "w",
+            encoding="utf-8",
+        ) as f:
+            f.write("5")
+
+        return True
+
+    except OSError:
+        return False
+
+
+class FrameBuffer:
+    """
+    1600x1200 の P-mode フレームを1枚だけ確保し、全スライドで使い回す。
+
+    - PNG はこのバッファへ直接デコードする（source.copy() をしない）
+    - オーバーレイも同じバッファに描く
+    - EL133UF1 では inky.set_image() の RGB 変換・再量子化・int64 の
+      remap を通さず、ドライバの buf へ index を直接書き込む
+
+    numpy 配列と Pillow の画像が同じメモリを共有するので、
+    フレームとして常駐するのは 1.9MB の1枚だけになる。
+
+    buffer に表示ワーカーの共有メモリを渡すと、フレームをそこに置き、
+    パネルへはパレットだけを送る。
+
+    共有は Pillow の内部に頼るので、PILLOW_DIRECT_FRAME_VERSIONS の外か、
+    作成時の確認で共有できていなければ、shared = False になる。
+    その場合の画像は独立した Image で、パネルへ書く前に sync() で
+    numpy 配列へ書き写す（1枚ごとに 1.9MB の一時確保が増える）。
+    """
+
+    def __init__(self, size, buffer=None, direct=None):
+        import numpy as np
+
+        width, height = size
+
+        self.size = size
+        self.buffer = buffer
+
+        if buffer is None:
+            self.array = np.zeros(
+                (height, width),
+                dtype=np.uint8,
+            )
+
+        else:
+            self.array = np.ndarray(
+                (height, width),
+                dtype=np.uint8,
+                buffer=buffer,
+            )
+
+        if direct is None:
+            direct = pillow_supports_direct_frame()
+
+        self.shared = direct and self._share_array()
+
+        if not self.shared:
+            self.image = Image.new("P", size)
+
+        self.image.putpalette(PANEL_PALETTE_BYTES)
+
+    def _share_array(self):
+        """
+        self.array を直接指す画像を作る。共有できなければ False。
+        """
+        self.image = Image.frombuffer(
+            "P",
+            self.size,
+            self.array,
+            "raw",
+            "P",
+            0,
+            1,
+        )
+
+        # frombuffer は読み取り専用になり、描画のたびに copy されるので、
+        # 書き込み可にして self.array へ直接描かせる。
+        self.image.readonly = 0
+
+        # 書き込みが本当に self.array へ届くかを1画素で確かめる
+        saved = self.array[0, 0]
+        self.image.putpixel((0, 0), 1 if saved != 1 else 2)
+        shared = self.array[0, 0] != saved
+        self.array[0, 0] = saved
+
+        if not shared:
+            logger.warning(
+                "Pillow %s does not draw into the frame buffer; "
+                "decoding to a separate image and copying",
+                Image.__version__,
+            )
+
+        return shared
+
+    def load(self, image_path):
+        """
+        PNG をフレームへデコードする。
+
+        返り値: True = 6色パレットのフレームとして読めた
+                False = それ以外のパレット（呼び出し側で set_image() 経由にする）
+        """
+        with Image.open(
+            slide_source(image_path),
+            formats=slide_formats(),
+        ) as source:
+            if source.mode != "P":
+                raise ValueError(
+                    f"Generated image must be P-mode: "
+                    f"{image_path} / mode={source.mode}"
+                )
+
+            if source.size != self.size:
+                raise ValueError(
+                    f"Unexpected image size: "
+                    f"{image_path} / "
+                    f"{source.size}"
+                )
+
+            if not has_panel_palette(source):
+                return False
+
+            if self.shared:
+                # ImageFile.load() は im が未確保のときだけ新しく確保するので、
+                # 先にフレームの core を渡しておくと、そこへ直接デコードされる。
+                source.im = self.image.im
+                source.load()
+
+                if source.im is self.image.im:
+                    return True
+
+            # 共有できない Pillow か、別バッファに読まれた場合
+            self.image.paste(source)
+
+        return True
+
+    def sync(self):
+        """共有していない場合、画像の内容を self.array へ書き写す。"""
+        if not self.shared:
+            import numpy as np
+
+            self.array[...] = np.asarray(self.image)
+
+    def write_to_panel(self, inky_display):
+        """
+        パネルのバッファへ書き込む。
+
+        返り値: "direct"（ドライバの buf へ直接）/ "set_image"
+                / "worker/..."（表示ワーカーが共有メモリから書き込んだ）
+        """
+        self.sync()
+
+        if (
+            self.buffer is not None
+            and getattr(inky_display, "frame_buffer", None) is self.buffer
+        ):
+            return "worker/" + inky_display.set_frame(
+                self.image.getpalette()
+            )
+
+        if supports_direct_write(inky_display):
+            write_indices(inky_display, self.array)
+
+            return "direct"
+
+        inky_display.set_image(self.image)
+
+        return "set_image"
+
+
+# ============================================================
+# Runtime
+# ============================================================
+
+def read_rss_mb():
+    """/proc/self/statm から現在の RSS (MB) を返す。"""
+    try:
+        with open(
+            "/proc/self/statm",
+            "r",
+            encoding="utf-8",
+        ) as f:
+            resident_pages = int(f.read().split()[1])
+
+        return (
+            resident_pages
+            * os.sysconf("SC_PAGE_SIZE")
+            / (1024 * 1024)
+        )
+
+    except Exception:
+        return 0.0
+
+
+# ============================================================
+# Memory instrumentation
+# ============================================================
+
+def is_monotonic_growth(samples, growth_mb, segments=4):
+    """
+    RSS の系列が、ノイズを除いて単調に増えているかを判定する。
+
+    窓を segments 個に分け、各区間の最小値が前の区間の最小値以上で、
+    かつ最初と最後の区間の最小値の差が growth_mb 以上なら増加とみなす。
+    最小値を使うので、一時的なピーク（デコード中など）では反応しない。
+    """
+    if len(samples) < segments * 2:
+        return False
+
+    size = len(samples) // segments
+
+    minimums = [
+        min(samples[i * size:(i + 1) * size])
+        for i in range(segments)
+    ]
+
+    rising = all(
+        later >= earlier
+        for earlier, later in zip(minimums, minimums[1:])
+    )
+
+    return rising and minimums[-1] - minimums[0] >= growth_mb
+
+
+class MemoryMonitor:
+    """
+    長期運用でのメモリリークを早く見つけるための観測モード。
+
+    - 表示ごとに /proc/self/statm の RSS を記録する
+    - snapshot_every 枚ごとに tracemalloc のスナップショットを取り、
+      前回との差分をファイル・行ごとに集計する
+    - 直近 window 枚の RSS が単調に増えていたら警告する
+    - 結果を小さな JSON レポートに書き出す
+
+    tracemalloc は Python のアロケータだけを追うので、
+    Pillow の画像バッファなど C 側の確保は RSS の推移で見る。
+    """
+
+    def __init__(
+        self,
+        snapshot_every=50,
+        window=200,
+        growth_mb=8.0,
+        report_file=MEMORY_REPORT_FILE,
+        top=10,
+    ):
+        self.snapshot_every = max(1, snapshot_every)
+        self.window = max(8, window)
+        self.growth_mb = growth_mb
+        self.report_file = Path(report_file)
+        self.top = top
+
+        self.samples = collections.deque(maxlen=self.window)
+        self.slides = 0
+        self.started_rss = read_rss_mb()
+        self.peak_rss = self.started_rss
+        self.snapshot = None
+        self.top_diffs = []
+        self.growth_flagged = False
+
+        import tracemalloc
+
+        tracemalloc.start(1)
+
+    def record_slide(self):
+        """表示が1枚終わるたびに呼ぶ。"""
+        rss = read_rss_mb()
+
+        self.slides += 1
+        self.samples.append(rss)
+        self.peak_rss = max(self.peak_rss, rss)
+
+        if self.slides % self.snapshot_every == 0:
+            self.compare_snapshot()
+
+        growing = (
+            len(self.samples) == self.window
+            and is_monotonic_growth(
+                list(self.samples),
+                self.growth_mb,
+            )
+        )
+
+        if growing and not self.growth_flagged:
+            logger.warning(
+                "Memory: RSS grew monotonically %.1fMB -> %.1fMB "
+                "over the last %d slides",
+                self.samples[0],
+                rss,
+                len(self.samples),
+            )
+
+        self.growth_flagged = growing
+
+        if growing or self.slides % self.snapshot_every == 0:
+            self.write_report()
+
+    def compare_snapshot(self):
+        import tracemalloc
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            )
+        )
+
+        if self.snapshot is not None:
+            stats = snapshot.compare_to(
+                self.snapshot,
+                "lineno",
+            )
+
+            self.top_diffs = [
+                {
+                    "where": (
+                        f"{stat.traceback[0].filename}:"
+                        f"{stat.traceback[0].lineno}"
+                    ),
+                    "size_diff_kb": round(stat.size_diff / 1024, 1),
+                    "count_diff": stat.count_diff,
+                }
+                for stat in stats[:self.top]
+                if stat.size_diff > 0
+            ]
+
+            if self.top_diffs:
+                logger.info(
+                    "Memory: top growth since last snapshot: %s "
+                    "(%+.1fKB)",
+                    self.top_diffs[0]["where"],
+                    self.top_diffs[0]["size_diff_kb"],
+                )
+
+        self.snapshot = snapshot
+
+    def write_report(self):
+        import tracemalloc
+
+        samples = list(self.samples)
+
+        report = {
+            "updated_at": datetime.now().isoformat(
+                timespec="seconds"
+            ),
+            "slides": self.slides,
+            "rss_mb": {
+                "start": round(self.started_rss, 1),
+                "current": round(samples[-1], 1),
+                "window_min": round(min(samples), 1),
+                "window_max": round(max(samples), 1),
+                "peak": round(self.peak_rss, 1),
+            },
+            "window": len(samples),
+            "monotonic_growth": self.growth_flagged,
+            "tracemalloc_mb": round(
+                tracemalloc.get_traced_memory()[0] / (1024 * 1024),
+                2,
+            ),
+            "top_growth": self.top_diffs,
+        }
+
+        try:
+            self.report_file.parent.mkdir(
+                parents=True,
+                exist_ok=True,
+            )
+
+            tmp_file = self.report_file.with_suffix(".tmp")
+            tmp_file.write_text(
+                json.dumps(report, indent=2)
+            )
+            os.replace(tmp_file, self.report_file)
+
+        except Exception:
+            logger.exception(
+                "Failed to write memory report"
+            )
+
+
+def create_memory_monitor():
+    if not CONFIG["MEMORY_MONITOR"]:
+        return None
+
+    logger.info(
+        "Memory monitor enabled: snapshot every %d slides, "
+        "window %d slides, growth %.1fMB -> %s",
+        CONFIG["MEMORY_SNAPSHOT_EVERY"],
+        CONFIG["MEMORY_WINDOW"],
+        CONFIG["MEMORY_GROWTH_MB"],
+        MEMORY_REPORT_FILE,
+    )
+
+    return MemoryMonitor(
+        snapshot_every=CONFIG["MEMORY_SNAPSHOT_EVERY"],
+        window=CONFIG["MEMORY_WINDOW"],
+        growth_mb=CONFIG["MEMORY_GROWTH_MB"],
+    )
+
+
+# show_slide() の返り値: INTERVAL_SECONDS に従って待つ
+FOLLOW_INTERVAL = "interval"
+
+
+class SlideshowRuntime:
+    """
+    asyncio のイベントループ上でスライドショーを動かす。
+
+    - スライドのタイマー、ボタン、再スキャン、metadata 再読み込み、
+      テレメトリはすべてループ上のタスク
+    - キュー・カウンタ・押下回数などの状態を触るのはループのスレッドだけ
+    - ボタンは gpiozero のスレッドから call_soon_threadsafe でキューに入る
+    - デコード・ファイル I/O は既定の executor、
+      パネル (SPI) は専用の1スレッド executor で実行する
+    """
+
+    def __init__(
+        self,
+        inky,
+        metadata,
+        scheduler,
+        queue,
+        current_images,
+        counter,
+        notifier=None,
+        startup=None,
+    ):
+        self.inky = inky
+        self.metadata = metadata
+        self.scheduler = scheduler
+        self.queue = queue
+        self.current_images = current_images
+        self.counter = counter
+
+        self.notifier = notifier or SystemdNotifier(address="")
+
+        # 最初のフレームまでの起動タイムライン
+        self.startup = startup
+
+        self.loop = None
+        self.button_events = None
+        self.next_event = None
+        self.buttons = []
+
+        # Button A: リフレッシュ中も数えておき、次の表示前にまとめて消費する
+        self.a_presses = 0
+        self.a_first_pressed_at = None
+
+        # Button A でリクエストされた表示の、最初の押下時刻
+        self.pressed_at = None
+
+        self.b_pressed_at = None
+
+        # 全スライドで使い回すフレーム（表示ワーカーなら共有メモリ上）
+        self.frame = FrameBuffer(
+            (inky.width, inky.height),
+            getattr(inky, "frame_buffer", None),
+        )
+
+        # (パス, mtime, フレームへデコード中の Future)
+        # デコード中のバッファを上書きしないよう、捨てる場合も必ず await する。
+        self.prefetched = None
+
+        # 1枚あたりのピーク RSS 計測の基準 (kB)
+        self.peak_base_kb = None
+
+        # 起動後の1枚目はフォント読み込みなど一度きりの確保を含むので、
+        # budget の判定から外す。
+        self.peak_warmed_up = False
+
+        # 再起動時、パネルに前回のフレームが残っていれば待つ秒数
+        self.resume_delay = None
+
+        self.env_mtime = file_mtime(ENV_FILE)
+        self.metadata_mtime = file_mtime(METADATA_FILE)
+
+        # sync_receiver.py の変更記録。起動時の collect_images() で
+        # 反映済みの分は読み飛ばす。
+        self.changes_mtime = file_mtime(LIBRARY_CHANGES_FILE)
+        self.changes_seq = last_change_seq(read_library_changes())
+
+        # .env の再読み込みで INTERVAL_SECONDS が変わったときに待ちを起こす
+        self.wake_event = None
+
+        self.shown = 0
+        self.last_show_seconds = 0.0
+
+        self.memory = create_memory_monitor()
+
+        self.stages = create_stage_tracker()
+
+        self.stages.listener = self.on_stage
+
+        if hasattr(inky, "frame_buffer"):
+            # 表示ワーカーが自分のタイムアウトで kill・再起動するので、
+            # パネルの段でプロセスごと終了しない。
+            self.stages.supervised.update(
+                (
+                    "set_image",
+                    "show",
+                )
+            )
+
+        self.panel_executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="panel",
+        )
+
+    # ---------- executors ----------
+
+    async def run_blocking(self, func, *args):
+        return await self.loop.run_in_executor(
+            None,
+            functools.partial(func, *args),
+        )
+
+    async def run_on_panel(self, func, *args):
+        return await self.loop.run_in_executor(
+            self.panel_executor,
+            functools.partial(func, *args),
+        )
+
+    # ---------- buttons ----------
+
+    def post_button_event(self, name, kind, at):
+        """gpiozero のスレッドから呼ばれる。"""
+        self.loop.call_soon_threadsafe(
+            self.button_events.put_nowait,
+            (name, kind, at),
+        )
+
+    async def setup_buttons_task(self):
+        """
+        gpiozero の import とピンの初期化は遅いので、
+        最初のフレームのデコード・表示と並行して executor で行う。
+        """
+        # gpiozero Button が GC されないよう保持する
+        self.buttons = await self.run_blocking(
+            setup_buttons,
+            self.post_button_event,
+        )
+
+    async def button_task(self):
+        while True:
+            name, kind, at = await self.button_events.get()
+
+            if name == "A":
+                if self.a_presses == 0:
+                    self.a_first_pressed_at = at
+
+                self.a_presses += 1
+
+                logger.info(
+                    "Button A pressed: next image requested "
+                    "(pending=%d)",
+                    self.a_presses,
+                )
+
+                self.next_event.set()
+
+            elif kind == "pressed":
+                self.b_pressed_at = at
+
+                logger.info("Button B pressed")
+
+            else:
+                self.on_b_released(at)
+
+    def on_b_released(self, at):
+        if self.b_pressed_at is None:
+            return
+
+        held = at - self.b_pressed_at
+
+        self.b_pressed_at = None
+
+        if held >= 3.0:
+            logger.warning(
+                "Button B long press %.2fs: poweroff",
+                held,
+            )
+
+            subprocess.Popen(
+                ["sudo", "/usr/sbin/poweroff"]
+            )
+
+        else:
+            logger.warning(
+                "Button B short press %.2fs: reboot",
+                held,
+            )
+
+            subprocess.Popen(
+                ["sudo", "/usr/sbin/reboot"]
+            )
+
+    def take_button_a_presses(self):
+        """
+        未消費の Button A 押下をまとめて取り出す。
+
+        返り値: (押下回数, 最初の押下の monotonic 時刻 or None)
+        """
+        presses = self.a_presses
+        first_pressed_at = self.a_first_pressed_at
+
+        self.a_presses = 0
+        self.a_first_pressed_at = None
+
+        self.next_event.clear()
+
+        return presses, first_pressed_at
+
+    # ---------- queue ----------
+
+    def save_state(self):
+        save_state(
+            self.queue,
+            len(self.current_images),
+        )
+
+    async def refill_queue(self):
+        self.current_images = await self.run_blocking(
+            collect_images
+        )
+
+        if not self.current_images:
+            logger.error(
+                "No PNG images found: %s",
+                slide_library(),
+            )
+            return False
+
+        self.queue = self.current_images.copy()
+
+        random.shuffle(self.queue)
+
+        logger.info(
+            "Image queue created: %d images",
+            len(self.queue),
+        )
+
+        return True
+
+    def apply_rescan(self, images):
+        """
+        再スキャン結果をキューへ反映する。
+
+        消えた画像はキューから外し、増えた画像はランダムな位置へ入れる。
+        キューを作り直さないので、表示順の途中経過は保たれる。
+        """
+        old = set(self.current_images)
+        new = set(images)
+
+        if old == new:
+            return
+
+        added = sorted(new - old)
+        removed = old - new
+
+        self.queue = [
+            path
+            for path in self.queue
+            if path not in removed
+        ]
+
+        for path in added:
+            self.queue.insert(
+                random.randint(0, len(self.queue)),
+                path,
+            )
+
+        self.current_images = images
+
+        logger.info(
+            "Rescan: +%d / -%d images (queue=%d)",
+            len(added),
+            len(removed),
+            len(self.queue),
+        )
+
+        self.save_state()
+
+    # ---------- prefetch ----------
+
+    def drop_prefetch(self):
+        """
+        先読みを使わないようにする。
+
+        実行中のデコードは止められないので Future は残し、
+        take_slide() で終わるのを待ってから読み直す。
+        """
+        if self.prefetched is not None:
+            self.prefetched = (
+                None,
+                None,
+                self.prefetched[2],
+            )
+
+    def start_prefetch(self):
+        """次の画像をフレームへ先にデコードしておく。"""
+        if not self.queue:
+            self.prefetched = None
+            return
+
+        path = self.queue[0]
+
+        self.prefetched = (
+            path,
+            slide_version(path),
+            self.loop.run_in_executor(
+                None,
+                self.frame.load,
+                path,
+            ),
+        )
+
+    async def take_slide(self, image_path):
+        """
+        表示する画像を返す。
+
+        6色パレットの PNG はフレーム（先読み済みならそのまま）、
+        それ以外は従来どおり独立した画像としてデコードする。
+        """
+        prefetched = self.prefetched
+        self.prefetched = None
+
+        if prefetched is not None:
+            path, mtime, future = prefetched
+
+            try:
+                native = await future
+            except Exception:
+                logger.warning(
+                    "Prefetch failed, decoding again: %s",
+                    image_path,
+                )
+                native = None
+
+            # 同名のまま差し替えられた画像は読み直す
+            if (
+                native
+                and path == image_path
+                and mtime == slide_version(image_path)
+            ):
+                return self.frame.image
+
+        native = await self.run_blocking(
+            self.frame.load,
+            image_path,
+        )
+
+        if native:
+            return self.frame.image
+
+        logger.info(
+            "Not a 6-colour panel palette, "
+            "using set_image(): %s",
+            image_path,
+        )
+
+        return await self.run_blocking(
+            load_slide,
+            image_path,
+            self.inky,
+        )
+
+    def start_peak_measure(self):
+        if reset_peak_rss():
+            self.peak_base_kb = read_proc_status_kb("VmRSS")
+        else:
+            self.peak_base_kb = None
+
+    def check_peak_budget(self, path_name):
+        """
+        デコードからパネルバッファ書き込みまでのピーク増分を budget と比べる。
+
+        フレームとドライバの buf は常駐なので、ここで増えるのは
+        1枚ごとの一時的な確保だけのはず。
+        """
+        if self.peak_base_kb is None:
+            return
+
+        peak_mb = max(
+            0,
+            read_proc_status_kb("VmHWM") - self.peak_base_kb,
+        ) / 1024
+
+        self.peak_base_kb = None
+
+        budget = CONFIG["FRAME_PEAK_BUDGET_MB"]
+
+        if not self.peak_warmed_up:
+            self.peak_warmed_up = True
+
+            logger.info(
+                "Frame peak +%.1fMB (first slide, includes warm-up)",
+                peak_mb,
+            )
+
+        elif peak_mb > budget:
+            logger.warning(
+                "Frame peak +%.1fMB exceeds budget %.1fMB: %s",
+                peak_mb,
+                budget,
+                path_name,
+            )
+        else:
+            logger.info(
+                "Frame peak +%.1fMB (budget %.1fMB)",
+                peak_mb,
+                budget,
+            )
+
+    # ---------- slide timer ----------
+
+    async def resume_from_record(self):
+        """
+        再起動前のフレームがまだ表示期間内なら、リフレッシュせずに
+        保存した締め切りまで待つ。
+        """
+        record = await self.run_blocking(
+            load_display_record
+        )
+
+        delay = await self.run_blocking(
+            startup_resume_delay,
+            record,
+            (self.inky.width, self.inky.height),
+        )
+
+        if delay is None:
+            logger.info(
+                "Startup refresh needed: %s",
+                "no display record"
+                if not record
+                else "previous frame not reusable",
+            )
+            return
+
+        logger.info(
+            "Panel already shows %s (shown %s, frame %s); "
+            "skipping startup refresh, next in %ds",
+            Path(record["path"]).name,
+            datetime.fromtimestamp(record["shown_at"]).isoformat(
+                timespec="seconds"
+            ),
+            str(record.get("frame_sha256", ""))[:12],
+            delay,
+        )
+
+        if self.startup is not None:
+            self.startup.mark("resume check")
+            self.startup.report("first refresh skipped")
+
+        self.stages.heartbeat()
+
+        await self.wait_for_next(delay)
+
+        self.apply_button_a_presses()
+
+    async def slide_task(self):
+        await self.resume_from_record()
+
+        while True:
+            if not self.queue:
+                if not await self.refill_queue():
+                    await asyncio.sleep(60)
+                    continue
+
+            image_path = self.queue.pop(0)
+
+            if not slide_exists(
+                image_path
+            ):
+                logger.warning(
+                    "Missing image skipped: %s",
+                    image_path,
+                )
+
+                self.save_state()
+
+                continue
+
+            try:
+                wait_seconds = await self.show_slide(
+                    image_path
+                )
+
+            except Exception:
+                logger.exception(
+                    "Failed to display image: %s",
+                    image_path,
+                )
+
+                wait_seconds = FOLLOW_INTERVAL
+
+            # 待ちに入る前に、今の段（idle）と段ごとの所要時間を残す
+            self.stages.heartbeat()
+
+            if wait_seconds is None:
+                continue
+
+            await self.wait_for_next(wait_seconds)
+
+            self.apply_button_a_presses()
+
+    async def wait_for_next(self, wait_seconds):
+        """
+        タイマー満了か Button A まで待つ。
+
+        FOLLOW_INTERVAL の場合は、待っている途中で INTERVAL_SECONDS が
+        再読み込みされても、表示からの経過時間で新しい値に合わせる。
+
+        静音時間帯や回数上限による延期は何時間にもなるので、
+        HEARTBEAT_REFRESH_SECONDS ごとに区切ってハートビートを書き直す。
+        """
+        started = self.loop.time()
+        first = True
+
+        while not self.next_event.is_set():
+            if not first:
+                self.stages.heartbeat()
+
+            first = False
+
+            if wait_seconds == FOLLOW_INTERVAL:
+                seconds = CONFIG["INTERVAL_SECONDS"]
+            else:
+                seconds = wait_seconds
+
+            remaining = started + seconds - self.loop.time()
+
+            if remaining <= 0:
+                return
+
+            self.notifier.status(
+                "Waiting: next slide at "
+                + (
+                    datetime.now() + timedelta(seconds=remaining)
+                ).strftime("%H:%M:%S")
+                + f" (shown {self.shown}, #{self.counter})"
+            )
+
+            self.wake_event.clear()
+
+            waiters = [
+                asyncio.create_task(self.next_event.wait()),
+                asyncio.create_task(self.wake_event.wait()),
+            ]
+
+            _, pending = await asyncio.wait(
+                waiters,
+                timeout=min(remaining, HEARTBEAT_REFRESH_SECONDS),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+
+            for task in pending:
+                task.cancel()
+
+    # ---------- systemd ----------
+
+    def on_stage(self, stage, slide):
+        self.notifier.status(
+            f"#{self.counter} {slide}: {stage}"
+        )
+
+    async def watchdog_task(self):
+        """
+        systemd の WatchdogSec の半分ごとに WATCHDOG=1 を送る。
+
+        送るのはイベントループがこのタスクを回せていて、かつ
+        どの段もタイムアウトを過ぎていないときだけ。
+        ループが止まるか段がハングすると送らなくなり、systemd が再起動する。
+        """
+        interval = self.notifier.watchdog_seconds / 2
+
+        logger.info(
+            "systemd watchdog: WatchdogSec=%.0fs, ping every %.1fs",
+            self.notifier.watchdog_seconds,
+            interval,
+        )
+
+        while True:
+            overdue = self.stages.overdue()
+
+            if overdue is None:
+                self.notifier.ping()
+
+            else:
+                logger.warning(
+                    "Withholding systemd watchdog ping: "
+                    "stage '%s' running %.0fs (limit %.0fs)",
+                    overdue[0],
+                    overdue[1],
+                    overdue[2],
+                )
+
+            await asyncio.sleep(interval)
+
+    def apply_button_a_presses(self):
+        presses, first_pressed_at = (
+            self.take_button_a_presses()
+        )
 
-    logger = setup_logging()
+        if not presses:
+            return
 
-    logger.info(
-        "=== Inky 13.3 slideshow starting ==="
-    )
+        self.pressed_at = first_pressed_at
 
-    logger.info(
-        "Image directory: %s",
-        IMAGE_DIR,
-    )
+        # N回押されたら N-1 枚は描画せずに飛ばす
+        skipped = skip_queue_entries(
+            self.queue,
+            presses - 1,
+        )
 
-    logger.info(
-        "Metadata file: %s",
-        METADATA_FILE,
-    )
+        if skipped:
+            logger.info(
+                "Button A pressed %d times: "
+                "skipped %d image(s) without rendering",
+                presses,
+                len(skipped),
+            )
 
-    metadata = load_metadata()
+            self.save_state()
 
-    inky = initialize_display()
-    buttons = setup_buttons()
+    async def show_slide(self, image_path):
+        """
+        1枚を表示する。
 
-    # buttonsをローカル変数として保持し、
-    # gpiozero ButtonがGCされないようにする。
-    _buttons = buttons
+        返り値: 次の表示までの待ち秒数。
+                None の場合は待たずに次の画像へ進む。
+        """
+        self.counter += 1
 
-    counter = load_display_counter()
+        slide_updated_at = (
+            datetime.now()
+        )
 
-    saved_count, queue = load_state()
+        if self.peak_base_kb is None:
+            self.start_peak_measure()
 
-    current_images = collect_images()
+        mode = get_display_mode(
+            image_path,
+            self.metadata,
+        )
 
-    if not current_images:
-        raise RuntimeError(
-            f"No PNG images found: {IMAGE_DIR}"
+        logger.info(
+            "Displaying #%d: %s / mode=%s",
+            self.counter,
+            image_path,
+            mode,
         )
 
-    if saved_count != len(
-        current_images
-    ):
+        slide = Path(image_path).name
+
+        with self.stages.track("decode", slide):
+            img = await self.take_slide(image_path)
+
+        with self.stages.track("overlay"):
+            img = await self.run_blocking(
+                apply_overlays,
+                img,
+                image_path,
+                slide_updated_at,
+                self.metadata,
+            )
+
         logger.info(
-            "Image count changed: "
-            "%d -> %d; resetting queue",
-            saved_count,
-            len(current_images),
+            "Prepared: mode=%s / size=%s / "
+            "palette_colours=%d",
+            img.mode,
+            img.size,
+            len(img.palette.colors)
+            if img.palette
+            else 0,
         )
-        queue = []
 
-    else:
-        queue = reconcile_queue(
-            queue,
-            current_images,
+        # 準備中に押された分はこの画像も含めて飛ばし、
+        # 押下のたびにリフレッシュしないようにする。
+        late_presses, late_pressed_at = (
+            self.take_button_a_presses()
         )
 
-    while True:
-        if not queue:
-            current_images = collect_images()
+        if late_presses:
+            skipped = skip_queue_entries(
+                self.queue,
+                late_presses - 1,
+            )
 
-            if not current_images:
-                logger.error(
-                    "No PNG images found: %s",
-                    IMAGE_DIR,
-                )
+            logger.info(
+                "Button A pressed %d time(s) during "
+                "prepare: skipping %s and %d more",
+                late_presses,
+                Path(image_path).name,
+                len(skipped),
+            )
 
-                time.sleep(60)
-                continue
+            if self.pressed_at is None:
+                self.pressed_at = late_pressed_at
+
+            self.counter -= 1
+
+            self.save_state()
+
+            return None
 
-            queue = current_images.copy()
+        decision = await self.run_blocking(
+            self.scheduler.check,
+            self.pressed_at is not None,
+        )
+
+        if not decision.allowed:
+            # 同じ画像を先頭に戻して、延期後に表示する
+            self.queue.insert(0, image_path)
+            self.counter -= 1
 
-            random.shuffle(queue)
+            self.save_state()
 
+            # 延期中もループは生きているので、待つ前に slide_task() で、
+            # 待っている間は wait_for_next() で定期的にハートビートを書き、
+            # heartbeat watchdog に再起動されないようにする。
+            return decision.delay
+
+        if self.pressed_at is not None:
             logger.info(
-                "Image queue created: %d images",
-                len(queue),
+                "Button A latency: %.2fs "
+                "(press -> refresh start)",
+                time.monotonic() - self.pressed_at,
             )
 
-        image_path = queue.pop(0)
+            self.pressed_at = None
 
-        if not os.path.exists(
-            image_path
-        ):
-            logger.warning(
-                "Missing image skipped: %s",
+        # ここでRGBへ変換しない。
+        # Macで生成したP-mode PNGをそのまま渡す。
+        with self.stages.track("set_image"):
+            path_used, frame_sha256 = await self.run_on_panel(
+                self.set_on_panel,
+                img,
+            )
+
+        self.check_peak_budget(
+            Path(image_path).name
+        )
+
+        # show() の前に、フレーム以外の中間画像を手放す
+        img = None
+
+        await self.run_blocking(
+            mark_display_pending,
+            image_path,
+        )
+
+        started = time.monotonic()
+
+        with self.stages.track("show"):
+            await self.run_on_panel(
+                self.inky.show
+            )
+
+        self.last_show_seconds = time.monotonic() - started
+
+        # 通常の待ちと同じく、リフレッシュが終わった時点から数える
+        shown_at = datetime.now()
+
+        with self.stages.track("persist"):
+            await self.run_blocking(
+                save_display_record,
                 image_path,
+                frame_sha256,
+                shown_at,
+                CONFIG["INTERVAL_SECONDS"],
+                (self.inky.width, self.inky.height),
             )
 
-            save_state(
-                queue,
-                len(current_images),
+            self.shown += 1
+
+            self.scheduler.record_refresh()
+
+            save_display_counter(
+                self.counter
             )
 
-            continue
+            self.save_state()
 
-        counter += 1
+        await self.run_blocking(
+            self.stages.save_history
+        )
 
-        slide_updated_at = (
-            datetime.now()
+        logger.info(
+            "Display completed: #%d (%.1fs, %s)",
+            self.counter,
+            self.last_show_seconds,
+            path_used,
         )
 
-        try:
-            mode = get_display_mode(
-                image_path,
-                metadata,
+        if self.startup is not None and not self.startup.reported:
+            self.startup.mark("first frame")
+            self.startup.report()
+
+        if self.memory is not None:
+            # スナップショットの比較は重いので executor で
+            await self.run_blocking(
+                self.memory.record_slide
             )
 
-            logger.info(
-                "Displaying #%d: %s / mode=%s",
-                counter,
-                image_path,
-                mode,
+        # 次の1枚（先読みのデコードを含む）のピークを測り始める
+        self.start_peak_measure()
+        self.start_prefetch()
+
+        return FOLLOW_INTERVAL
+
+    def set_on_panel(self, img):
+        """
+        パネル専用スレッドで実行される。
+
+        返り値: (書き込み方法, フレームの sha256)
+        """
+        if img is self.frame.image:
+            path_used = self.frame.write_to_panel(self.inky)
+            digest = hashlib.sha256(self.frame.array).hexdigest()
+
+            return path_used, digest
+
+        self.inky.set_image(img)
+
+        return "set_image", hashlib.sha256(img.tobytes()).hexdigest()
+
+    # ---------- periodic tasks ----------
+
+    async def rescan_task(self):
+        while True:
+            await asyncio.sleep(CONFIG["RESCAN_SECONDS"])
+
+            images = await self.run_blocking(
+                collect_images
             )
 
-            img = prepare_image(
-                image_path,
-                inky,
-                slide_updated_at,
-                metadata,
+            if images:
+                self.apply_rescan(images)
+
+    async def reload_task(self):
+        """
+        .env と metadata.json の mtime を見て、変わったら読み直す。
+
+        パネルのハンドルはそのまま使い続けるので、
+        再起動と違って initialize_display() のリフレッシュは起きない。
+        """
+        while True:
+            await asyncio.sleep(
+                CONFIG["RELOAD_CHECK_SECONDS"]
+            )
+
+            env_mtime = file_mtime(ENV_FILE)
+
+            if env_mtime != self.env_mtime:
+                self.env_mtime = env_mtime
+                await self.reload_config()
+
+            metadata_mtime = file_mtime(METADATA_FILE)
+
+            if metadata_mtime != self.metadata_mtime:
+                self.metadata_mtime = metadata_mtime
+                await self.reload_metadata()
+
+            changes_mtime = file_mtime(LIBRARY_CHANGES_FILE)
+
+            if changes_mtime != self.changes_mtime:
+                self.changes_mtime = changes_mtime
+                await self.apply_library_changes()
+
+    async def apply_library_changes(self):
+        """
+        sync_receiver.py の変更記録を、再スキャンせずにキューへ反映する。
+
+        同名のまま中身が変わった画像は、先読みの mtime 確認で読み直される。
+        記録が途切れていたら（読む前に古い行が捨てられた）再スキャンする。
+        """
+        entries = await self.run_blocking(
+            read_library_changes
+        )
+
+        if last_change_seq(entries) < self.changes_seq:
+            # 記録が作り直された。追加・削除は何度適用しても同じ結果になる
+            self.changes_seq = 0
+
+        pending = sorted(
+            (
+                entry
+                for entry in entries
+                if entry.get("seq", 0) > self.changes_seq
+            ),
+            key=lambda entry: entry["seq"],
+        )
+
+        if not pending:
+            return
+
+        previous_seq = self.changes_seq
+        self.changes_seq = pending[-1]["seq"]
+
+        if PHOTO_PACK is not None:
+            # パックから読んでいるときは、パックの差し替えで反映する
+            return
+
+        if pending[0]["seq"] != previous_seq + 1:
+            logger.warning(
+                "Library change log skipped #%d-#%d; rescanning",
+                previous_seq + 1,
+                pending[0]["seq"] - 1,
+            )
+
+            images = await self.run_blocking(
+                collect_images
             )
 
+        else:
+            images = set(self.current_images)
+
+            for entry in pending:
+                images.difference_update(entry.get("removed", []))
+                images.update(entry.get("added", []))
+
             logger.info(
-                "Prepared: mode=%s / size=%s / "
-                "palette_colours=%d",
-                img.mode,
-                img.size,
-                len(img.palette.colors)
-                if img.palette
-                else 0,
+                "Library changes #%d-#%d: +%d / ~%d / -%d",
+                pending[0]["seq"],
+                self.changes_seq,
+                sum(len(entry.get("added", [])) for entry in pending),
+                sum(len(entry.get("changed", [])) for entry in pending),
+                sum(len(entry.get("removed", [])) for entry in pending),
             )
 
-            # ここでRGBへ変換しない。
-            # Macで生成したP-mode PNGをそのまま渡す。
-            inky.set_image(img)
-            inky.show()
+            images = sorted(images)
 
-            save_display_counter(
-                counter
+        if images:
+            self.apply_rescan(images)
+
+    async def reload_config(self):
+        started = time.monotonic()
+
+        old_library = slide_library()
+        old_metadata_file = METADATA_FILE
+
+        try:
+            changed = reload_environment()
+        except Exception:
+            logger.exception(
+                "Failed to reload %s; keeping current config",
+                ENV_FILE,
             )
+            return
+
+        # フォントと先読みは古い設定で作られているので捨てる
+        FONT_CACHE.clear()
+        self.drop_prefetch()
 
-            save_state(
-                queue,
-                len(current_images),
+        self.scheduler = create_scheduler()
+
+        if slide_library() != old_library:
+            images = await self.run_blocking(
+                collect_images
             )
 
-            update_heartbeat()
+            if images:
+                self.apply_rescan(images)
+            else:
+                logger.error(
+                    "No PNG images found: %s",
+                    slide_library(),
+                )
+
+        if METADATA_FILE != old_metadata_file:
+            self.metadata_mtime = file_mtime(METADATA_FILE)
+            await self.reload_metadata()
+
+        # INTERVAL_SECONDS の変更を今の待ちに反映する
+        self.wake_event.set()
+
+        logger.info(
+            "Reloaded %s in %.1fms: changed=%s",
+            ENV_FILE,
+            (time.monotonic() - started) * 1000,
+            ",".join(changed) or "none",
+        )
+
+    async def reload_metadata(self):
+        started = time.monotonic()
+
+        self.metadata = await self.run_blocking(
+            load_metadata
+        )
+
+        logger.info(
+            "Reloaded %s in %.1fms",
+            METADATA_FILE,
+            (time.monotonic() - started) * 1000,
+        )
+
+    async def telemetry_task(self):
+        while True:
+            await asyncio.sleep(
+                CONFIG["TELEMETRY_SECONDS"]
+            )
 
             logger.info(
-                "Display completed: #%d",
-                counter,
+                "Telemetry: shown=%d / queue=%d / images=%d / "
+                "last_show=%.1fs / rss=%.1fMB / load=%.2f",
+                self.shown,
+                len(self.queue),
+                len(self.current_images),
+                self.last_show_seconds,
+                read_rss_mb(),
+                os.getloadavg()[0],
+            )
+
+    # ---------- entry ----------
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.button_events = asyncio.Queue()
+        self.next_event = asyncio.Event()
+        self.wake_event = asyncio.Event()
+
+        if CONFIG["STAGE_WATCHDOG"]:
+            self.stages.start()
+
+        background = [
+            asyncio.create_task(self.setup_buttons_task()),
+            asyncio.create_task(self.button_task()),
+            asyncio.create_task(self.rescan_task()),
+            asyncio.create_task(self.reload_task()),
+            asyncio.create_task(self.telemetry_task()),
+        ]
+
+        if self.notifier.watchdog_seconds:
+            background.append(
+                asyncio.create_task(self.watchdog_task())
+            )
+
+        try:
+            await self.slide_task()
+
+        finally:
+            self.notifier.stopping()
+
+            for task in background:
+                task.cancel()
+
+            self.panel_executor.shutdown(
+                wait=False,
+                cancel_futures=True,
             )
 
+            self.close_display()
+
+    def close_display(self):
+        """
+        表示ワーカーを止め、共有メモリを /dev/shm から消す。
+
+        DisplayWorker は atexit でも閉じるが、SIGTERM などでの終了時に
+        atexit より先に、ここで確実に後片付けする。
+        """
+        if getattr(self.inky, "frame_buffer", None) is None:
+            return
+
+        # フレームが共有メモリの view を持っていると close() できないので先に手放す
+        self.prefetched = None
+        self.frame = None
+
+        try:
+            self.inky.close()
+
         except Exception:
             logger.exception(
-                "Failed to display image: %s",
-                image_path,
+                "Failed to close display worker"
+            )
+        else:
+            logger.info(
+                "Display worker stopped and shared memory released"
             )
 
-        NEXT_IMAGE_EVENT.clear()
 
-        NEXT_IMAGE_EVENT.wait(
-            CONFIG[
-                "INTERVAL_SECONDS"
-            ]
+# ============================================================
+# Main
+# ============================================================
+
+def exit_on_sigterm(signum, frame):
+    """
+    systemctl stop の SIGTERM を SystemExit にする。
+
+    既定の動作ではその場で終了するので、run() の後片付け（STOPPING=1 など）も
+    atexit（キューとバッファのログの書き出し）も走らない。
+    SystemExit なら asyncio.run() がタスクをキャンセルしてから抜け、
+    atexit まで通常の終了と同じ道をたどる。
+    """
+    # 後片付け中に2回目が来たら、そのまま終了させる
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    logger.info(
+        "SIGTERM received; shutting down"
+    )
+
+    raise SystemExit(0)
+
+
+def main():
+    global logger
+
+    startup = StartupTimeline(STARTUP_STARTED)
+    startup.mark("imports", IMPORTS_DONE)
+
+    preload_module("numpy", startup)
+
+    startup.mark("config")
+
+    logger = setup_logging()
+
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+
+    startup.mark("logging")
+
+    logger.info(
+        "=== Inky 13.3 slideshow starting ==="
+    )
+
+    logger.info(
+        "Image directory: %s",
+        IMAGE_DIR,
+    )
+
+    if PHOTO_PACK is not None:
+        logger.info(
+            "Slide pack: %s",
+            PHOTO_PACK,
+        )
+
+    logger.info(
+        "Metadata file: %s",
+        METADATA_FILE,
+    )
+
+    metadata = load_metadata()
+
+    startup.mark("metadata")
+
+    notifier = SystemdNotifier()
+
+    inky = initialize_display()
+
+    startup.mark("display")
+
+    scheduler = create_scheduler()
+
+    counter = load_display_counter()
+
+    saved_count, queue = load_state()
+
+    current_images = collect_images()
+
+    if not current_images:
+        raise RuntimeError(
+            f"No PNG images found: {slide_library()}"
+        )
+
+    if saved_count != len(
+        current_images
+    ):
+        logger.info(
+            "Image count changed: "
+            "%d -> %d; resetting queue",
+            saved_count,
+            len(current_images),
         )
+        queue = []
+
+    else:
+        queue = reconcile_queue(
+            queue,
+            current_images,
+        )
+
+    runtime = SlideshowRuntime(
+        inky,
+        metadata,
+        scheduler,
+        queue,
+        current_images,
+        counter,
+        notifier,
+        startup,
+    )
+
+    startup.mark("queue")
+
+    # Type=notify の systemd へ、パネルの初期化が済んだことを知らせる
+    if notifier.ready(
+        f"Display ready: {getattr(inky, 'driver', type(inky).__name__)}, "
+        f"{len(current_images)} images"
+    ):
+        logger.info(
+            "Notified systemd: READY=1"
+        )
+
+    asyncio.run(runtime.run())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+常駐スーパーバイザー。
+
+monitor_throttled.py / watch_slideshow_heartbeat.py / network_watchdog.py を
+systemd timer で毎回新しい Python として起動する代わりに、
+1つの常駐プロセスの中で定期タスクとして実行する。
+
+- 各チェックの中身は既存スクリプトの check_*() をそのまま呼ぶ
+- ntfy 通知（Notifier）とログの出力先は全チェックで共有する
+- throttled のログは従来どおり ~/.logs/throttled_monitor.log に同じ書式で書くので、
+  analyze_throttled.py はそのまま使える
+- チェックごとの所要時間をログに出し、~/.cache/supervisor_status.json にまとめる
+
+例:
+  python3 supervisor.py          # 常駐
+  python3 supervisor.py --once   # 全チェックを1回ずつ実行して終了
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from email.header import Header
+from urllib import request, error as urlerror
+
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(BASE_DIR, ".env"))
+
+import monitor_throttled  # noqa: E402
+import network_watchdog  # noqa: E402
+import watch_slideshow_heartbeat  # noqa: E402
+
+
+# ============================================================
+# Config
+# ============================================================
+
+CONFIG = {
+    # 0 でそのチェックを無効にする
+    "THROTTLED_SECONDS": int(
+        os.getenv("SUPERVISOR_THROTTLED_SECONDS", "300")
+    ),
+    "HEARTBEAT_SECONDS": int(
+        os.getenv("SUPERVISOR_HEARTBEAT_SECONDS", "900")
+    ),
+    "NETWORK_SECONDS": int(
+        os.getenv("SUPERVISOR_NETWORK_SECONDS", "600")
+    ),
+
+    # throttled の通知先。ネットワークの通知は NTFY_TOPIC_URL があればそちらへ。
+    "NTFY_URL": os.getenv("NTFY_THROTTLED_URL"),
+    "NTFY_NETWORK_URL": (
+        os.getenv("NTFY_TOPIC_URL", "").strip()
+        or os.getenv("NTFY_THROTTLED_URL")
+    ),
+}
+
+LOG_DIR = os.path.expanduser("~/.logs")
+LOG_FILE = os.path.join(LOG_DIR, "supervisor.log")
+
+STATUS_FILE = os.path.expanduser("~/.cache/supervisor_status.json")
+
+logger = logging.getLogger("supervisor")
+
+
+def setup_logging():
+    """
+    - supervisor 自身と heartbeat / network のログ: ~/.logs/supervisor.log
+    - throttled のログ: ~/.logs/throttled_monitor.log（analyze_throttled.py 用に従来の書式）
+    - どちらも標準エラー（journal）にも出す
+    """
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(levelname)s [%(name)s] %(message)s")
+    )
+
+    file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
+    file_handler.setFormatter(
+        logging.Formatter(
+            "%(asctime)s - %(levelname)s - [%(name)s] %(message)s"
+        )
+    )
+
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[
+            file_handler,
+            stream_handler,
+        ],
+    )
+
+    throttled_handler = logging.FileHandler(
+        monitor_throttled.LOG_FILE,
+        encoding="utf-8",
+    )
+    throttled_handler.setFormatter(
+        logging.Formatter(monitor_throttled.LOG_FORMAT)
+    )
+
+    throttled_logger = logging.getLogger("throttled")
+    throttled_logger.propagate = False
+    throttled_logger.addHandler(throttled_handler)
+    throttled_logger.addHandler(stream_handler)
+
+
+# ============================================================
+# Notifier
+# ============================================================
+
+class Notifier:
+    """
+    ntfy への通知。全チェックで共有する。
+
+    monitor_throttled.send_ntfy と同じくヘッダで Title / Tags / Priority を送る。
+    日本語のタイトルは RFC 2047 でエンコードする（ntfy が解釈する）。
+    """
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+        self.sent = 0
+        self.failed = 0
+
+    def send(self, title, message, tags=None, priority=None, url=None):
+        url = url or self.url
+
+        if not url:
+            logger.warning(
+                "ntfy URL が設定されていないため、通知をスキップします: %s",
+                title,
+            )
+            return
+
+        headers = {
+            "Title": Header(title, "utf-8").encode(),
+        }
+        if tags:
+            headers["Tags"] = ",".join(tags)
+        if priority:
+            headers["Priority"] = str(priority)
+
+        req = request.Request(
+            url,
+            data=message.encode("utf-8"),
+            headers=headers,
+            method="POST",
+        )
+
+        try:
+            with request.urlopen(req, timeout=self.timeout) as resp:
+                self.sent += 1
+                logger.info("ntfy sent: HTTP %s", resp.status)
+
+        except (urlerror.URLError, OSError) as e:
+            self.failed += 1
+            logger.error("ntfy send error: %s", e)
+
+    def for_url(self, url):
+        """send と同じ引数で、通知先だけ変えた関数を返す。"""
+        def send(title, message, tags=None, priority=None):
+            self.send(title, message, tags, priority, url=url)
+
+        return send
+
+
+# ============================================================
+# Scheduler
+# ============================================================
+
+class Check:
+    """定期タスク1つ分。所要時間と結果を覚えておく。"""
+
+    def __init__(self, name, interval, func, first_delay=0):
+        self.name = name
+        self.interval = interval
+        self.func = func
+
+        self.next_run = time.monotonic() + first_delay
+
+        self.runs = 0
+        self.errors = 0
+        self.last_seconds = None
+        self.max_seconds = 0.0
+        self.total_seconds = 0.0
+        self.last_result = None
+        self.last_run_at = None
+
+    def run(self):
+        started = time.monotonic()
+        self.last_run_at = datetime.now().isoformat(timespec="seconds")
+
+        try:
+            self.last_result = self.func()
+            status = "ok"
+
+        except Exception:
+            self.errors += 1
+            self.last_result = None
+            status = "error"
+
+            logger.exception("check %s failed", self.name)
+
+        elapsed = time.monotonic() - started
+
+        self.runs += 1
+        self.last_seconds = elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+        self.total_seconds += elapsed
+
+        logger.info(
+            "check %s: %s in %.2fs (avg %.2fs, max %.2fs, runs %d)",
+            self.name,
+            status,
+            elapsed,
+            self.total_seconds / self.runs,
+            self.max_seconds,
+            self.runs,
+        )
+
+        # 遅れても取り戻そうと連続実行はしない
+        self.next_run = max(
+            self.next_run + self.interval,
+            time.monotonic(),
+        )
+
+    def status(self):
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "errors": self.errors,
+            "last_run_at": self.last_run_at,
+            "last_seconds": (
+                round(self.last_seconds, 3)
+                if self.last_seconds is not None
+                else None
+            ),
+            "avg_seconds": (
+                round(self.total_seconds / self.runs, 3)
+                if self.runs
+                else None
+            ),
+            "max_seconds": round(self.max_seconds, 3),
+            "last_result": (
+                round(self.last_result, 1)
+                if isinstance(self.last_result, float)
+                else self.last_result
+            ),
+        }
+
+
+def write_status(checks, notifier):
+    data = {
+        "updated_at": datetime.now().isoformat(timespec="seconds"),
+        "pid": os.getpid(),
+        "checks": {check.name: check.status() for check in checks},
+        "ntfy": {"sent": notifier.sent, "failed": notifier.failed},
+    }
+
+    tmp_file = STATUS_FILE + ".tmp"
+
+    try:
+        os.makedirs(os.path.dirname(STATUS_FILE), exist_ok=True)
+
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+        os.replace(tmp_file, STATUS_FILE)
+
+    except Exception as e:
+        logger.error("status save error: %s", e)
+
+
+def create_checks(notifier):
+    heartbeat_log = logging.getLogger("heartbeat").info
+    network_log = logging.getLogger("network").info
+
+    candidates = (
+        # 起動直後に1回（monitor-throttled.timer の OnBootSec 相当）
+        Check(
+            "throttled",
+            CONFIG["THROTTLED_SECONDS"],
+            lambda: monitor_throttled.check_throttled(notifier.send),
+        ),
+        # slideshow の起動を待ってから
+        Check(
+            "heartbeat",
+            CONFIG["HEARTBEAT_SECONDS"],
+            lambda: watch_slideshow_heartbeat.check_heartbeat(heartbeat_log),
+            first_delay=CONFIG["HEARTBEAT_SECONDS"],
+        ),
+        Check(
+            "network",
+            CONFIG["NETWORK_SECONDS"],
+            lambda: network_watchdog.check_network(
+                network_log,
+                notifier.for_url(CONFIG["NTFY_NETWORK_URL"]),
+            ),
+            first_delay=60,
+        ),
+    )
+
+    return [check for check in candidates if check.interval > 0]
+
+
+def run_forever(checks, notifier):
+    while True:
+        check = min(checks, key=lambda c: c.next_run)
+        wait = check.next_run - time.monotonic()
+
+        if wait > 0:
+            time.sleep(wait)
+            continue
+
+        check.run()
+        write_status(checks, notifier)
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the throttled / heartbeat / network checks in one process",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="run every enabled check once and exit",
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    setup_logging()
+
+    notifier = Notifier(CONFIG["NTFY_URL"])
+    checks = create_checks(notifier)
+
+    if not checks:
+        logger.error("All checks are disabled")
+        return
+
+    logger.info(
+        "===== supervisor start: %s =====",
+        ", ".join(f"{c.name}/{c.interval}s" for c in checks),
+    )
+
+    if args.once:
+        for check in checks:
+            check.run()
+
+        write_status(checks, notifier)
+        return
+
+    run_forever(checks, notifier)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+トーン・ディザのパラメータを総当たりして、1枚のコンタクトシートにする。
+
+archive/ の test-gamma.py / test-saturation.py / test-variant.py のように
+設定ごとにパネルを全面リフレッシュする代わりに、
+全組み合わせを preprocess_photos.py と同じ量子化パスで描画し、
+ラベル付きの 1600x1200 P-mode PNG 1枚にまとめる。
+
+- 組み合わせはプロセスプールで並列に描画する（--jobs）
+- 出力はそのまま slideshow.py / inky で表示できる6色パレットの PNG
+- --show でパネルへ1回だけ表示する
+
+例:
+  python3 sweep_contact_sheet.py photos_raw/808.jpeg \
+    --gamma 1.0,1.25 --saturation 0.5,0.75 \
+    --dither floyd-steinberg,blue-noise
+"""
+
+import argparse
+import itertools
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import ImageDraw, ImageFont
+
+import preprocess_photos as pp
+
+
+SHEET_SIZE = pp.TARGET_SIZE
+
+LABEL_HEIGHT = 22
+CELL_GAP = 4
+
+FONT_PATH = os.getenv(
+    "FONT_PATH",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+)
+
+# 掃引できるパラメータ: (CLI 名, options のキー, 型, ラベルの略号)
+SWEEP_PARAMS = (
+    ("gamma", "GAMMA", float, "g"),
+    ("highlight-knee", "HIGHLIGHT_KNEE", int, "k"),
+    ("highlight-strength", "HIGHLIGHT_STRENGTH", float, "hs"),
+    ("tone-saturation", "TONE_SATURATION", float, "ts"),
+    ("saturation", "SATURATION", float, "s"),
+    ("dither", "DITHER", str, ""),
+    ("metric", "METRIC", str, ""),
+)
+
+DITHER_LABELS = {
+    "floyd-steinberg": "fs",
+    "floyd-steinberg-parallel": "fs-mp",
+    "bayer": "bayer",
+    "blue-noise": "blue",
+    "none": "none",
+}
+
+
+# ============================================================
+# Layout
+# ============================================================
+
+def grid_shape(count, sheet_size=SHEET_SIZE):
+    """
+    count 個のセルを、4:3 に近いセルで sheet_size に収める (cols, rows)。
+    """
+    width, height = sheet_size
+    best = None
+
+    for cols in range(1, count + 1):
+        rows = math.ceil(count / cols)
+        cell_w = width / cols
+        cell_h = height / rows - LABEL_HEIGHT
+
+        if cell_h <= 0:
+            continue
+
+        # 画像部分の面積が最大になる配置を選ぶ
+        image_w = min(cell_w, cell_h * 4 / 3)
+        area = image_w * image_w * 3 / 4
+
+        if best is None or area > best[0]:
+            best = (area, cols, rows)
+
+    return best[1], best[2]
+
+
+def format_label(options, varying, image_name):
+    parts = []
+
+    for cli_name, key, _, prefix in SWEEP_PARAMS:
+        if key not in varying:
+            continue
+
+        value = options[key]
+
+        if key == "DITHER":
+            parts.append(DITHER_LABELS.get(value, value))
+        elif prefix:
+            parts.append(f"{prefix}{value:g}")
+        else:
+            parts.append(str(value))
+
+    if image_name:
+        parts.append(image_name)
+
+    return " ".join(parts)
+
+
+# ============================================================
+# Rendering
+# ============================================================
+
+def render_cell(task):
+    """
+    1セル分を preprocess_photos と同じトーン補正・量子化で描画し、
+    パネル色順の index 配列を返す。
+    """
+    path, options, cell_size = task
+
+    # セルは小さいので、JPEG は縮小デコードで十分
+    img, _ = pp.load_source_low_memory(path, target_size=cell_size)
+    img = pp.apply_tone(img, options)
+
+    return pp.quantize(
+        img,
+        options["SATURATION"],
+        options["DITHER"],
+        options["DISPLAY_MODE"],
+        options["METRIC"],
+        options["LUT_BITS"],
+    )
+
+
+def load_label_font(size=14):
+    try:
+        return ImageFont.truetype(FONT_PATH, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def compose_sheet(cells, labels, cols, rows, cell_size):
+    """index 配列のセルを並べ、白地にラベルを描いた P-mode 画像を返す。"""
+    width, height = SHEET_SIZE
+    pitch_w = width // cols
+    pitch_h = height // rows
+
+    # index 1 = WHITE
+    sheet = np.ones((height, width), dtype=np.uint8)
+
+    positions = []
+
+    for i, indices in enumerate(cells):
+        x = (i % cols) * pitch_w + (pitch_w - cell_size[0]) // 2
+        y = (i // cols) * pitch_h
+
+        sheet[y:y + cell_size[1], x:x + cell_size[0]] = indices
+        positions.append((x, y + cell_size[1]))
+
+    img = pp.to_panel_image(sheet)
+    draw = ImageDraw.Draw(img)
+    font = load_label_font()
+
+    for (x, y), label in zip(positions, labels):
+        # index 0 = BLACK
+        draw.text((x + 2, y + 3), label, fill=0, font=font)
+
+    return img
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def parse_values(text, cast):
+    return [cast(value.strip()) for value in text.split(",") if value.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render a labelled contact sheet of tone/dither settings",
+    )
+
+    parser.add_argument("images", nargs="+", type=Path)
+
+    for cli_name, key, _, _ in SWEEP_PARAMS:
+        parser.add_argument(
+            f"--{cli_name}",
+            default=None,
+            help=f"comma separated values (default: {pp.CONFIG[key]})",
+        )
+
+    parser.add_argument(
+        "--out",
+        type=Path,
+        default=Path("sweep-contact-sheet.png"),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=pp.CONFIG["JOBS"],
+    )
+    parser.add_argument(
+        "--show",
+        action="store_true",
+        help="display the sheet on the Inky panel (one refresh)",
+    )
+
+    return parser.parse_args(argv)
+
+
+def build_tasks(args):
+    """パラメータの直積 × 画像のタスク一覧と、変化するキーを返す。"""
+    base = {
+        key: pp.CONFIG[key]
+        for key in (
+            "TONE_ORDER",
+            "GAMMA",
+            "HIGHLIGHT_KNEE",
+            "HIGHLIGHT_STRENGTH",
+            "TONE_SATURATION",
+            "SATURATION",
+            "DITHER",
+            "DISPLAY_MODE",
+            "METRIC",
+            "LUT_BITS",
+        )
+    }
+
+    axes = []
+
+    for cli_name, key, cast, _ in SWEEP_PARAMS:
+        text = getattr(args, cli_name.replace("-", "_"))
+        values = parse_values(text, cast) if text else [base[key]]
+
+        if key == "DITHER":
+            unknown = set(values) - set(pp.DITHER_MODES)
+
+            if unknown:
+                raise SystemExit(f"Unknown dither mode: {sorted(unknown)}")
+
+        axes.append((key, values))
+
+    varying = {key for key, values in axes if len(values) > 1}
+    combos = []
+
+    for values in itertools.product(*(values for _, values in axes)):
+        options = dict(base)
+        options.update(zip((key for key, _ in axes), values))
+
+        error = pp.check_highlight(
+            options["HIGHLIGHT_KNEE"],
+            options["HIGHLIGHT_STRENGTH"],
+        )
+
+        if error:
+            raise SystemExit(error)
+
+        combos.append(options)
+
+    tasks = [
+        (path, options)
+        for options in combos
+        for path in args.images
+    ]
+
+    return tasks, varying
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    tasks, varying = build_tasks(args)
+    show_names = len(args.images) > 1
+
+    cols, rows = grid_shape(len(tasks))
+
+    pitch_w = SHEET_SIZE[0] // cols
+    pitch_h = SHEET_SIZE[1] // rows
+    image_h = pitch_h - LABEL_HEIGHT - CELL_GAP
+    image_w = min(pitch_w - CELL_GAP, image_h * 4 // 3)
+    cell_size = (image_w, image_w * 3 // 4)
+
+    print(
+        f"{len(tasks)} cells ({cols}x{rows}, {cell_size[0]}x{cell_size[1]} "
+        f"each) / jobs={args.jobs}"
+    )
+
+    started = time.monotonic()
+
+    render_tasks = [(path, options, cell_size) for path, options in tasks]
+
+    if args.jobs > 1 and len(render_tasks) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            cells = list(pool.map(render_cell, render_tasks))
+    else:
+        cells = [render_cell(task) for task in render_tasks]
+
+    labels = [
+        format_label(
+            options,
+            varying,
+            path.stem if show_names else "",
+        )
+        for path, options in tasks
+    ]
+
+    sheet = compose_sheet(cells, labels, cols, rows, cell_size)
+    sheet.save(args.out, format="PNG", optimize=True)
+
+    print(f"Saved: {args.out} ({time.monotonic() - started:.1f}s)")
+
+    if args.show:
+        from inky.auto import auto
+
+        inky = auto(verbose=True)
+        inky.set_image(sheet)
+        inky.show()
+
+        print("Finished.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,937 @@
+#!/usr/bin/env python3
+"""
+Mac から Pi へ、変わったスライドだけを送る差分同期。
+
+PHOTO_DIR へ毎回全ファイルをコピーする代わりに、送り手がライブラリ全体の
+sha256 のマニフェストを送り、受け手（Pi）は無い・中身が違うファイルだけを要求する。
+
+- 受け取ったファイルは PHOTO_DIR の隣の一時ディレクトリに置き、sha256 を確かめる
+- commit で PHOTO_DIR と metadata.json へ rename でまとめて反映する。
+  反映の前に一時ディレクトリへ手順（commit.json）を書いておくので、
+  途中で電源が落ちても次の起動時に最後までやり直す
+- 反映した追加・変更・削除を ~/.cache/slideshow_library_changes_133.jsonl に残す。
+  slideshow.py はこれを読んでキューを更新するので、再スキャンしない
+- 手元のファイルの sha256 はサイズと mtime で ~/.cache/sync_receiver_index.json に
+  覚えておき、変わったファイルだけ計算し直す
+
+HTTP（既定ポート 8765）:
+  POST /manifest                    {"files": {name: sha256}, "metadata_sha256": ...}
+  PUT  /session/<id>/files/<name>   PNG 本体
+  PUT  /session/<id>/metadata       metadata.json 本体
+  POST /session/<id>/commit
+
+例:
+  python3 sync_receiver.py serve                                   # Pi（受け手）
+  python3 sync_receiver.py send photos \\
+    --metadata photos/metadata.json --url http://inky.local:8765   # Mac（送り手）
+
+送るのは Pi の PHOTO_DIR に当たるディレクトリ（名前は PHOTO_DIR からの相対名）。
+"""
+
+import argparse
+import hashlib
+import http.server
+import json
+import logging
+import os
+import secrets
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+from urllib import parse, request, error as urlerror
+
+import slideshow
+
+
+# ============================================================
+# Config
+# ============================================================
+
+CONFIG = {
+    "HOST": os.getenv("SYNC_HOST", "0.0.0.0"),
+    "PORT": int(
+        os.getenv("SYNC_PORT", "8765")
+    ),
+
+    # 送り手と受け手で同じ値にする。ループバック以外で待ち受けるときは必須
+    "TOKEN": os.getenv("SYNC_TOKEN", "").strip() or None,
+
+    # send の送り先
+    "URL": os.getenv("SYNC_URL", "http://localhost:8765"),
+
+    # 1 でマニフェストに無いファイルを消す（送り手のライブラリをそのまま写す）
+    "DELETE": int(
+        os.getenv("SYNC_DELETE", "0")
+    ),
+
+    "MAX_FILE_MB": int(
+        os.getenv("SYNC_MAX_FILE_MB", "64")
+    ),
+
+    # 変更記録に残す件数
+    "KEEP_CHANGES": int(
+        os.getenv("SYNC_KEEP_CHANGES", "200")
+    ),
+}
+
+INDEX_FILE = Path.home() / ".cache" / "sync_receiver_index.json"
+
+LOG_DIR = Path.home() / ".logs"
+LOG_FILE = LOG_DIR / "sync_receiver.log"
+
+STAGING_PREFIX = ".sync-staging-"
+
+MAX_MANIFEST_BYTES = 16 * 1024 * 1024
+
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+logger = logging.getLogger("sync")
+
+
+class SyncError(Exception):
+    """マニフェストやファイルが不正・セッションが違うなど、送り手に返すエラー。"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def setup_logging():
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+
+    file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
+    file_handler.setFormatter(
+        logging.Formatter(slideshow.LOG_FORMAT)
+    )
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(levelname)s %(message)s")
+    )
+
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[
+            file_handler,
+            stream_handler,
+        ],
+    )
+
+
+# ============================================================
+# Library
+# ============================================================
+
+def is_slide_path(relative):
+    """collect_images() と同じく、隠しファイル・隠しディレクトリ以外の PNG。"""
+    return (
+        relative.suffix.lower() == ".png"
+        and not any(part.startswith(".") for part in relative.parts)
+    )
+
+
+def check_name(name):
+    """送り手から来た名前が PHOTO_DIR の中の PNG を指しているか確かめる。"""
+    path = PurePosixPath(name)
+
+    if (
+        not name
+        or "\\" in name
+        or path.is_absolute()
+        or ".." in path.parts
+        or path.as_posix() != name
+        or not is_slide_path(path)
+    ):
+        raise SyncError(f"Invalid slide name: {name!r}")
+
+    return name
+
+
+def list_slides(root):
+    """root 以下のスライドを (PHOTO_DIR からの相対名, Path) で返す。"""
+    root = Path(root)
+
+    if not root.exists():
+        return []
+
+    slides = []
+
+    for path in sorted(root.rglob("*.png")):
+        relative = path.relative_to(root)
+
+        if path.is_file() and is_slide_path(relative):
+            slides.append((relative.as_posix(), path))
+
+    return slides
+
+
+def top_level(names):
+    """相対名の先頭のディレクトリ（PHOTO_DIR 直下のファイルは ""）。"""
+    return {
+        name.split("/", 1)[0] if "/" in name else ""
+        for name in names
+    }
+
+
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_json_atomic(path, data, indent=None):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_file = path.with_name(path.name + ".tmp")
+
+    with tmp_file.open("w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_file, path)
+
+
+class LibraryIndex:
+    """
+    PHOTO_DIR の 相対名 -> sha256。
+
+    Pi Zero 2 W で数千枚を毎回ハッシュすると数十秒かかるので、
+    サイズと mtime が前回と同じファイルは保存しておいた値を使う。
+    """
+
+    def __init__(self, root, cache_file=None):
+        self.root = Path(root)
+        self.cache_file = Path(cache_file or INDEX_FILE)
+        self.cache = self._load()
+
+    def _load(self):
+        try:
+            with self.cache_file.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+
+            if data.get("root") == str(self.root.resolve()):
+                return data.get("files", {})
+
+        except (OSError, ValueError):
+            pass
+
+        return {}
+
+    def save(self):
+        try:
+            write_json_atomic(
+                self.cache_file,
+                {
+                    "root": str(self.root.resolve()),
+                    "files": self.cache,
+                },
+            )
+
+        except OSError as e:
+            logger.error("index save error: %s", e)
+
+    def record(self, name, sha256):
+        st = (self.root / name).stat()
+        self.cache[name] = [st.st_size, st.st_mtime_ns, sha256]
+
+    def scan(self):
+        started = time.monotonic()
+
+        files = {}
+        cache = {}
+        hashed = 0
+
+        for name, path in list_slides(self.root):
+            st = path.stat()
+            cached = self.cache.get(name)
+
+            if (
+                cached
+                and cached[0] == st.st_size
+                and cached[1] == st.st_mtime_ns
+            ):
+                sha256 = cached[2]
+            else:
+                sha256 = slideshow.file_sha256(path)
+                hashed += 1
+
+            files[name] = sha256
+            cache[name] = [st.st_size, st.st_mtime_ns, sha256]
+
+        self.cache = cache
+
+        if hashed:
+            self.save()
+
+        logger.info(
+            "Library scanned: %d slides, %d hashed (%.1fs)",
+            len(files),
+            hashed,
+            time.monotonic() - started,
+        )
+
+        return files
+
+
+# ============================================================
+# Commit
+# ============================================================
+
+def append_library_changes(added, changed, removed):
+    """slideshow.py が読む変更記録に1件足す。返り値: 連番"""
+    entries = slideshow.read_library_changes()
+    seq = slideshow.last_change_seq(entries) + 1
+
+    entries.append(
+        {
+            "seq": seq,
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "added": added,
+            "changed": changed,
+            "removed": removed,
+        }
+    )
+
+    path = slideshow.LIBRARY_CHANGES_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_file = path.with_name(path.name + ".tmp")
+
+    with tmp_file.open("w", encoding="utf-8") as f:
+        for entry in entries[-CONFIG["KEEP_CHANGES"]:]:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_file, path)
+
+    return seq
+
+
+def apply_commit(staging, root, metadata_file, plan):
+    """
+    commit.json の手順どおりに、一時ディレクトリから PHOTO_DIR へ反映する。
+
+    rename 済みのものは飛ばすので、途中で止まったあとにもう一度呼んでよい。
+    返り値: 変更記録の連番（スライドに変更が無ければ None）
+    """
+    root = Path(root)
+    touched = {root}
+
+    for name in plan["files"]:
+        source = staging / "files" / name
+        target = root / name
+
+        if source.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(source, target)
+            touched.add(target.parent)
+
+    for name in plan["removed"]:
+        target = root / name
+        target.unlink(missing_ok=True)
+        touched.add(target.parent)
+
+    if plan["metadata"]:
+        source = staging / "metadata.json"
+
+        if source.exists():
+            os.replace(source, metadata_file)
+            touched.add(Path(metadata_file).parent)
+
+    for directory in touched:
+        if directory.exists():
+            fsync_dir(directory)
+
+    base = root.resolve()
+    seq = None
+
+    # metadata.json だけの変更は、slideshow.py が mtime を見て読み直す
+    if plan["added"] or plan["changed"] or plan["removed"]:
+        seq = append_library_changes(
+            [str(base / name) for name in plan["added"]],
+            [str(base / name) for name in plan["changed"]],
+            [str(base / name) for name in plan["removed"]],
+        )
+
+    shutil.rmtree(staging, ignore_errors=True)
+
+    return seq
+
+
+def recover_staging(root, metadata_file):
+    """
+    前回の一時ディレクトリを片付ける。
+
+    commit.json があれば反映の途中で止まっているので最後までやり直し、
+    無ければ commit 前なので捨てる。
+    """
+    parent = Path(root).parent
+
+    if not parent.exists():
+        return
+
+    for staging in sorted(parent.glob(STAGING_PREFIX + "*")):
+        journal = staging / "commit.json"
+
+        try:
+            with journal.open("r", encoding="utf-8") as f:
+                plan = json.load(f)
+
+        except (OSError, ValueError):
+            logger.info("Discarding unfinished upload: %s", staging)
+            shutil.rmtree(staging, ignore_errors=True)
+            continue
+
+        seq = apply_commit(staging, root, metadata_file, plan)
+
+        logger.warning(
+            "Finished an interrupted commit: %s (change #%s)",
+            staging,
+            seq or "-",
+        )
+
+
+# ============================================================
+# Session
+# ============================================================
+
+class SyncSession:
+    """マニフェスト1つ分の差分。受け取ったファイルは一時ディレクトリに置く。"""
+
+    def __init__(self, root, metadata_file, manifest, local):
+        files = manifest.get("files")
+
+        if not isinstance(files, dict):
+            raise SyncError("Manifest has no files")
+
+        for name, sha256 in files.items():
+            check_name(name)
+
+            if not isinstance(sha256, str) or len(sha256) != 64:
+                raise SyncError(f"Invalid sha256 for {name}")
+
+        if not files and local:
+            raise SyncError("Refusing an empty manifest for a non-empty library")
+
+        # PHOTO_DIR="photos/" に photos/auto を送ると、名前が auto/ の分ずれて
+        # 全部が追加＋削除になる。先頭のディレクトリが1つも重ならなければ断る
+        if files and local and not top_level(files) & top_level(local):
+            raise SyncError(
+                "Manifest shares no top-level directory with the library "
+                f"(sent {sorted(top_level(files))}, "
+                f"have {sorted(top_level(local))}); "
+                "send the directory that PHOTO_DIR points to",
+                409,
+            )
+
+        self.id = secrets.token_hex(8)
+
+        self.root = Path(root)
+        self.metadata_file = Path(metadata_file)
+
+        # rename できるよう、PHOTO_DIR と同じファイルシステムに置く
+        self.staging = self.root.parent / f"{STAGING_PREFIX}{self.id}"
+
+        self.expected = {
+            name: sha256
+            for name, sha256 in files.items()
+            if local.get(name) != sha256
+        }
+
+        self.added = sorted(name for name in self.expected if name not in local)
+        self.changed = sorted(name for name in self.expected if name in local)
+
+        self.removed = (
+            sorted(set(local) - set(files))
+            if CONFIG["DELETE"]
+            else []
+        )
+
+        self.metadata_sha256 = manifest.get("metadata_sha256")
+        self.need_metadata = bool(self.metadata_sha256) and (
+            not self.metadata_file.exists()
+            or slideshow.file_sha256(self.metadata_file) != self.metadata_sha256
+        )
+
+        self.received = set()
+        self.metadata_received = False
+
+    def plan(self):
+        return {
+            "session": self.id,
+            "need": sorted(self.expected),
+            "need_metadata": self.need_metadata,
+            "removed": self.removed,
+        }
+
+    def _receive(self, target, stream, length, sha256):
+        if length > CONFIG["MAX_FILE_MB"] * 1024 * 1024:
+            raise SyncError(f"Too large: {length} bytes", 413)
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        digest = hashlib.sha256()
+        remaining = length
+
+        with target.open("wb") as f:
+            while remaining:
+                chunk = stream.read(min(remaining, 1 << 20))
+
+                if not chunk:
+                    raise SyncError("Upload ended early")
+
+                digest.update(chunk)
+                f.write(chunk)
+                remaining -= len(chunk)
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        if digest.hexdigest() != sha256:
+            target.unlink()
+            raise SyncError(f"sha256 mismatch: {target.name}")
+
+    def receive_file(self, name, stream, length):
+        if name not in self.expected:
+            raise SyncError(f"Not requested: {name}", 409)
+
+        self._receive(
+            self.staging / "files" / name,
+            stream,
+            length,
+            self.expected[name],
+        )
+
+        self.received.add(name)
+
+    def receive_metadata(self, stream, length):
+        if not self.need_metadata:
+            raise SyncError("metadata.json not requested", 409)
+
+        self._receive(
+            self.staging / "metadata.json",
+            stream,
+            length,
+            self.metadata_sha256,
+        )
+
+        self.metadata_received = True
+
+    def commit(self):
+        missing = set(self.expected) - self.received
+
+        if missing:
+            raise SyncError(f"{len(missing)} files not uploaded", 409)
+
+        if self.need_metadata and not self.metadata_received:
+            raise SyncError("metadata.json not uploaded", 409)
+
+        plan = {
+            "files": sorted(self.received),
+            "added": self.added,
+            "changed": self.changed,
+            "removed": self.removed,
+            "metadata": self.metadata_received,
+        }
+
+        # ここから先は、止まっても recover_staging() が最後まで反映する
+        self.staging.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(self.staging / "commit.json", plan)
+        fsync_dir(self.staging)
+
+        return apply_commit(
+            self.staging,
+            self.root,
+            self.metadata_file,
+            plan,
+        )
+
+
+class SyncReceiver:
+    """同時に扱うセッションは1つだけ。新しいマニフェストが来たら前のものは捨てる。"""
+
+    def __init__(self, root, metadata_file):
+        self.root = Path(root)
+        self.metadata_file = Path(metadata_file)
+        self.index = LibraryIndex(self.root)
+        self.session = None
+
+    def start_session(self, manifest):
+        if self.session is not None:
+            logger.info("Dropping unfinished session %s", self.session.id)
+            self.session = None
+
+            # commit の途中で失敗していたら、捨てずに最後まで反映する
+            recover_staging(self.root, self.metadata_file)
+
+        local = self.index.scan()
+
+        self.session = SyncSession(
+            self.root,
+            self.metadata_file,
+            manifest,
+            local,
+        )
+
+        logger.info(
+            "Session %s: %d files in manifest, +%d / ~%d / -%d, metadata=%s",
+            self.session.id,
+            len(manifest["files"]),
+            len(self.session.added),
+            len(self.session.changed),
+            len(self.session.removed),
+            "yes" if self.session.need_metadata else "no",
+        )
+
+        return self.session.plan()
+
+    def get_session(self, session_id):
+        if self.session is None or self.session.id != session_id:
+            raise SyncError(f"Unknown session: {session_id}", 404)
+
+        return self.session
+
+    def commit(self, session_id):
+        session = self.get_session(session_id)
+        started = time.monotonic()
+
+        seq = session.commit()
+        self.session = None
+
+        for name in session.received:
+            self.index.record(name, session.expected[name])
+
+        for name in session.removed:
+            self.index.cache.pop(name, None)
+
+        self.index.save()
+
+        logger.info(
+            "Committed session %s as change #%s: +%d / ~%d / -%d%s (%.2fs)",
+            session.id,
+            seq or "-",
+            len(session.added),
+            len(session.changed),
+            len(session.removed),
+            " + metadata.json" if session.metadata_received else "",
+            time.monotonic() - started,
+        )
+
+        return {
+            "seq": seq,
+            "added": len(session.added),
+            "changed": len(session.changed),
+            "removed": len(session.removed),
+            "metadata": session.metadata_received,
+        }
+
+
+# ============================================================
+# HTTP
+# ============================================================
+
+class SyncHandler(http.server.BaseHTTPRequestHandler):
+    server_version = "inky-sync/1"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def content_length(self):
+        try:
+            return int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            raise SyncError("Content-Length required", 411) from None
+
+    def authorize(self):
+        token = self.server.token
+
+        if token is None:
+            return
+
+        given = self.headers.get("Authorization", "")
+
+        if not secrets.compare_digest(given, f"Bearer {token}"):
+            raise SyncError("Unauthorized", 401)
+
+    def handle_request(self, method):
+        try:
+            self.authorize()
+
+            parts = [
+                parse.unquote(part)
+                for part in parse.urlsplit(self.path).path.strip("/").split("/", 3)
+            ]
+
+            receiver = self.server.receiver
+            length = self.content_length()
+
+            if method == "POST" and parts == ["manifest"]:
+                if length > MAX_MANIFEST_BYTES:
+                    raise SyncError("Manifest too large", 413)
+
+                try:
+                    manifest = json.loads(self.rfile.read(length))
+                except ValueError:
+                    raise SyncError("Manifest is not JSON") from None
+
+                self.send_json(200, receiver.start_session(manifest))
+
+            elif parts[0] != "session" or len(parts) < 3:
+                raise SyncError(f"Not found: {method} {self.path}", 404)
+
+            elif method == "PUT" and len(parts) == 4 and parts[2] == "files":
+                session = receiver.get_session(parts[1])
+                session.receive_file(check_name(parts[3]), self.rfile, length)
+                self.send_json(200, {"ok": True})
+
+            elif method == "PUT" and parts[2:] == ["metadata"]:
+                session = receiver.get_session(parts[1])
+                session.receive_metadata(self.rfile, length)
+                self.send_json(200, {"ok": True})
+
+            elif method == "POST" and parts[2:] == ["commit"]:
+                self.send_json(200, receiver.commit(parts[1]))
+
+            else:
+                raise SyncError(f"Not found: {method} {self.path}", 404)
+
+        except SyncError as e:
+            logger.warning("%s %s: %s", method, self.path, e)
+            self.close_connection = True
+            self.send_json(e.status, {"error": str(e)})
+
+        except Exception as e:
+            logger.exception("%s %s failed", method, self.path)
+            self.close_connection = True
+            self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+
+def create_server(root, metadata_file, host, port, token):
+    """
+    1リクエストずつ順に処理する（セッションにロックが要らない）。
+
+    port=0 なら空いているポートを使う（server.server_address で分かる）。
+    """
+    if token is None and host not in LOOPBACK_HOSTS:
+        raise SystemExit(
+            "SYNC_TOKEN is required unless SYNC_HOST is a loopback address"
+        )
+
+    recover_staging(root, metadata_file)
+
+    server = http.server.HTTPServer((host, port), SyncHandler)
+    server.receiver = SyncReceiver(root, metadata_file)
+    server.token = token
+
+    return server
+
+
+# ============================================================
+# Sender
+# ============================================================
+
+def build_manifest(photo_dir, metadata_file=None):
+    manifest = {
+        "files": {
+            name: slideshow.file_sha256(path)
+            for name, path in list_slides(photo_dir)
+        },
+    }
+
+    if metadata_file is not None and Path(metadata_file).exists():
+        manifest["metadata_sha256"] = slideshow.file_sha256(metadata_file)
+
+    return manifest
+
+
+def call(url, method, path, body, token=None, timeout=120):
+    headers = {
+        "Content-Type": "application/octet-stream",
+    }
+
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+
+    req = request.Request(
+        url.rstrip("/") + path,
+        data=body,
+        headers=headers,
+        method=method,
+    )
+
+    try:
+        with request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read())
+
+    except urlerror.HTTPError as e:
+        try:
+            message = json.loads(e.read())["error"]
+        except (ValueError, KeyError):
+            message = e.reason
+
+        raise SyncError(f"HTTP {e.code}: {message}", e.code) from None
+
+
+def send_library(url, photo_dir, metadata_file=None, token=None):
+    """
+    送り手。マニフェストを送り、要求されたファイルだけを送って commit する。
+
+    返り値: 受け手の commit の結果
+    """
+    photo_dir = Path(photo_dir)
+    started = time.monotonic()
+
+    manifest = build_manifest(photo_dir, metadata_file)
+
+    plan = call(
+        url,
+        "POST",
+        "/manifest",
+        json.dumps(manifest).encode("utf-8"),
+        token,
+    )
+
+    session = parse.quote(plan["session"])
+    sent_bytes = 0
+
+    for name in plan["need"]:
+        data = (photo_dir / name).read_bytes()
+        sent_bytes += len(data)
+
+        call(
+            url,
+            "PUT",
+            f"/session/{session}/files/{parse.quote(name)}",
+            data,
+            token,
+        )
+
+    if plan["need_metadata"]:
+        data = Path(metadata_file).read_bytes()
+        sent_bytes += len(data)
+
+        call(
+            url,
+            "PUT",
+            f"/session/{session}/metadata",
+            data,
+            token,
+        )
+
+    result = call(
+        url,
+        "POST",
+        f"/session/{session}/commit",
+        b"",
+        token,
+    )
+
+    result["sent_files"] = len(plan["need"])
+    result["sent_bytes"] = sent_bytes
+    result["manifest_files"] = len(manifest["files"])
+    result["seconds"] = round(time.monotonic() - started, 2)
+
+    return result
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Content-hash delta sync of the slide library",
+    )
+
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="receive library updates (on the Pi)")
+    serve.add_argument("--host", default=CONFIG["HOST"])
+    serve.add_argument("--port", type=int, default=CONFIG["PORT"])
+    serve.add_argument("--photo-dir", type=Path, default=slideshow.IMAGE_DIR)
+    serve.add_argument("--metadata", type=Path, default=slideshow.METADATA_FILE)
+
+    send = sub.add_parser("send", help="send a library (on the Mac)")
+    send.add_argument("photo_dir", type=Path)
+    send.add_argument("--metadata", type=Path, default=None)
+    send.add_argument("--url", default=CONFIG["URL"])
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "send":
+        try:
+            result = send_library(
+                args.url,
+                args.photo_dir,
+                args.metadata,
+                CONFIG["TOKEN"],
+            )
+
+        except (SyncError, OSError) as e:
+            raise SystemExit(f"sync failed: {e}")
+
+        print(
+            f"change #{result['seq'] or '-'}: "
+            f"+{result['added']} / ~{result['changed']} / "
+            f"-{result['removed']}"
+            f"{' + metadata.json' if result['metadata'] else ''} / "
+            f"sent {result['sent_files']}/{result['manifest_files']} files "
+            f"({result['sent_bytes'] / 1024 / 1024:.1f}MB) in {result['seconds']}s"
+        )
+        return
+
+    setup_logging()
+
+    server = create_server(
+        args.photo_dir,
+        args.metadata,
+        args.host,
+        args.port,
+        CONFIG["TOKEN"],
+    )
+
+    logger.info(
+        "===== sync receiver on %s:%d -> %s / %s =====",
+        args.host,
+        server.server_address[1],
+        args.photo_dir,
+        args.metadata,
+    )
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
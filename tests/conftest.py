@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# スクリプトはリポジトリ直下に並んでいるので、そのまま import できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
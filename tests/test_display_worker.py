@@ -0,0 +1,309 @@
+import json
+import os
+import re
+import textwrap
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import display_worker
+import panel_driver
+from display_worker import DisplayWorker, DisplayWorkerError
+
+
+SIZE = (160, 120)
+
+PANEL_REMAP = np.frombuffer(panel_driver.PANEL_REMAP, dtype=np.uint8)
+
+# ワーカーが import する偽のドライバ。名前を inky_el133uf1 に合わせて、
+# buf へ直接書く経路も通す。misbehave は1回目の show() だけで、
+# 作り直したワーカーは普通に動く（marker ファイルで判断する）。
+FAKE_DRIVER = '''
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+class Panel:
+    WHITE = 1
+
+    def __init__(self, out, misbehave, size):
+        self.out = Path(out)
+        self.misbehave = misbehave
+        self.width, self.height = size
+        self.buf = np.zeros((self.height, self.width), dtype=np.uint8)
+
+    def set_border(self, colour):
+        pass
+
+    def set_image(self, image):
+        self.buf = np.asarray(image).copy()
+
+    def show(self):
+        marker = self.out / "misbehaved"
+
+        if self.misbehave and not marker.exists():
+            marker.touch()
+
+            if self.misbehave == "hang":
+                time.sleep(3600)
+            elif self.misbehave == "raise":
+                raise RuntimeError("SPI transfer failed")
+            elif self.misbehave == "exit":
+                os._exit(3)
+
+        (self.out / "shown.bin").write_bytes(self.buf.tobytes())
+
+
+def create(out, misbehave=None, size=None, init=None):
+    (Path(out) / "worker.json").write_text(
+        json.dumps(
+            {
+                "pid": os.getpid(),
+                "slideshow_imported": "slideshow" in sys.modules,
+            }
+        )
+    )
+
+    if init == "hang":
+        time.sleep(3600)
+    elif init == "raise":
+        raise OSError("no panel on SPI")
+
+    return Panel(out, misbehave, size or (160, 120))
+'''
+
+
+@pytest.fixture
+def fake_driver(tmp_path, monkeypatch):
+    """偽のドライバモジュールを書き、ワーカーが import できるようにする。"""
+    modules = tmp_path / "modules"
+    modules.mkdir()
+
+    (modules / "fake_inky_el133uf1.py").write_text(textwrap.dedent(FAKE_DRIVER))
+
+    monkeypatch.setenv("PYTHONPATH", str(modules))
+
+    out = tmp_path / "out"
+    out.mkdir()
+
+    workers = []
+
+    def start(**kwargs):
+        timeouts = {
+            "init_timeout": kwargs.pop("init_timeout", 30.0),
+            "command_timeout": 5.0,
+            "show_timeout": kwargs.pop("show_timeout", 5.0),
+        }
+
+        worker = DisplayWorker(
+            size=SIZE,
+            factory="fake_inky_el133uf1:create",
+            factory_kwargs={"out": str(out), **kwargs},
+            **timeouts,
+        )
+        workers.append(worker)
+
+        return worker
+
+    yield start, out
+
+    for worker in workers:
+        worker.close()
+
+
+def shm_exists(name):
+    return (display_worker.SHM_DIR / name).exists()
+
+
+def worker_info(out):
+    return json.loads((out / "worker.json").read_text())
+
+
+def show_frame(worker, out, indices):
+    worker.array[...] = indices
+
+    assert worker.set_frame(panel_driver.PANEL_PALETTE_BYTES) == "direct"
+
+    worker.show()
+
+    return np.frombuffer(
+        (out / "shown.bin").read_bytes(),
+        dtype=np.uint8,
+    ).reshape(SIZE[1], SIZE[0])
+
+
+def frame_indices(seed=0):
+    return np.random.default_rng(seed).integers(
+        0,
+        6,
+        size=(SIZE[1], SIZE[0]),
+        dtype=np.uint8,
+    )
+
+
+# ============================================================
+# Commands
+# ============================================================
+
+def test_worker_writes_shared_frame(fake_driver):
+    start, out = fake_driver
+    worker = start()
+
+    indices = frame_indices()
+    shown = show_frame(worker, out, indices)
+
+    assert np.array_equal(shown, PANEL_REMAP[indices])
+    assert worker.restarts == 0
+
+    # ワーカーは slideshow.py を import しない
+    assert worker_info(out) == {
+        "pid": worker.process.pid,
+        "slideshow_imported": False,
+    }
+
+
+def test_worker_set_image_for_other_palettes(fake_driver):
+    start, out = fake_driver
+    worker = start()
+
+    from PIL import Image
+
+    image = Image.fromarray(frame_indices(1), "P")
+    image.putpalette(bytes(range(18)))
+
+    assert worker.set_image(image) == "set_image"
+
+    worker.show()
+
+    assert (out / "shown.bin").read_bytes() == image.tobytes()
+
+
+@pytest.mark.parametrize(
+    ("misbehave", "message", "restarts"),
+    [
+        ("hang", "show timed out", 1),
+        ("exit", "exited during show (code 3)", 1),
+        # ドライバの例外ではワーカーは生きているので、作り直さない
+        ("raise", "show failed: RuntimeError: SPI transfer failed", 0),
+    ],
+)
+def test_worker_recovers_from_failed_show(fake_driver, misbehave, message, restarts):
+    start, out = fake_driver
+    worker = start(misbehave=misbehave, show_timeout=1.0)
+
+    first_pid = worker.process.pid
+    worker.array[...] = frame_indices()
+    worker.set_frame(panel_driver.PANEL_PALETTE_BYTES)
+
+    with pytest.raises(DisplayWorkerError, match=re.escape(message)):
+        worker.show()
+
+    assert worker.restarts == restarts
+    assert (worker.process.pid != first_pid) == bool(restarts)
+
+    # 次のコマンドは同じ共有メモリのまま成功する
+    indices = frame_indices(2)
+    shown = show_frame(worker, out, indices)
+
+    assert np.array_equal(shown, PANEL_REMAP[indices])
+
+
+def test_dead_worker_is_restarted_on_next_command(fake_driver):
+    start, out = fake_driver
+    worker = start()
+
+    # コマンドの合間にワーカーが消えた（OOM killer など）
+    worker.process.kill()
+    worker.process.wait(5)
+
+    with pytest.raises(DisplayWorkerError, match="pipe closed before show"):
+        worker.show()
+
+    assert worker.restarts == 1
+
+    indices = frame_indices(3)
+    shown = show_frame(worker, out, indices)
+
+    assert np.array_equal(shown, PANEL_REMAP[indices])
+
+
+# ============================================================
+# Start and close
+# ============================================================
+
+@pytest.mark.parametrize(
+    ("kwargs", "message"),
+    [
+        ({"size": [200, 100]}, "Unexpected display resolution: 200x100"),
+        ({"init": "raise"}, "init failed: OSError: no panel on SPI"),
+        ({"init": "hang", "init_timeout": 1.0}, "init timed out"),
+    ],
+)
+def test_failed_start_releases_shared_memory(fake_driver, monkeypatch, kwargs, message):
+    start, out = fake_driver
+
+    created = []
+    create_shm = display_worker.shared_memory.SharedMemory
+
+    def record_shm(*args, **kw):
+        shm = create_shm(*args, **kw)
+        created.append(shm.name)
+        return shm
+
+    monkeypatch.setattr(display_worker.shared_memory, "SharedMemory", record_shm)
+
+    with pytest.raises(DisplayWorkerError, match=re.escape(message)):
+        start(**kwargs)
+
+    [name] = created
+    assert not shm_exists(name)
+
+    # 初期化中のワーカーも残さない
+    assert not Path(f"/proc/{worker_info(out)['pid']}").exists()
+
+
+def test_close_stops_worker_and_unlinks_shared_memory(fake_driver):
+    start, out = fake_driver
+    worker = start()
+
+    name = worker.shm.name
+    process = worker.process
+
+    # FrameBuffer のように、共有メモリの view を持ったままでも閉じられる
+    view = np.ndarray(
+        (SIZE[1], SIZE[0]),
+        dtype=np.uint8,
+        buffer=worker.frame_buffer,
+    )
+
+    assert shm_exists(name)
+
+    worker.close()
+
+    assert not shm_exists(name)
+    assert process.poll() is not None
+    assert worker.process is None and worker.shm is None
+
+    del view
+
+    # 2回目（atexit）は何もしない
+    worker.close()
+
+
+def test_killed_worker_does_not_unlink_parent_segment(fake_driver):
+    start, out = fake_driver
+    worker = start(misbehave="exit")
+
+    name = worker.shm.name
+
+    with pytest.raises(DisplayWorkerError):
+        worker.show()
+
+    assert shm_exists(name)
+    assert os.path.getsize(display_worker.SHM_DIR / name) == SIZE[0] * SIZE[1]
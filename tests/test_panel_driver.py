@@ -0,0 +1,119 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import panel_driver
+
+
+# ============================================================
+# Display model cache
+# ============================================================
+
+class FakeDriver:
+    """inky のドライバの代わり。resolution を受け取るが、実寸は width/height。"""
+
+    __module__ = "fake_inky"
+
+    width, height = 1600, 1200
+
+    def __init__(self, resolution=None):
+        self.resolution = resolution
+
+
+class FakeImports:
+    """open_display() の import_module の代わり。inky.auto の呼び出しを数える。"""
+
+    def __init__(self, driver=FakeDriver):
+        self.probes = 0
+        self.modules = {
+            "fake_inky": SimpleNamespace(FakeDriver=driver),
+            "inky.auto": SimpleNamespace(auto=self.auto),
+        }
+
+    def auto(self, verbose=False):
+        self.probes += 1
+        return FakeDriver()
+
+    def __call__(self, name):
+        try:
+            return self.modules[name]
+        except KeyError:
+            raise ModuleNotFoundError(name) from None
+
+
+def test_display_model_cache_hit_skips_probe(tmp_path):
+    cache_file = tmp_path / "display_model.json"
+    imports = FakeImports()
+
+    first = panel_driver.open_display(imports, cache_file, use_cache=True)
+
+    assert imports.probes == 1
+    assert isinstance(first, FakeDriver)
+    assert panel_driver.load_display_model(cache_file) == {
+        "module": "fake_inky",
+        "class": "FakeDriver",
+        "resolution": (1600, 1200),
+    }
+
+    second = panel_driver.open_display(imports, cache_file, use_cache=True)
+
+    assert imports.probes == 1
+    assert second.resolution == (1600, 1200)
+
+
+@pytest.mark.parametrize(
+    "cached",
+    [
+        # ドライバのモジュールがなくなった
+        {"module": "gone_inky", "class": "FakeDriver"},
+        # クラス名が変わった
+        {"module": "fake_inky", "class": "InkyRenamed"},
+        # 別の解像度のパネルに付け替えた
+        {"module": "fake_inky", "class": "FakeDriver", "resolution": [800, 480]},
+    ],
+)
+def test_stale_display_model_falls_back_to_probe(tmp_path, cached):
+    cache_file = tmp_path / "display_model.json"
+    cache_file.write_text(
+        json.dumps({"resolution": [1600, 1200], **cached})
+    )
+
+    imports = FakeImports()
+
+    inky = panel_driver.open_display(imports, cache_file, use_cache=True)
+
+    assert imports.probes == 1
+    assert inky.resolution is None
+    # 検出し直した結果で上書きされる
+    assert panel_driver.load_display_model(cache_file)["module"] == "fake_inky"
+    assert panel_driver.load_display_model(cache_file)["resolution"] == (1600, 1200)
+
+
+@pytest.mark.parametrize(
+    "content",
+    ["", "{not json", '{"module": "fake_inky"}', '["fake_inky"]'],
+)
+def test_corrupt_display_model_is_ignored(tmp_path, content):
+    cache_file = tmp_path / "display_model.json"
+    cache_file.write_text(content)
+
+    assert panel_driver.load_display_model(cache_file) is None
+
+    imports = FakeImports()
+
+    panel_driver.open_display(imports, cache_file, use_cache=True)
+
+    assert imports.probes == 1
+    assert panel_driver.load_display_model(cache_file) is not None
+
+
+def test_display_model_cache_disabled(tmp_path):
+    cache_file = tmp_path / "display_model.json"
+    imports = FakeImports()
+
+    panel_driver.open_display(imports, cache_file, use_cache=False)
+    panel_driver.open_display(imports, cache_file, use_cache=False)
+
+    assert imports.probes == 2
+    assert not cache_file.exists()
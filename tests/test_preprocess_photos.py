@@ -0,0 +1,181 @@
+import math
+import os
+
+import numpy as np
+import pytest
+
+import preprocess_photos as pp
+
+
+def uniform_rgb(size=256, seed=0):
+    """RGB 空間を一様に覆う、固定シードの合成画像。"""
+    return np.random.default_rng(seed).integers(
+        0,
+        256,
+        size=(size, size, 3),
+        dtype=np.uint8,
+    )
+
+
+# ============================================================
+# 3D LUT
+# ============================================================
+
+@pytest.mark.parametrize("metric", pp.DISTANCE_METRICS)
+@pytest.mark.parametrize("saturation", [0.0, 0.5, 1.0])
+def test_lut_matches_exact_search(metric, saturation):
+    palette = pp.blend_palette(saturation)
+    lut = pp.build_palette_lut(palette, 6, metric)
+
+    result = pp.compare_lut(uniform_rgb(), palette, lut, metric)
+
+    assert result["match_ratio"] >= 0.985
+
+
+def test_lut_mismatch_is_bounded_by_cell_size():
+    # 6bit LUT のセルは 4 段幅。セル中心との距離は最大 1.5*sqrt(3) なので、
+    # 三角不等式から、外れた画素の余分な距離はその2倍を超えない。
+    palette = pp.blend_palette(0.5)
+    lut = pp.build_palette_lut(palette, 6, "rgb")
+
+    result = pp.compare_lut(uniform_rgb(), palette, lut, "rgb")
+
+    assert result["extra_max"] <= 2 * 1.5 * math.sqrt(3) + 1e-9
+
+
+def test_lut_disk_cache_round_trip(tmp_path):
+    palette = pp.blend_palette(0.5)
+
+    built = pp.get_palette_lut(palette, 5, "rgb", cache_dir=tmp_path)
+    pp._LUT_MEMO.clear()
+    loaded = pp.get_palette_lut(palette, 5, "rgb", cache_dir=tmp_path)
+
+    assert len(list(tmp_path.glob("lut-nearest-rgb-5-*.npy"))) == 1
+    np.testing.assert_array_equal(built, loaded)
+
+
+# ============================================================
+# Tone curves
+# ============================================================
+
+@pytest.mark.parametrize("knee", [0, 128, 200, 254])
+@pytest.mark.parametrize("strength", [10.0, 60.0, 300.0, -300.0])
+def test_highlight_curve_is_monotonic(knee, strength):
+    curve = pp.highlight_curve(knee, strength)
+    values = curve(np.arange(256, dtype=np.float64))
+
+    assert np.all(np.diff(values) >= -1e-9)
+    assert values[255] == pytest.approx(255.0)
+
+
+def test_check_highlight_rejects_inverting_strength():
+    assert pp.check_highlight(200, 55) is None
+    assert pp.check_highlight(255, 0) is None
+    assert "invert" in pp.check_highlight(200, 60)
+    assert pp.check_highlight(300, 10) is not None
+
+    with pytest.raises(SystemExit):
+        pp.parse_args(["--highlight-knee", "200", "--highlight-strength", "60"])
+
+
+# ============================================================
+# Ordered dithering
+# ============================================================
+
+@pytest.mark.parametrize("dither", ["bayer", "blue-noise"])
+def test_ordered_dither_matches_per_pixel_rule(dither):
+    palette = pp.blend_palette(0.5)
+    mix_lut = pp.build_mix_lut(palette, 6, "rgb")
+    matrix = pp.threshold_matrix(dither)
+    rgb = uniform_rgb(size=100)
+
+    indices = pp.ordered_dither_indices(rgb, mix_lut, matrix)
+
+    # 画素ごとに「しきい値 < 比率 なら b、そうでなければ a」
+    mix = mix_lut[rgb[..., 0] >> 2, rgb[..., 1] >> 2, rgb[..., 2] >> 2]
+    rows, cols = np.indices(rgb.shape[:2])
+    thresholds = np.rint(
+        matrix[rows % matrix.shape[0], cols % matrix.shape[1]] * 255
+    )
+    expected = np.where(thresholds < mix[..., 2], mix[..., 1], mix[..., 0])
+
+    assert indices.dtype == np.uint8
+    assert np.array_equal(indices, expected)
+
+
+# ============================================================
+# Parallel error diffusion
+# ============================================================
+
+def serial_floyd_steinberg(rgb, palette, lut):
+    """1画素ずつ左上から処理する、素直な Floyd-Steinberg。"""
+    height, width = rgb.shape[:2]
+    bits = int(round(math.log2(lut.shape[0])))
+    work = rgb.astype(np.float64)
+    out = np.empty((height, width), dtype=np.uint8)
+
+    for r in range(height):
+        for x in range(width):
+            value = np.clip(work[r, x], 0.0, 255.0)
+            level = value.astype(int) >> (8 - bits)
+            index = lut[level[0], level[1], level[2]]
+            out[r, x] = index
+            error = value - palette[index]
+
+            if x + 1 < width:
+                work[r, x + 1] += error * 0.4375
+
+            if r + 1 < height:
+                if x > 0:
+                    work[r + 1, x - 1] += error * 0.1875
+
+                work[r + 1, x] += error * 0.3125
+
+                if x + 1 < width:
+                    work[r + 1, x + 1] += error * 0.0625
+
+    return out
+
+
+@pytest.mark.parametrize("shape", [(23, 31), (9, 2), (2, 9), (1, 5), (6, 1)])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_error_diffusion_matches_serial(shape, workers):
+    palette = pp.blend_palette(0.5)
+    lut = pp.build_palette_lut(palette, 6, "rgb")
+    rgb = np.random.default_rng(1).integers(
+        0,
+        256,
+        size=shape + (3,),
+        dtype=np.uint8,
+    )
+
+    indices = pp.error_diffusion_indices(rgb, palette, lut, workers)
+
+    assert np.array_equal(indices, serial_floyd_steinberg(rgb, palette, lut))
+
+
+# ============================================================
+# Rendition cache
+# ============================================================
+
+def test_rendition_cache_evicts_oldest_once_per_batch(tmp_path):
+    from PIL import Image
+
+    img = Image.fromarray(uniform_rgb(size=32))
+    cache = pp.RenditionCache(tmp_path, 1)
+
+    for i in range(4):
+        key = f"{i:02d}" * 16
+        cache.put("crop", key, img)
+        path = cache.path("crop", key)
+        os.utime(path, (1000 + i, 1000 + i))
+
+    # put() は追い出さない
+    sizes = [cache.path("crop", f"{i:02d}" * 16).stat().st_size for i in range(4)]
+    assert all(size > 0 for size in sizes)
+
+    cache.max_bytes = sizes[2] + sizes[3]
+    cache.evict()
+
+    kept = [cache.path("crop", f"{i:02d}" * 16).exists() for i in range(4)]
+    assert kept == [False, False, True, True]
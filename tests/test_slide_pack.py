@@ -0,0 +1,524 @@
+import hashlib
+import json
+import logging
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import slide_pack
+import slideshow
+from slide_pack import (
+    FOOTER,
+    HEADER,
+    RECORD,
+    PackEntry,
+    PackError,
+    SlidePack,
+    append_to_pack,
+    build_pack,
+)
+
+
+@pytest.fixture(autouse=True)
+def plain_logger(monkeypatch):
+    monkeypatch.setattr(slideshow, "logger", logging.getLogger("slideshow"))
+
+
+def write_png(path, seed=0, size=(40, 30)):
+    """6色パレットの小さな P-mode PNG を書き、そのバイト列を返す。"""
+    indices = np.random.default_rng(seed).integers(
+        0,
+        6,
+        size=(size[1], size[0]),
+        dtype=np.uint8,
+    )
+
+    image = Image.fromarray(indices, "P")
+    image.putpalette(bytes(range(18)))
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    image.save(path)
+
+    return path.read_bytes()
+
+
+def make_sources(photos, names, seed=0, capture_date=None, mode=None):
+    sources = []
+
+    for i, name in enumerate(names):
+        path = photos / name
+        write_png(path, seed=seed + i)
+        sources.append((name, path, capture_date, mode))
+
+    return sources
+
+
+def read_slide(pack, name):
+    with pack.view(name) as data:
+        return bytes(data)
+
+
+def flip_byte(path, offset):
+    with Path(path).open("r+b") as f:
+        f.seek(offset)
+        byte = f.read(1)[0]
+        f.seek(offset)
+        f.write(bytes((byte ^ 0xFF,)))
+
+
+# ============================================================
+# Format
+# ============================================================
+
+def test_pack_layout(tmp_path):
+    photos = tmp_path / "photos"
+    sources = make_sources(
+        photos,
+        ["auto/b.png", "auto/a.png"],
+        capture_date="2024-05-01 10:00:00",
+        mode="fill",
+    )
+
+    pack_path = tmp_path / "photos.pack"
+    assert build_pack(pack_path, sources) == (2, [])
+
+    raw = pack_path.read_bytes()
+
+    assert (HEADER.size, RECORD.size, FOOTER.size) == (32, 256, 32)
+    assert HEADER.unpack_from(raw, 0)[:3] == (b"INKYPAK1", 1, RECORD.size)
+
+    # PNG は sources の順に連結され、索引は name 順
+    magic, index_offset, count, index_crc, created = FOOTER.unpack_from(
+        raw,
+        len(raw) - FOOTER.size,
+    )
+    index = raw[index_offset:len(raw) - FOOTER.size]
+
+    assert (magic, count) == (b"INKYIDX1", 2)
+    assert zlib.crc32(index) == index_crc
+    assert created > 0
+
+    entries = [
+        slide_pack.unpack_record(index[i:i + RECORD.size])
+        for i in range(0, len(index), RECORD.size)
+    ]
+
+    assert [entry.name for entry in entries] == ["auto/a.png", "auto/b.png"]
+    assert entries[1].offset == HEADER.size
+
+    for entry in entries:
+        data = (photos / entry.name).read_bytes()
+
+        assert raw[entry.offset:entry.offset + entry.length] == data
+        assert entry.crc32 == zlib.crc32(data)
+        assert (entry.capture_date, entry.mode) == ("2024-05-01 10:00:00", "fill")
+
+
+def test_record_round_trip():
+    entry = PackEntry("auto/日本語.png", 32, 1234, 0xDEADBEEF, None, None)
+
+    assert slide_pack.unpack_record(slide_pack.pack_record(entry)) == entry
+
+    with pytest.raises(ValueError, match="name too long"):
+        slide_pack.pack_record(entry._replace(name="x" * 193))
+
+
+@pytest.mark.parametrize(
+    ("data", "complete"),
+    [
+        (slide_pack.PNG_SIGNATURE + b"\0" * 8 + b"IEND\xaeB`\x82", True),
+        (slide_pack.PNG_SIGNATURE + b"\0" * 20, False),
+        (b"GIF89a" + b"\0" * 10 + b"IEND\xaeB`\x82", False),
+        (b"", False),
+    ],
+)
+def test_is_complete_png(data, complete):
+    assert slide_pack.is_complete_png(data) is complete
+
+
+# ============================================================
+# Build
+# ============================================================
+
+def test_build_swaps_atomically(tmp_path):
+    photos = tmp_path / "photos"
+    pack_path = tmp_path / "photos.pack"
+
+    build_pack(pack_path, make_sources(photos, ["auto/a.png"]))
+
+    old = SlidePack(pack_path)
+    old_a = read_slide(old, "auto/a.png")
+
+    # 同期途中の書きかけ PNG（IEND まで無い）は飛ばす
+    partial = photos / "auto" / "partial.png"
+    partial.write_bytes(write_png(tmp_path / "full.png", seed=9)[:100])
+
+    sources = make_sources(photos, ["auto/b.png"], seed=5)
+    sources.append(("auto/partial.png", partial, None, None))
+
+    assert build_pack(pack_path, sources) == (1, [partial])
+    assert not (tmp_path / "photos.pack.tmp").exists()
+
+    # 開いていた古いパックは、差し替え後も前の内容を読める
+    assert old.names() == ["auto/a.png"]
+    assert read_slide(old, "auto/a.png") == old_a
+    old.verify("auto/a.png")
+
+    new = SlidePack(pack_path)
+
+    assert new.names() == ["auto/b.png"]
+    assert new.stat_key() != old.stat_key()
+    assert read_slide(new, "auto/b.png") == (photos / "auto/b.png").read_bytes()
+
+
+def test_failed_build_keeps_old_pack(tmp_path):
+    photos = tmp_path / "photos"
+    pack_path = tmp_path / "photos.pack"
+
+    build_pack(pack_path, make_sources(photos, ["auto/a.png"]))
+    before = pack_path.read_bytes()
+
+    sources = make_sources(photos, ["auto/b.png"])
+    sources.append(("auto/gone.png", photos / "auto/gone.png", None, None))
+
+    with pytest.raises(FileNotFoundError):
+        build_pack(pack_path, sources)
+
+    assert pack_path.read_bytes() == before
+    assert not (tmp_path / "photos.pack.tmp").exists()
+
+
+def test_cli_build_reads_metadata(tmp_path, capsys):
+    photos = tmp_path / "photos"
+    write_png(photos / "auto" / "a.png")
+    write_png(photos / "auto" / "b.png", seed=1)
+    write_png(photos / "auto" / ".hidden.png", seed=2)
+
+    (photos / "metadata.json").write_text(
+        json.dumps(
+            {
+                "a.png": {
+                    "capture_date": "2023:08:15 18:30:00.123",
+                    "display_mode": "fit",
+                },
+                "IMG_0002.JPG": {"output": "auto/b.png", "mode": "fill"},
+            }
+        )
+    )
+
+    pack_path = tmp_path / "photos.pack"
+    slide_pack.main(["build", str(photos), str(pack_path)])
+
+    assert "build: 2 added / 0 skipped / 2 slides" in capsys.readouterr().out
+
+    pack = SlidePack(pack_path)
+
+    assert pack.entry("auto/a.png")[4:] == ("2023:08:15 18:30:00", "fit")
+    assert pack.entry("auto/b.png")[4:] == (None, "fill")
+
+
+# ============================================================
+# Append
+# ============================================================
+
+def test_append_adds_and_replaces(tmp_path):
+    photos = tmp_path / "photos"
+    pack_path = tmp_path / "photos.pack"
+
+    build_pack(pack_path, make_sources(photos, ["auto/a.png", "auto/b.png"]))
+
+    old = SlidePack(pack_path)
+    old_a = read_slide(old, "auto/a.png")
+    old_size = pack_path.stat().st_size
+
+    sources = make_sources(photos, ["auto/a.png", "auto/c.png"], seed=10)
+
+    assert append_to_pack(pack_path, sources) == (2, [])
+
+    # 既存のバイトは書き換えない
+    raw = pack_path.read_bytes()
+    assert raw[:old.footer_offset] == bytes(old.mm[:old.footer_offset])
+    assert len(raw) > old_size
+
+    new = SlidePack(pack_path)
+
+    assert new.names() == ["auto/a.png", "auto/b.png", "auto/c.png"]
+    assert new.truncated_tail == 0
+    assert new.entry("auto/a.png").offset >= old_size
+    assert new.entry("auto/b.png") == old.entry("auto/b.png")
+
+    for name in new.names():
+        assert read_slide(new, name) == (photos / name).read_bytes()
+        new.verify(name)
+
+    # 追記前に開いたパックは、古い長さのまま前の a.png を読む
+    assert read_slide(old, "auto/a.png") == old_a
+    assert "auto/c.png" not in old
+
+
+# ============================================================
+# Recovery
+# ============================================================
+
+def test_corrupt_tail_falls_back_to_previous_index(tmp_path):
+    photos = tmp_path / "photos"
+    pack_path = tmp_path / "photos.pack"
+
+    build_pack(pack_path, make_sources(photos, ["auto/a.png"]))
+    append_to_pack(pack_path, make_sources(photos, ["auto/b.png"], seed=1))
+
+    good_size = pack_path.stat().st_size
+
+    # append の途中で電源が落ちた: PNG の途中と、書きかけの footer
+    garbage = (photos / "auto/b.png").read_bytes()[:50] + b"INKYIDX1\0\0\0"
+
+    with pack_path.open("ab") as f:
+        f.write(garbage)
+
+    pack = SlidePack(pack_path)
+
+    assert pack.names() == ["auto/a.png", "auto/b.png"]
+    assert pack.footer_offset == good_size - FOOTER.size
+    assert pack.truncated_tail == len(garbage)
+
+    pack.close()
+
+    # 次の append は壊れた末尾の上に書く
+    append_to_pack(pack_path, make_sources(photos, ["auto/c.png"], seed=2))
+
+    pack = SlidePack(pack_path)
+
+    assert pack.names() == ["auto/a.png", "auto/b.png", "auto/c.png"]
+    assert pack.truncated_tail == 0
+    assert pack.entry("auto/c.png").offset == good_size
+
+    for name in pack.names():
+        pack.verify(name)
+
+
+def test_truncated_footer_falls_back_after_append(tmp_path):
+    photos = tmp_path / "photos"
+    pack_path = tmp_path / "photos.pack"
+
+    build_pack(pack_path, make_sources(photos, ["auto/a.png"]))
+    first_size = pack_path.stat().st_size
+
+    append_to_pack(pack_path, make_sources(photos, ["auto/b.png"], seed=1))
+
+    with pack_path.open("r+b") as f:
+        f.truncate(pack_path.stat().st_size - 10)
+
+    pack = SlidePack(pack_path)
+
+    assert pack.names() == ["auto/a.png"]
+    assert pack.footer_offset == first_size - FOOTER.size
+    assert pack.truncated_tail == pack_path.stat().st_size - first_size
+
+
+@pytest.mark.parametrize(
+    ("damage", "message"),
+    [
+        # 索引が1つしかないパックの footer が途中で切れた
+        (lambda raw: raw[:-10], "No valid index found"),
+        # 索引そのものが化けた（crc32 が合わない）
+        (
+            lambda raw: raw[:-FOOTER.size - 1] + b"\xff" + raw[-FOOTER.size:],
+            "No valid index found",
+        ),
+        (lambda raw: b"NOTAPACK" + raw[8:], "Not a version 1 slide pack"),
+        (lambda raw: raw[:HEADER.size + FOOTER.size - 1], "Too small for a slide pack"),
+    ],
+)
+def test_unreadable_pack_raises(tmp_path, damage, message):
+    photos = tmp_path / "photos"
+    pack_path = tmp_path / "photos.pack"
+
+    build_pack(pack_path, make_sources(photos, ["auto/a.png"]))
+    pack_path.write_bytes(damage(pack_path.read_bytes()))
+
+    with pytest.raises(PackError, match=message):
+        SlidePack(pack_path)
+
+
+def test_flipped_payload_byte_fails_verify(tmp_path, capsys):
+    photos = tmp_path / "photos"
+    pack_path = tmp_path / "photos.pack"
+
+    build_pack(pack_path, make_sources(photos, ["auto/a.png", "auto/b.png"]))
+
+    entry = SlidePack(pack_path).entry("auto/a.png")
+    flip_byte(pack_path, entry.offset + entry.length // 2)
+
+    # 索引は無事なので開ける。化けたスライドだけが読めない
+    pack = SlidePack(pack_path)
+
+    with pytest.raises(PackError, match="crc32 mismatch: auto/a.png"):
+        pack.verify("auto/a.png")
+
+    with pytest.raises(PackError, match="crc32 mismatch"):
+        pack.open("auto/a.png")
+
+    pack.verify("auto/b.png")
+
+    with pytest.raises(SystemExit) as excinfo:
+        slide_pack.main(["verify", str(pack_path)])
+
+    assert excinfo.value.code == 1
+    assert "verify: 1 ok / 1 bad" in capsys.readouterr().out
+
+
+# ============================================================
+# Reader
+# ============================================================
+
+def test_member_reads_like_a_file(tmp_path):
+    photos = tmp_path / "photos"
+    pack_path = tmp_path / "photos.pack"
+
+    build_pack(pack_path, make_sources(photos, ["auto/a.png", "auto/b.png"]))
+
+    data = (photos / "auto/b.png").read_bytes()
+    pack = SlidePack(pack_path)
+    member = pack.open("auto/b.png")
+
+    assert member.read(8) == slide_pack.PNG_SIGNATURE
+    assert member.tell() == 8
+
+    member.seek(-4, 2)
+    assert member.read() == data[-4:]
+    assert member.read(10) == b""
+
+    member.seek(16)
+    buffer = bytearray(8)
+    assert member.readinto(buffer) == 8
+    assert bytes(buffer) == data[16:24]
+
+    member.seek(0)
+    with Image.open(member, formats=["PNG"]) as image:
+        assert image.mode == "P"
+        assert image.tobytes() == Image.open(photos / "auto/b.png").tobytes()
+
+    # member の memoryview を放せば mmap を閉じられる
+    member.close()
+    pack.close()
+
+    assert pack.mm.closed
+
+
+# ============================================================
+# slideshow.py
+# ============================================================
+
+@pytest.fixture
+def photo_pack(tmp_path, monkeypatch):
+    """PHOTO_PACK を使う slideshow。パックを作るたびに開き直す。"""
+    photos = tmp_path / "photos"
+    pack_path = tmp_path / "photos.pack"
+
+    build_pack(
+        pack_path,
+        make_sources(
+            photos,
+            ["auto/a.png", "auto/b.png"],
+            capture_date="2024:01:02 03:04:05",
+            mode="fit",
+        ),
+    )
+
+    monkeypatch.setattr(slideshow, "PHOTO_PACK", pack_path)
+    monkeypatch.setattr(slideshow, "SLIDE_PACK", None)
+
+    return photos, pack_path
+
+
+def test_slideshow_reads_slides_from_pack(photo_pack):
+    photos, pack_path = photo_pack
+    a = f"{pack_path}::/auto/a.png"
+
+    assert slideshow.collect_images() == [a, f"{pack_path}::/auto/b.png"]
+    assert slideshow.slide_exists(a)
+    assert not slideshow.slide_exists(f"{pack_path}::/auto/gone.png")
+    assert not slideshow.slide_exists(f"{pack_path}.old::/auto/a.png")
+
+    source = slideshow.slide_source(a)
+
+    assert isinstance(source, slide_pack.PackMember)
+
+    with Image.open(source, formats=slideshow.slide_formats()) as image:
+        assert image.tobytes() == Image.open(photos / "auto/a.png").tobytes()
+
+    assert slideshow.slide_sha256(a) == hashlib.sha256(
+        (photos / "auto/a.png").read_bytes()
+    ).hexdigest()
+
+    with pytest.raises(FileNotFoundError):
+        slideshow.slide_source(f"{pack_path}::/auto/gone.png")
+
+    # 通常のファイルはパスのまま
+    plain = str(photos / "auto/a.png")
+
+    assert slideshow.slide_source(plain) == plain
+    assert slideshow.pack_metadata_entry(plain) is None
+
+
+def test_slideshow_uses_pack_metadata(photo_pack):
+    photos, pack_path = photo_pack
+    a = f"{pack_path}::/auto/a.png"
+
+    expected = {"capture_date": "2024:01:02 03:04:05", "display_mode": "fit"}
+
+    assert slideshow.pack_metadata_entry(a) == expected
+
+    # metadata.json に無いスライドは索引の値を使い、あれば metadata.json が優先
+    assert slideshow.get_metadata_entry(a, {}) == expected
+    assert slideshow.get_metadata_entry(a, {"a.png": {"title": "A"}}) == {"title": "A"}
+
+    assert slideshow.get_capture_date(a, {}) == slideshow.parse_capture_date(
+        "2024:01:02 03:04:05"
+    )
+
+    # 撮影日もモードも無いスライドは None
+    append_to_pack(pack_path, make_sources(photos, ["auto/c.png"], seed=7))
+
+    assert slideshow.pack_metadata_entry(f"{pack_path}::/auto/c.png") is None
+
+
+def test_slideshow_reopens_appended_pack(photo_pack):
+    photos, pack_path = photo_pack
+    a = f"{pack_path}::/auto/a.png"
+
+    first = slideshow.current_slide_pack()
+    version = slideshow.slide_version(a)
+
+    append_to_pack(pack_path, make_sources(photos, ["auto/a.png"], seed=20))
+
+    assert slideshow.current_slide_pack() is not first
+    assert slideshow.slide_version(a) != version
+    assert slideshow.slide_sha256(a) == hashlib.sha256(
+        (photos / "auto/a.png").read_bytes()
+    ).hexdigest()
+
+    # 開けなくなったら、同じパックの前の内容を使い続ける
+    reopened = slideshow.current_slide_pack()
+
+    broken = pack_path.with_name("broken.pack")
+    broken.write_bytes(b"\0" * 100)
+    broken.replace(pack_path)
+
+    assert slideshow.current_slide_pack() is reopened
+
+
+def test_slideshow_rejects_corrupt_slide(photo_pack):
+    photos, pack_path = photo_pack
+
+    entry = SlidePack(pack_path).entry("auto/b.png")
+    flip_byte(pack_path, entry.offset + entry.length - 20)
+
+    with pytest.raises(PackError, match="crc32 mismatch"):
+        slideshow.slide_source(f"{pack_path}::/auto/b.png")
+
+    slideshow.slide_source(f"{pack_path}::/auto/a.png").close()
@@ -0,0 +1,937 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+import panel_driver
+import slideshow
+
+
+PANEL_REMAP = np.frombuffer(panel_driver.PANEL_REMAP, dtype=np.uint8)
+
+
+@pytest.fixture(autouse=True)
+def plain_logger(monkeypatch):
+    # logger は main() の setup_logging() で作られるので、テストでは素の logger を使う
+    monkeypatch.setattr(slideshow, "logger", logging.getLogger("slideshow"))
+
+
+class FakeClock:
+    """datetime.now の代わり。advance() で進める。"""
+
+    def __init__(self, start):
+        self.current = start
+
+    def __call__(self):
+        return self.current
+
+    def advance(self, seconds):
+        self.current += timedelta(seconds=seconds)
+
+
+class FakeThrottled:
+    """vcgencmd get_throttled の代わり。values を順に返す。"""
+
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+
+        if len(self.values) > 1:
+            return self.values.pop(0)
+
+        return self.values[0]
+
+
+# ============================================================
+# Refresh scheduler
+# ============================================================
+
+def make_scheduler(clock, throttled, tmp_path, **kwargs):
+    return slideshow.RefreshScheduler(
+        budget_file=tmp_path / "budget.json",
+        read_throttled=throttled,
+        now=clock,
+        **kwargs,
+    )
+
+
+def test_quiet_hours_defer_until_window_end(tmp_path):
+    clock = FakeClock(datetime(2026, 5, 1, 23, 30, 15))
+    throttled = FakeThrottled(0)
+    scheduler = make_scheduler(
+        clock,
+        throttled,
+        tmp_path,
+        quiet_hours=slideshow.parse_quiet_hours("23:00-06:30"),
+    )
+
+    decision = scheduler.check()
+
+    assert not decision.allowed
+    assert decision.reason == "quiet hours"
+    assert decision.delay == 7 * 3600 - 15
+    # 静音時間帯は vcgencmd を呼ぶ前に決まる
+    assert throttled.calls == 0
+
+    # 手動リフレッシュは静音時間帯を無視する
+    assert scheduler.check(manual=True).allowed
+
+    clock.advance(decision.delay)
+
+    assert scheduler.check().allowed
+
+
+def test_daily_budget_defers_until_midnight(tmp_path):
+    clock = FakeClock(datetime(2026, 5, 1, 18, 0, 0))
+    scheduler = make_scheduler(
+        clock,
+        FakeThrottled(0),
+        tmp_path,
+        daily_budget=2,
+    )
+
+    for _ in range(2):
+        assert scheduler.check().allowed
+        scheduler.record_refresh()
+
+    decision = scheduler.check()
+
+    assert not decision.allowed
+    assert decision.delay == 6 * 3600
+
+    # 回数は budget_file に残り、再起動後も数え続ける
+    restarted = make_scheduler(
+        clock,
+        FakeThrottled(0),
+        tmp_path,
+        daily_budget=2,
+    )
+    assert not restarted.check().allowed
+
+    clock.advance(decision.delay)
+
+    assert restarted.check().allowed
+
+
+def test_under_voltage_backs_off_exponentially(tmp_path):
+    clock = FakeClock(datetime(2026, 5, 1, 12, 0, 0))
+    throttled = FakeThrottled(0x50005, 0x50005, 0x50005, 0x50005, 0x50000)
+    scheduler = make_scheduler(
+        clock,
+        throttled,
+        tmp_path,
+        backoff_seconds=60,
+        backoff_max_seconds=200,
+    )
+
+    delays = [scheduler.check(manual=True).delay for _ in range(4)]
+
+    assert delays == [60, 120, 200, 200]
+
+    # 電圧が戻ればバックオフはリセットされる
+    assert scheduler.check().allowed
+    assert scheduler.deferrals == 0
+
+
+def test_power_guard_off_skips_vcgencmd(tmp_path):
+    throttled = FakeThrottled(0x1)
+    scheduler = make_scheduler(
+        FakeClock(datetime(2026, 5, 1, 12, 0, 0)),
+        throttled,
+        tmp_path,
+        power_guard=False,
+    )
+
+    assert scheduler.check().allowed
+    assert throttled.calls == 0
+
+
+# ============================================================
+# Waiting between slides
+# ============================================================
+
+def test_long_wait_keeps_heartbeat_fresh(monkeypatch):
+    monkeypatch.setattr(slideshow, "HEARTBEAT_REFRESH_SECONDS", 0.05)
+
+    heartbeats = []
+
+    async def run():
+        runtime = SimpleNamespace(
+            loop=asyncio.get_running_loop(),
+            next_event=asyncio.Event(),
+            wake_event=asyncio.Event(),
+            notifier=SimpleNamespace(status=lambda text: None),
+            stages=SimpleNamespace(
+                heartbeat=lambda: heartbeats.append(True)
+            ),
+            shown=0,
+            counter=1,
+        )
+
+        await slideshow.SlideshowRuntime.wait_for_next(runtime, 0.3)
+
+    asyncio.run(run())
+
+    # 0.3 秒の待ちを 0.05 秒ごとに区切って書き直す
+    assert len(heartbeats) >= 4
+
+
+def test_button_a_presses_during_refresh_coalesce(monkeypatch):
+    monkeypatch.setattr(slideshow, "slide_exists", lambda path: True)
+    monkeypatch.setattr(slideshow, "save_state", lambda queue, total: None)
+
+    shown = []
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        refreshing = asyncio.Event()
+        release = asyncio.Event()
+
+        runtime = slideshow.SlideshowRuntime.__new__(
+            slideshow.SlideshowRuntime
+        )
+        runtime.__dict__.update(
+            loop=loop,
+            queue=[f"s{i}.png" for i in range(1, 7)],
+            current_images=[],
+            counter=0,
+            shown=0,
+            button_events=asyncio.Queue(),
+            next_event=asyncio.Event(),
+            wake_event=asyncio.Event(),
+            notifier=SimpleNamespace(status=lambda text: None),
+            stages=SimpleNamespace(heartbeat=lambda: None),
+            a_presses=0,
+            a_first_pressed_at=None,
+            pressed_at=None,
+        )
+
+        async def no_resume():
+            pass
+
+        async def show_slide(image_path):
+            # 1枚目はパネルのリフレッシュ中のまま止めておく
+            shown.append(image_path)
+            refreshing.set()
+
+            if len(shown) == 1:
+                await release.wait()
+
+            return 3600
+
+        runtime.resume_from_record = no_resume
+        runtime.show_slide = show_slide
+
+        buttons = asyncio.create_task(runtime.button_task())
+        slides = asyncio.create_task(runtime.slide_task())
+
+        await refreshing.wait()
+
+        for at in (1.0, 1.2, 1.4):
+            runtime.post_button_event("A", "pressed", at)
+
+        await asyncio.sleep(0.05)
+
+        assert runtime.a_presses == 3
+        assert shown == ["s1.png"]
+
+        release.set()
+        await asyncio.sleep(0.05)
+
+        # 3回の押下で2枚を描画せずに飛ばし、リフレッシュは1回だけ
+        assert shown == ["s1.png", "s4.png"]
+        assert runtime.queue == ["s5.png", "s6.png"]
+        assert runtime.a_presses == 0
+        assert runtime.a_first_pressed_at is None
+        assert runtime.pressed_at == 1.0
+        assert not runtime.next_event.is_set()
+
+        buttons.cancel()
+        slides.cancel()
+
+    asyncio.run(run())
+
+
+def test_heartbeat_interval_is_below_watchdog_threshold():
+    import watch_slideshow_heartbeat
+
+    assert (
+        slideshow.HEARTBEAT_REFRESH_SECONDS * 2
+        < watch_slideshow_heartbeat.THRESHOLD_SECONDS
+    )
+
+
+# ============================================================
+# Startup resume
+# ============================================================
+
+RESUME_SIZE = (1600, 1200)
+RESUME_NOW = 1_700_000_000.0
+
+
+@pytest.fixture
+def resume_record(tmp_path):
+    """600 秒前に表示して、締め切りまであと 1200 秒の記録。"""
+    slide = tmp_path / "slide.png"
+    slide.write_bytes(b"slide")
+
+    return {
+        "path": str(slide),
+        "source_sha256": slideshow.file_sha256(slide),
+        "frame_sha256": "0" * 64,
+        "size": list(RESUME_SIZE),
+        "shown_at": RESUME_NOW - 600,
+        "deadline": RESUME_NOW + 1200,
+    }
+
+
+@pytest.mark.parametrize(
+    ("change", "interval", "expected"),
+    [
+        ({}, 1800, 1200),
+        ({"pending": "slide.png"}, 1800, None),
+        ({"path": "/nonexistent/slide.png"}, 1800, None),
+        ({"size": [1200, 1600]}, 1800, None),
+        ({"source_sha256": "f" * 64}, 1800, None),
+        ({"deadline": RESUME_NOW - 1}, 1800, None),
+        ({"deadline": RESUME_NOW}, 1800, None),
+        # 時計がずれて締め切りが遠い未来でも、INTERVAL_SECONDS より長くは待たない
+        ({"deadline": RESUME_NOW + 86400}, 1800, 1800),
+        ({}, 600, 600),
+    ],
+)
+def test_startup_resume_delay(resume_record, monkeypatch, change, interval, expected):
+    monkeypatch.setitem(slideshow.CONFIG, "INTERVAL_SECONDS", interval)
+
+    record = {**resume_record, **change}
+
+    assert slideshow.startup_resume_delay(
+        record,
+        RESUME_SIZE,
+        now=RESUME_NOW,
+    ) == expected
+
+
+@pytest.mark.parametrize("record", [None, {}])
+def test_startup_resume_delay_without_record(record):
+    assert slideshow.startup_resume_delay(record, RESUME_SIZE) is None
+
+
+def test_startup_resume_delay_sees_rewritten_slide(resume_record):
+    Path(resume_record["path"]).write_bytes(b"edited")
+
+    assert slideshow.startup_resume_delay(
+        resume_record,
+        RESUME_SIZE,
+        now=RESUME_NOW,
+    ) is None
+
+
+# ============================================================
+# Startup timeline
+# ============================================================
+
+def test_import_does_not_load_numpy(tmp_path):
+    env_file = tmp_path / "env"
+    env_file.write_text("")
+
+    child = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, slideshow; print('numpy' in sys.modules)",
+        ],
+        env=dict(
+            os.environ,
+            PYTHONPATH=str(Path(slideshow.__file__).parent),
+            HOME=str(tmp_path / "home"),
+            SLIDESHOW_ENV_FILE=str(env_file),
+        ),
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+
+    assert child.stdout.strip() == "False", child.stderr
+
+
+def test_background_import_is_noted_in_imports_phase(caplog):
+    startup = slideshow.StartupTimeline(time.perf_counter())
+    startup.mark("imports")
+
+    slideshow.preload_module("numpy", startup).join()
+    slideshow.preload_module("no_such_module_for_test", startup).join()
+
+    startup.mark("config")
+
+    with caplog.at_level(logging.INFO, logger="slideshow"):
+        startup.report()
+
+    [line] = [r.message for r in caplog.records if "Startup timeline" in r.message]
+
+    assert re.search(r"imports \d+\.\d\ds \(numpy \d+\.\d\ds in background\), config", line)
+    assert "no_such_module" not in line
+
+
+# ============================================================
+# Stage watchdog
+# ============================================================
+
+class FakeMonotonic:
+    """time.monotonic の代わり。advance() で進める。"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def stage_tracker(tmp_path, monkeypatch):
+    monkeypatch.setattr(slideshow, "HEARTBEAT_PATH", tmp_path / "heartbeat")
+
+    clock = FakeMonotonic()
+    timeouts = []
+
+    def make(**kwargs):
+        return slideshow.StageTracker(
+            history_file=tmp_path / "stage_history.json",
+            clock=clock,
+            on_timeout=lambda *overdue: timeouts.append(overdue),
+            **kwargs,
+        )
+
+    return make, clock, timeouts
+
+
+def run_stage(tracker, clock, stage, seconds):
+    with tracker.track(stage, "slide.png"):
+        clock.advance(seconds)
+
+
+def test_stage_timeout_learns_from_history(stage_tracker):
+    make, clock, timeouts = stage_tracker
+    tracker = make(factor=4.0, min_seconds=30.0)
+
+    # 履歴がたまるまでは既定値
+    for _ in range(slideshow.STAGE_HISTORY_MIN_SAMPLES - 1):
+        run_stage(tracker, clock, "show", 40.0)
+
+    assert tracker.timeout_for("show") == slideshow.DEFAULT_STAGE_TIMEOUTS["show"]
+
+    run_stage(tracker, clock, "show", 45.0)
+
+    assert tracker.timeout_for("show") == 45.0 * 4.0
+
+    # 速い段は min_seconds を下回らない
+    for _ in range(slideshow.STAGE_HISTORY_MIN_SAMPLES):
+        run_stage(tracker, clock, "decode", 1.5)
+
+    assert tracker.timeout_for("decode") == 30.0
+
+
+def test_failed_stage_is_not_learned(stage_tracker):
+    make, clock, timeouts = stage_tracker
+    tracker = make()
+
+    with pytest.raises(RuntimeError):
+        with tracker.track("decode"):
+            clock.advance(500.0)
+            raise RuntimeError("decode failed")
+
+    assert list(tracker.history["decode"]) == []
+    assert tracker.overdue() is None
+
+
+def test_overdue_stage_calls_on_timeout(stage_tracker):
+    make, clock, timeouts = stage_tracker
+    tracker = make(factor=4.0, min_seconds=30.0)
+
+    for _ in range(slideshow.STAGE_HISTORY_MIN_SAMPLES):
+        run_stage(tracker, clock, "decode", 10.0)
+
+    with tracker.track("decode", "stuck.png"):
+        clock.advance(40.0)
+        assert not tracker.check()
+
+        clock.advance(0.5)
+        assert tracker.check()
+
+    assert timeouts == [("decode", 40.5, 40.0, "stuck.png")]
+
+    # 段の外（idle）では何もしない
+    clock.advance(1000.0)
+    assert not tracker.check()
+
+
+def test_supervised_stage_is_exempt(stage_tracker):
+    make, clock, timeouts = stage_tracker
+    tracker = make()
+    tracker.supervised.add("show")
+
+    with tracker.track("show"):
+        clock.advance(10_000.0)
+        assert tracker.overdue() is None
+        assert not tracker.check()
+
+    # 時間は記録する
+    assert list(tracker.history["show"]) == [10_000.0]
+    assert timeouts == []
+
+
+def test_stage_history_persists(stage_tracker):
+    make, clock, timeouts = stage_tracker
+    tracker = make(factor=3.0, min_seconds=1.0)
+
+    for seconds in (2.0, 5.0, 3.0, 4.0, 1.0):
+        run_stage(tracker, clock, "overlay", seconds)
+
+    tracker.save_history()
+
+    restarted = make(factor=3.0, min_seconds=1.0)
+
+    assert list(restarted.history["overlay"]) == [2.0, 5.0, 3.0, 4.0, 1.0]
+    assert restarted.timeout_for("overlay") == 15.0
+
+
+def test_corrupt_stage_history_is_ignored(stage_tracker, tmp_path):
+    make, clock, timeouts = stage_tracker
+    (tmp_path / "stage_history.json").write_text("{not json")
+
+    tracker = make()
+
+    assert tracker.timeout_for("show") == slideshow.DEFAULT_STAGE_TIMEOUTS["show"]
+
+
+STAGE_TIMEOUT_CHILD = """
+import json
+import logging
+import sys
+from pathlib import Path
+
+import slideshow
+
+slideshow.logger = logging.getLogger("slideshow")
+slideshow.HEARTBEAT_PATH = Path(sys.argv[1])
+
+now = [0.0]
+
+tracker = slideshow.StageTracker(
+    history_file=Path(sys.argv[2]),
+    clock=lambda: now[0],
+)
+
+with tracker.track("show", "stuck.png"):
+    now[0] += slideshow.DEFAULT_STAGE_TIMEOUTS["show"] + 1
+    tracker.check()
+
+sys.exit(0)
+"""
+
+
+def test_stage_timeout_exits_with_tempfail(tmp_path):
+    script = tmp_path / "child.py"
+    script.write_text(STAGE_TIMEOUT_CHILD)
+
+    heartbeat = tmp_path / "heartbeat"
+
+    env_file = tmp_path / "env"
+    env_file.write_text("")
+
+    child = subprocess.run(
+        [
+            sys.executable,
+            str(script),
+            str(heartbeat),
+            str(tmp_path / "stage_history.json"),
+        ],
+        env=dict(
+            os.environ,
+            PYTHONPATH=str(Path(slideshow.__file__).parent),
+            HOME=str(tmp_path / "home"),
+            SLIDESHOW_ENV_FILE=str(env_file),
+        ),
+        capture_output=True,
+        timeout=60,
+    )
+
+    assert child.returncode == slideshow.EXIT_STAGE_TIMEOUT
+    assert b"Stage 'show' stuck" in child.stderr
+
+    details = json.loads(heartbeat.read_text())
+    assert details["timed_out"] == "show"
+    assert details["slide"] == "stuck.png"
+
+
+# ============================================================
+# Frame buffer
+# ============================================================
+
+FRAME_SIZE = (1600, 1200)
+
+
+class FakeEL133UF1:
+    """inky_el133uf1 の代わり。buf への直接書き込みの対象になる。"""
+
+    __module__ = "inky.inky_el133uf1"
+
+    width, height = FRAME_SIZE
+
+    def __init__(self):
+        self.buf = np.zeros((self.height, self.width), dtype=np.uint8)
+
+
+@pytest.fixture
+def panel_png(tmp_path):
+    indices = np.random.default_rng(0).integers(
+        0,
+        6,
+        size=(FRAME_SIZE[1], FRAME_SIZE[0]),
+        dtype=np.uint8,
+    )
+
+    img = Image.fromarray(indices, "P")
+    img.putpalette(slideshow.PANEL_PALETTE_BYTES)
+
+    path = tmp_path / "slide.png"
+    img.save(path)
+
+    return path, indices
+
+
+def test_installed_pillow_decodes_into_frame(panel_png, monkeypatch):
+    # Pillow を上げて内部が変わったら、黙って遅い経路になる前にここで落とす
+    assert slideshow.pillow_supports_direct_frame(), (
+        f"Pillow {Image.__version__} is outside "
+        f"PILLOW_DIRECT_FRAME_VERSIONS; re-check FrameBuffer and widen it"
+    )
+
+    path, indices = panel_png
+    frame = slideshow.FrameBuffer(FRAME_SIZE)
+
+    assert frame.shared
+
+    def no_paste(*args, **kwargs):
+        raise AssertionError("decoded into a separate image")
+
+    monkeypatch.setattr(frame.image, "paste", no_paste)
+
+    assert frame.load(path)
+    assert np.array_equal(frame.array, indices)
+
+    # オーバーレイも同じメモリに描かれる
+    ImageDraw.Draw(frame.image).rectangle((0, 0, 9, 9), fill=3)
+
+    assert (frame.array[:10, :10] == 3).all()
+
+
+def test_frame_fallback_matches_direct_path(panel_png):
+    path, indices = panel_png
+    display = FakeEL133UF1()
+    frame = slideshow.FrameBuffer(FRAME_SIZE, direct=False)
+
+    assert not frame.shared
+    assert frame.load(path)
+
+    ImageDraw.Draw(frame.image).rectangle((0, 0, 9, 9), fill=3)
+
+    assert frame.write_to_panel(display) == "direct"
+
+    expected = indices.copy()
+    expected[:10, :10] = 3
+
+    assert np.array_equal(frame.array, expected)
+    assert np.array_equal(display.buf, PANEL_REMAP[expected])
+
+
+def test_frame_peak_stays_within_budget(panel_png):
+    path, indices = panel_png
+    display = FakeEL133UF1()
+    frame = slideshow.FrameBuffer(FRAME_SIZE)
+
+    # 1枚目はデコーダの初期化などを含むので数えない（実行時と同じ）
+    frame.load(path)
+    frame.write_to_panel(display)
+
+    if not slideshow.reset_peak_rss():
+        pytest.skip("/proc/self/clear_refs is not writable")
+
+    base_kb = slideshow.read_proc_status_kb("VmRSS")
+
+    assert frame.load(path)
+    assert frame.write_to_panel(display) == "direct"
+
+    peak_mb = (slideshow.read_proc_status_kb("VmHWM") - base_kb) / 1024
+
+    assert np.array_equal(display.buf, PANEL_REMAP[indices])
+    assert peak_mb <= slideshow.CONFIG["FRAME_PEAK_BUDGET_MB"]
+
+
+def test_png_only_rejects_other_formats(tmp_path, monkeypatch):
+    monkeypatch.setitem(slideshow.CONFIG, "PNG_ONLY", True)
+
+    path = tmp_path / "slide.gif"
+    Image.new("P", FRAME_SIZE).save(path)
+
+    frame = slideshow.FrameBuffer(FRAME_SIZE)
+
+    with pytest.raises(Image.UnidentifiedImageError):
+        frame.load(path)
+
+    monkeypatch.setitem(slideshow.CONFIG, "PNG_ONLY", False)
+
+    # PNG_ONLY=0 なら開けて、6色パレットではないので set_image() 側に回る
+    assert frame.load(path) is False
+
+
+# ============================================================
+# Memory monitor
+# ============================================================
+
+def rss_series(kind, count=40, base=100.0):
+    """1枚ごとの RSS (MB) の系列。デコード中のピークを模した揺れを含む。"""
+    series = []
+
+    for i in range(count):
+        peak = 30.0 if i % 5 == 2 else 0.0
+
+        if kind == "rising":
+            series.append(base + i * 0.5 + peak)
+        elif kind == "flat":
+            series.append(base + (i % 3) * 0.2 + peak)
+        elif kind == "sawtooth":
+            # 10枚ごとにキャッシュが育っては解放される
+            series.append(base + (i % 10) * 2.0 + peak)
+        elif kind == "slow":
+            series.append(base + i * 0.05 + peak)
+
+    return series
+
+
+@pytest.mark.parametrize(
+    ("kind", "growing"),
+    [
+        ("rising", True),
+        ("flat", False),
+        ("sawtooth", False),
+        ("slow", False),
+    ],
+)
+def test_monotonic_growth_verdicts(kind, growing):
+    assert slideshow.is_monotonic_growth(rss_series(kind), 8.0) is growing
+
+
+def test_monotonic_growth_needs_enough_samples():
+    assert not slideshow.is_monotonic_growth([100.0, 200.0, 300.0, 400.0], 8.0)
+
+
+def test_memory_monitor_flags_growth_once(tmp_path, monkeypatch, caplog):
+    samples = iter([100.0] + rss_series("flat") + rss_series("rising", base=101.0))
+    monkeypatch.setattr(slideshow, "read_rss_mb", lambda: next(samples))
+
+    report_file = tmp_path / "memory.json"
+
+    monitor = slideshow.MemoryMonitor(
+        snapshot_every=1000,
+        window=40,
+        growth_mb=8.0,
+        report_file=report_file,
+    )
+
+    try:
+        with caplog.at_level(logging.WARNING, logger="slideshow"):
+            flags = []
+
+            for _ in range(80):
+                monitor.record_slide()
+                flags.append(monitor.growth_flagged)
+
+    finally:
+        import tracemalloc
+
+        tracemalloc.stop()
+
+    # 平らな窓では黙っていて、窓が増加分で埋まってから警告する
+    assert not any(flags[:40])
+    assert flags[-1]
+    assert len(
+        [r for r in caplog.records if "grew monotonically" in r.message]
+    ) == 1
+
+    report = json.loads(report_file.read_text())
+    assert report["monotonic_growth"] is True
+    assert report["slides"] == 80
+
+
+# ============================================================
+# systemd notify
+# ============================================================
+
+@pytest.fixture
+def notify_socket():
+    """systemd の代わりに NOTIFY_SOCKET を受ける abstract socket。"""
+    name = f"inky-notify-test-{os.getpid()}-{time.monotonic_ns()}"
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind("\0" + name)
+    sock.settimeout(10)
+
+    yield "@" + name, sock
+
+    sock.close()
+
+
+def receive_until(sock, field, messages):
+    """field を含むメッセージが来るまで受け取り、messages に足していく。"""
+    while True:
+        message = sock.recv(4096).decode("utf-8")
+        messages.append(message)
+
+        if field in message.split("\n"):
+            return message
+
+
+def test_notifier_sends_sd_notify_fields(notify_socket):
+    address, sock = notify_socket
+
+    notifier = slideshow.SystemdNotifier(
+        environ={
+            "NOTIFY_SOCKET": address,
+            "WATCHDOG_USEC": "2000000",
+        },
+    )
+
+    assert notifier.enabled
+    assert notifier.watchdog_seconds == 2.0
+
+    assert notifier.ready("Display ready")
+    assert sock.recv(4096) == b"READY=1\nSTATUS=Display ready"
+
+    assert notifier.status("Waiting")
+    # 同じ STATUS は送り直さない
+    assert not notifier.status("Waiting")
+
+    assert notifier.ping()
+    assert notifier.stopping()
+
+    assert [sock.recv(4096) for _ in range(3)] == [
+        b"STATUS=Waiting",
+        b"WATCHDOG=1",
+        b"STOPPING=1",
+    ]
+
+
+def test_notifier_is_silent_outside_systemd():
+    notifier = slideshow.SystemdNotifier(environ={})
+
+    assert not notifier.enabled
+    assert notifier.watchdog_seconds is None
+    assert not notifier.ready("Display ready")
+
+
+SLIDESHOW_CHILD = """
+import sys
+
+import numpy as np
+
+import slideshow
+
+
+class Inky:
+    __module__ = "inky.inky_el133uf1"
+
+    width, height = 1600, 1200
+
+    def __init__(self):
+        self.buf = np.zeros((self.height, self.width), dtype=np.uint8)
+
+    def set_image(self, img):
+        pass
+
+    def show(self):
+        pass
+
+
+slideshow.HEARTBEAT_PATH = slideshow.Path(sys.argv[1])
+slideshow.initialize_display = Inky
+slideshow.setup_buttons = lambda events: []
+slideshow.main()
+"""
+
+
+def test_sigterm_sends_stopping(tmp_path, notify_socket, panel_png):
+    address, sock = notify_socket
+
+    script = tmp_path / "child.py"
+    script.write_text(SLIDESHOW_CHILD)
+
+    env_file = tmp_path / "env"
+    env_file.write_text("")
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=str(Path(slideshow.__file__).parent),
+        HOME=str(tmp_path / "home"),
+        SLIDESHOW_ENV_FILE=str(env_file),
+        PHOTO_DIR=str(panel_png[0].parent),
+        METADATA_FILE=str(tmp_path / "metadata.json"),
+        INTERVAL_SECONDS="600",
+        POWER_GUARD="0",
+        DISPLAY_WORKER="0",
+        NOTIFY_SOCKET=address,
+        WATCHDOG_USEC="200000",
+    )
+
+    child = subprocess.Popen(
+        [sys.executable, str(script), str(tmp_path / "heartbeat")],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+
+    messages = []
+
+    try:
+        receive_until(sock, "READY=1", messages)
+        receive_until(sock, "WATCHDOG=1", messages)
+
+        # 1枚目を表示し終えて待ちに入ってから止める
+        while not any(
+            message.startswith("STATUS=Waiting")
+            for message in messages
+        ):
+            receive_until(sock, "WATCHDOG=1", messages)
+
+        child.send_signal(signal.SIGTERM)
+
+        receive_until(sock, "STOPPING=1", messages)
+
+        assert child.wait(timeout=10) == 0
+
+    finally:
+        if child.poll() is None:
+            child.kill()
+
+        stderr = child.communicate()[1].decode("utf-8", "replace")
+
+    assert "SIGTERM received; shutting down" in stderr
@@ -0,0 +1,214 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+import pytest
+
+import slideshow
+import sync_receiver as sr
+
+
+TOKEN = "test-token"
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """Pi 側の PHOTO_DIR と、~/.cache の代わりの置き場所。"""
+    monkeypatch.setattr(sr, "INDEX_FILE", tmp_path / "cache" / "index.json")
+    monkeypatch.setattr(
+        slideshow,
+        "LIBRARY_CHANGES_FILE",
+        tmp_path / "cache" / "changes.jsonl",
+    )
+    monkeypatch.setitem(sr.CONFIG, "DELETE", 1)
+
+    root = tmp_path / "pi" / "photos"
+    root.mkdir(parents=True)
+
+    return root, root / "metadata.json"
+
+
+@pytest.fixture
+def receiver(library):
+    """空いているポートで受け手を動かし、URL を返す。"""
+    root, metadata_file = library
+
+    server = sr.create_server(root, metadata_file, "127.0.0.1", 0, TOKEN)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def write_files(directory, files):
+    for name, data in files.items():
+        path = Path(directory) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+
+def read_tree(root):
+    return {name: path.read_bytes() for name, path in sr.list_slides(root)}
+
+
+def read_changes():
+    return slideshow.read_library_changes()
+
+
+# ============================================================
+# Delta sync
+# ============================================================
+
+def test_send_adds_changes_and_removes(tmp_path, library, receiver):
+    root, metadata_file = library
+    mac = tmp_path / "mac" / "photos"
+
+    write_files(
+        mac,
+        {
+            "auto/a.png": b"a1",
+            "auto/b.png": b"b1",
+            "metadata.json": b'{"auto/a.png": {"title": "A"}}',
+        },
+    )
+
+    result = sr.send_library(receiver, mac, mac / "metadata.json", TOKEN)
+
+    assert (result["seq"], result["added"], result["metadata"]) == (1, 2, True)
+    assert read_tree(root) == read_tree(mac)
+    assert metadata_file.read_bytes() == (mac / "metadata.json").read_bytes()
+
+    write_files(mac, {"auto/a.png": b"a2", "auto/c.png": b"c1"})
+    (mac / "auto" / "b.png").unlink()
+
+    result = sr.send_library(receiver, mac, mac / "metadata.json", TOKEN)
+
+    assert (
+        result["seq"],
+        result["added"],
+        result["changed"],
+        result["removed"],
+        result["metadata"],
+    ) == (2, 1, 1, 1, False)
+    assert result["sent_files"] == 2
+    assert read_tree(root) == read_tree(mac)
+
+    base = root.resolve()
+    assert read_changes()[-1]["added"] == [str(base / "auto/c.png")]
+    assert read_changes()[-1]["changed"] == [str(base / "auto/a.png")]
+    assert read_changes()[-1]["removed"] == [str(base / "auto/b.png")]
+
+    # 何も変わっていなければ何も送らず、変更記録も増えない
+    result = sr.send_library(receiver, mac, mac / "metadata.json", TOKEN)
+
+    assert (result["seq"], result["sent_files"], result["sent_bytes"]) == (None, 0, 0)
+    assert len(read_changes()) == 2
+
+
+def test_send_keeps_missing_files_unless_delete(tmp_path, library, receiver, monkeypatch):
+    monkeypatch.setitem(sr.CONFIG, "DELETE", 0)
+
+    root, metadata_file = library
+    write_files(root, {"auto/old.png": b"old"})
+
+    mac = tmp_path / "mac" / "photos"
+    write_files(mac, {"auto/new.png": b"new"})
+
+    result = sr.send_library(receiver, mac, None, TOKEN)
+
+    assert (result["added"], result["removed"]) == (1, 0)
+    assert read_tree(root) == {"auto/new.png": b"new", "auto/old.png": b"old"}
+
+
+def test_manifest_from_another_level_is_rejected(tmp_path, library, receiver):
+    # PHOTO_DIR="photos/" に photos/auto を送ると、名前が auto/ の分ずれる
+    root, metadata_file = library
+    write_files(root, {"auto/a.png": b"a1", "auto/b.png": b"b1"})
+
+    mac = tmp_path / "mac" / "photos"
+    write_files(mac, {"auto/a.png": b"a1", "auto/b.png": b"b1"})
+
+    with pytest.raises(sr.SyncError) as excinfo:
+        sr.send_library(receiver, mac / "auto", None, TOKEN)
+
+    assert excinfo.value.status == 409
+    assert read_tree(root) == {"auto/a.png": b"a1", "auto/b.png": b"b1"}
+    assert read_changes() == []
+
+
+def test_wrong_token_is_rejected(tmp_path, library, receiver):
+    mac = tmp_path / "mac" / "photos"
+    write_files(mac, {"a.png": b"a1"})
+
+    with pytest.raises(sr.SyncError) as excinfo:
+        sr.send_library(receiver, mac, None, "wrong")
+
+    assert excinfo.value.status == 401
+    assert read_tree(library[0]) == {}
+
+
+# ============================================================
+# Recovery
+# ============================================================
+
+def test_interrupted_commit_is_replayed(tmp_path, library, receiver, monkeypatch):
+    root, metadata_file = library
+    write_files(root, {"auto/gone.png": b"gone"})
+
+    mac = tmp_path / "mac" / "photos"
+    write_files(
+        mac,
+        {
+            "auto/a.png": b"a1",
+            "auto/b.png": b"b1",
+            "metadata.json": b"{}",
+        },
+    )
+
+    def power_lost(staging, root, metadata_file, plan):
+        # 1枚目を rename したところで止まる
+        name = plan["files"][0]
+        os.replace(staging / "files" / name, Path(root) / name)
+        raise OSError("power lost")
+
+    with monkeypatch.context() as m:
+        m.setattr(sr, "apply_commit", power_lost)
+
+        with pytest.raises(sr.SyncError) as excinfo:
+            sr.send_library(receiver, mac, mac / "metadata.json", TOKEN)
+
+    assert excinfo.value.status == 500
+    assert read_tree(root) == {"auto/a.png": b"a1", "auto/gone.png": b"gone"}
+
+    [staging] = root.parent.glob(sr.STAGING_PREFIX + "*")
+    plan = json.loads((staging / "commit.json").read_text())
+    assert plan["removed"] == ["auto/gone.png"]
+
+    # 次の起動時と同じく、commit.json の手順を最後までやり直す
+    sr.recover_staging(root, metadata_file)
+
+    assert read_tree(root) == {"auto/a.png": b"a1", "auto/b.png": b"b1"}
+    assert metadata_file.read_bytes() == b"{}"
+    assert not staging.exists()
+
+    base = root.resolve()
+    [entry] = read_changes()
+    assert entry["added"] == [str(base / "auto/a.png"), str(base / "auto/b.png")]
+    assert entry["removed"] == [str(base / "auto/gone.png")]
+
+
+def test_upload_without_commit_is_discarded(library):
+    root, metadata_file = library
+    staging = root.parent / f"{sr.STAGING_PREFIX}0123456789abcdef"
+    write_files(staging / "files", {"auto/a.png": b"a1"})
+
+    sr.recover_staging(root, metadata_file)
+
+    assert not staging.exists()
+    assert read_tree(root) == {}
+    assert read_changes() == []
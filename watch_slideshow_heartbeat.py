@@ -42,7 +42,7 @@ def is_service_active():
     except Exception:
         return False
 
-def restart_service():
+def restart_service(log=log):
     log(f"{SERVICE_NAME} を再起動します...")
     try:
         subprocess.run(
@@ -53,24 +53,34 @@ def restart_service():
     except Exception as e:
         log(f"service restart 失敗: {e}")
 
-def main():
+def check_heartbeat(log=log):
+    """
+    1回分のチェック。supervisor.py からも呼ばれる（log を差し替える）。
+
+    返り値: ハートビートの経過秒数（ファイルがなければ None）
+    """
     age = get_heartbeat_age()
     if age is None:
         log("ハートビートファイルが存在しません。初回起動中か、まだ slideshow が動いていない可能性。何もしません。")
-        return
+        return None
 
     log(f"ハートビートの経過秒数: {age:.1f} 秒")
 
     if age < THRESHOLD_SECONDS:
         log("ハートビートは正常な範囲内です。何もしません。")
-        return
+        return age
 
     # しきい値を超えていて、かつサービスが active なら再起動を試みる
     if is_service_active():
         log("ハートビートがしきい値を超え、サービスは active のため、ハングの可能性があります。")
-        restart_service()
+        restart_service(log)
     else:
         log("サービスが active ではありません。systemd 側で何か操作された可能性があります。再起動は行いません。")
 
+    return age
+
+def main():
+    check_heartbeat()
+
 if __name__ == "__main__":
     main()